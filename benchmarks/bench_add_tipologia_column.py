@@ -0,0 +1,137 @@
+"""Confronta i tempi di add_tipologia_column con la vecchia implementazione riga
+per riga, su tutti i fogli dei file analisi di test.
+
+Uso:
+    python benchmarks/bench_add_tipologia_column.py [cartella_dati]
+
+Se non si specifica una cartella vengono usati i dati in tests/assets/cantieri_test.zip.
+"""
+
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+
+from pyconsolida.aggregations import find_all_files
+from pyconsolida.budget_reader_utils import (
+    add_tipologia_column,
+    compile_tipologie_skip,
+    crop_costi,
+)
+from pyconsolida.sheet_specs import EXCLUDED_FASI, HEADERS, TIPOLOGIA_IDX
+
+TEST_DATA = Path(__file__).parent.parent / "tests" / "assets" / "cantieri_test.zip"
+N_REPEATS = 3
+
+
+def _is_tipologia_header_loop(row, commessa, fase, tipologie_skip=None):
+    """Vecchia implementazione del controllo header, riga per riga."""
+    if type(row.iloc[1]) is not str:
+        return False
+
+    try:
+        int_commessa = int(commessa)
+    except ValueError:
+        int_commessa = int(commessa[:4])
+
+    if tipologie_skip is not None:
+        conditions_matched = sum(
+            (tipologie_skip["tipologia"] == row.iloc[1])
+            & (tipologie_skip["commessa"] == int_commessa)
+            & (tipologie_skip["fase"] == fase)
+        )
+        if conditions_matched:
+            return False
+
+    if type(row.iloc[2]) is str:
+        if row.iloc[2] != HEADERS["units"]:
+            return False
+    else:
+        if not np.isnan(row.iloc[2]):
+            return False
+
+    return True
+
+
+def add_tipologia_column_loop(df, commessa, fase, tipologie_skip=None):
+    """Vecchia implementazione di add_tipologia_column, riga per riga."""
+    df = df.copy()
+    df[HEADERS["tipologia"]] = ""
+
+    current_tipologia = ""
+    for row_i, row in enumerate(df.index):
+        if _is_tipologia_header_loop(
+            df.iloc[row_i, :], commessa, fase, tipologie_skip=tipologie_skip
+        ):
+            current_tipologia = df.iloc[row_i, TIPOLOGIA_IDX]
+
+        df.loc[row, HEADERS["tipologia"]] = current_tipologia
+
+    return df
+
+
+def load_sheets(data_folder):
+    """Legge e ritaglia tutti i fogli di tutti i file analisi."""
+    sheets = []
+    for folder in sorted(data_folder.glob("202[1-9]/*/*")):
+        if not folder.is_dir():
+            continue
+        for filename in find_all_files(folder):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                all_sheets = pd.read_excel(filename, sheet_name=None)
+            for fase, df in all_sheets.items():
+                if fase in EXCLUDED_FASI:
+                    continue
+                df_costi = crop_costi(df)
+                if df_costi is not None:
+                    sheets.append((df_costi, folder.name, fase))
+    return sheets
+
+
+def time_implementation(function, sheets, tipologie_skip):
+    timings = []
+    for _ in range(N_REPEATS):
+        start = time.perf_counter()
+        results = [
+            function(df, commessa, fase, tipologie_skip=tipologie_skip)
+            for df, commessa, fase in sheets
+        ]
+        timings.append(time.perf_counter() - start)
+    return min(timings), results
+
+
+def main(data_folder):
+    tipologie_skip = pd.read_excel(data_folder / "tipologie_skip.xlsx")
+    sheets = load_sheets(data_folder)
+    n_rows = sum(len(df) for df, _, _ in sheets)
+    print(f"{len(sheets)} fogli, {n_rows} righe")
+
+    t_loop, expected = time_implementation(
+        add_tipologia_column_loop, sheets, tipologie_skip
+    )
+    t_vect, results = time_implementation(
+        add_tipologia_column, sheets, compile_tipologie_skip(tipologie_skip)
+    )
+
+    for result, reference in zip(results, expected):
+        pd.testing.assert_frame_equal(result, reference)
+
+    print(f"riga per riga: {t_loop:.3f} s")
+    print(f"vettoriale:    {t_vect:.3f} s")
+    print(f"speedup:       {t_loop / t_vect:.1f}x")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(Path(sys.argv[1]))
+    else:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with ZipFile(TEST_DATA) as zip_file:
+                zip_file.extractall(temp_dir)
+            main(Path(temp_dir) / "Cantieri_test")
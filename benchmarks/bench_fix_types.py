@@ -0,0 +1,132 @@
+"""Confronta i tempi di fix_types e _get_valid_costo_rows con le vecchie
+implementazioni valore per valore, su un foglio sintetico di 50k righe.
+
+Uso:
+    python benchmarks/bench_fix_types.py [n_righe]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from pyconsolida.budget_reader import _get_valid_costo_rows
+from pyconsolida.budget_reader_utils import (
+    fix_codice_costo_alphanum,
+    fix_types,
+)
+from pyconsolida.sheet_specs import (
+    CODICE_COSTO_COL,
+    HEADERS,
+    SHEET_COL_SEQ,
+    TYPES_MAP,
+)
+
+N_ROWS = 50_000
+N_REPEATS = 3
+
+
+def _is_valid_costo_code_loop(val):
+    """Vecchia implementazione del controllo del codice costo."""
+    if isinstance(val, int):
+        return True
+    elif isinstance(val, str):
+        try:
+            int(val[:-1])
+            return True
+        except ValueError:
+            return False
+    return False
+
+
+def get_valid_costo_rows_loop(df):
+    """Vecchia implementazione di _get_valid_costo_rows, riga per riga."""
+    try:
+        max_n = np.nonzero(df.iloc[:, CODICE_COSTO_COL].values == "Totale costi")[0][0]
+    except IndexError:
+        max_n = len(df)
+    return [
+        _is_valid_costo_code_loop(cost_id) and i < max_n and i > 0
+        for i, cost_id in enumerate(df.iloc[:, CODICE_COSTO_COL])
+    ]
+
+
+def fix_types_loop(df):
+    """Vecchia implementazione di fix_types, valore per valore."""
+    for k, typ in TYPES_MAP.items():
+        if k == HEADERS["codice"]:
+            df.loc[:, k] = df.loc[:, k].apply(fix_codice_costo_alphanum)
+        if k == HEADERS["costo_unit"]:
+            df.loc[:, k] = df.loc[:, k].apply(
+                lambda x: (
+                    typ(x.replace(" ", "").replace(",", "."))
+                    if type(x) is str
+                    else typ(x)
+                )
+            )
+        else:
+            df.loc[:, k] = df.loc[:, k].astype(typ)
+
+
+def make_sheet(n_rows, seed=0):
+    """Foglio sintetico con codici e costi nei formati che si trovano nei file."""
+    rng = np.random.default_rng(seed)
+    codici = rng.integers(100, 99999, n_rows).astype(object)
+    with_letter = rng.random(n_rows) < 0.1
+    codici[with_letter] = [f"{c}a" for c in codici[with_letter]]
+
+    costi = np.round(rng.random(n_rows) * 1000, 2).astype(object)
+    as_text = rng.random(n_rows) < 0.2
+    costi[as_text] = [
+        f"{c:,.2f}".replace(",", " ").replace(".", ",") for c in costi[as_text]
+    ]
+
+    numbers = np.round(rng.random((n_rows, 4)) * 100, 3).astype(object)
+    df = pd.DataFrame(
+        {
+            HEADERS["codice"]: codici,
+            HEADERS["tipologia"]: "Personale",
+            HEADERS["voce"]: "voce di costo",
+            HEADERS["costo_unit"]: costi,
+            HEADERS["units"]: "h",
+            HEADERS["quantita"]: numbers[:, 0],
+            HEADERS["imp_unit"]: numbers[:, 1],
+            HEADERS["imp_comp"]: numbers[:, 2],
+        }
+    )[SHEET_COL_SEQ]
+
+    # Qualche riga non valida e la riga dei totali:
+    df.iloc[rng.integers(1, n_rows, n_rows // 100), CODICE_COSTO_COL] = "Personale"
+    df.iloc[n_rows - 10, CODICE_COSTO_COL] = "Totale costi"
+    return df
+
+
+def time_function(function, df):
+    timings = []
+    for _ in range(N_REPEATS):
+        df_copy = df.copy()
+        start = time.perf_counter()
+        result = function(df_copy)
+        timings.append(time.perf_counter() - start)
+    return min(timings), df_copy if result is None else result
+
+
+def main(n_rows):
+    df = make_sheet(n_rows)
+    print(f"Foglio sintetico di {len(df)} righe")
+
+    t_loop, expected = time_function(get_valid_costo_rows_loop, df)
+    t_vect, selection = time_function(_get_valid_costo_rows, df)
+    assert list(selection) == expected
+    print(f"_get_valid_costo_rows: {t_loop:.3f} s -> {t_vect:.3f} s")
+
+    voci_costo = df.iloc[selection, :].copy()
+    t_loop, expected = time_function(fix_types_loop, voci_costo)
+    t_vect, result = time_function(fix_types, voci_costo)
+    pd.testing.assert_frame_equal(result, expected)
+    print(f"fix_types:             {t_loop:.3f} s -> {t_vect:.3f} s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else N_ROWS)
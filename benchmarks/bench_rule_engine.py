@@ -0,0 +1,115 @@
+"""Confronta i tempi del match delle regole di correzione tipologie tra il vecchio
+doppio ciclo numba (_isinlist) e l'automa di rule_engine, su 50k voci sintetiche
+con un file di regole realistico e con 10 volte piu' regole; poi il tempo su un
+tabellone con le stesse voci ripetute in ogni mese, dove isinlist confronta solo le
+coppie voce/tipologia distinte.
+
+Uso:
+    python benchmarks/bench_rule_engine.py [n_righe]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from pyconsolida.posthoc_fix_utils import (
+    _isinlist,
+    format_check,
+    format_to_check,
+    isinlist,
+)
+
+N_ROWS = 50_000
+N_REPEATS = 3
+N_RULES = 40
+N_MONTHS = 24
+TIPOLOGIE = ["Materiali", "Noli", "Personale", "Subappalti", "Interno"]
+WORDS = [
+    "escavatore", "mini", "micro", "sabbia", "ghiaia", "lavata", "geometra", "gru",
+    "mobile", "cls", "ferro", "tondino", "operaio", "autocarro", "nolo", "trasporto",
+    "cemento", "rete", "casseri", "ponteggio", "tubo", "pvc", "bitume", "asfalto",
+]  # fmt: skip
+
+
+def make_rules(n_rules, seed=0):
+    """Regole sintetiche, con frammenti da contenere ed esclusioni multiple."""
+    rng = np.random.default_rng(seed)
+    words = np.array(WORDS + [f"{w}{i}" for w in WORDS for i in range(n_rules // 20)])
+    exclusions = [
+        (
+            ";".join(rng.choice(words, rng.integers(1, 4)))
+            if rng.random() < 0.5
+            else np.nan
+        )
+        for _ in range(n_rules)
+    ]
+    return pd.DataFrame(
+        {
+            "da": rng.choice(TIPOLOGIE, n_rules),
+            "a": rng.choice(TIPOLOGIE, n_rules),
+            "se contiene": rng.choice(words, n_rules),
+            "e non contiene": exclusions,
+        }
+    )
+
+
+def make_voci(n_rows, seed=0):
+    """Voci sintetiche di 3-6 parole, come nei file analisi."""
+    rng = np.random.default_rng(seed)
+    voci = [" ".join(rng.choice(WORDS, rng.integers(3, 7))) for _ in range(n_rows)]
+    return pd.DataFrame(
+        {"voce": voci, "tipologia": rng.choice(TIPOLOGIE, n_rows).astype(object)}
+    )
+
+
+def isinlist_numba(input_df, tipologie_fix_df):
+    """Vecchia implementazione di isinlist, con il doppio ciclo numba."""
+    return _isinlist(
+        format_to_check(input_df["voce"]),
+        format_to_check(input_df["tipologia"]),
+        format_check(tipologie_fix_df["se contiene"]),
+        format_check(tipologie_fix_df["e non contiene"]),
+        format_check(tipologie_fix_df["da"]),
+    )
+
+
+def time_function(function, *args):
+    timings = []
+    for _ in range(N_REPEATS):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main(n_rows):
+    voci = make_voci(n_rows)
+    print(f"{len(voci)} voci sintetiche")
+
+    # Compilazione numba fuori dai tempi:
+    isinlist_numba(voci.iloc[:10], make_rules(2))
+
+    for n_rules in [10 * N_RULES, N_RULES]:
+        rules = make_rules(n_rules)
+        t_numba, expected = time_function(isinlist_numba, voci, rules)
+        t_automa, result = time_function(isinlist, voci, rules)
+        np.testing.assert_array_equal(result, expected)
+        print(
+            f"{n_rules} regole ({expected.sum()} match): "
+            f"numba {t_numba:.3f} s -> automa {t_automa:.3f} s"
+        )
+
+    # Le stesse voci in ogni mese, come nel tabellone:
+    tabellone = pd.concat([voci] * N_MONTHS, ignore_index=True)
+    t_tabellone, result = time_function(isinlist, tabellone, rules)
+    np.testing.assert_array_equal(result, np.tile(expected, (N_MONTHS, 1)))
+    print(
+        f"{len(tabellone)} righe ({N_MONTHS} mesi), {N_RULES} regole: "
+        f"{t_tabellone:.3f} s (numba stimato: {t_numba * N_MONTHS:.1f} s)"
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else N_ROWS)
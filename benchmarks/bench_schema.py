@@ -0,0 +1,103 @@
+"""Confronta memoria e tempi del calcolo dei delta tra il tabellone con colonne di
+oggetti Python e quello nei tipi compatti di `schema`, su un tabellone sintetico di
+100k righe.
+
+Uso:
+    python benchmarks/bench_schema.py [n_righe]
+"""
+
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from pyconsolida.delta import get_tabellone_delta
+from pyconsolida.schema import (
+    memory_footprint,
+    plain_memory_footprint,
+    to_compact_dtypes,
+)
+from pyconsolida.sheet_specs import KEY_SEQUENCE
+
+N_ROWS = 100_000
+N_REPEATS = 3
+N_COMMESSE = 60
+N_VOCI = 5000
+
+
+def make_tabellone(n_rows, seed=0):
+    """Tabellone sintetico con le colonne come uscivano da load_loop_and_concat."""
+    rng = np.random.default_rng(seed)
+    months = pd.period_range("2022-01", "2024-12", freq="M")
+    month_n = np.sort(rng.integers(0, len(months), n_rows))
+    commesse = rng.integers(1000, 1000 + N_COMMESSE, n_rows)
+    voci_n = rng.integers(0, N_VOCI, n_rows)
+    voci = np.array([f"voce di costo numero {i}" for i in range(N_VOCI)], dtype=object)
+    tipologie = np.array(["Materiali", "Noli", "Personale", "Subappalti"], dtype=object)
+
+    return pd.DataFrame(
+        {
+            "commessa": commesse.astype(str).astype(object),
+            "fase": np.array([f"fase {i}" for i in range(8)], dtype=object)[
+                rng.integers(0, 8, n_rows)
+            ],
+            "anno": months.year[month_n].to_numpy().astype(np.int64),
+            "mese": months.month[month_n].to_numpy().astype(np.int64),
+            "data": months.strftime("%Y-%m").to_numpy(dtype=object)[month_n],
+            "mesi-da-inizio": month_n.astype(np.int64),
+            "codice": (voci_n + 100).astype(object),
+            "tipologia": tipologie[voci_n % len(tipologie)],
+            "voce": voci[voci_n],
+            "costo u.": np.round(rng.random(n_rows) * 100, 2).astype(object),
+            "u.m.": np.array(["m", "kg", "h", "cad"], dtype=object)[voci_n % 4],
+            "quantita": np.round(rng.random(n_rows) * 10, 3).astype(object),
+            "imp. unit.": np.round(rng.random(n_rows) * 100, 2).astype(object),
+            "imp.comp.": np.round(rng.random(n_rows) * 1000, 2).astype(object),
+            "file-hash": (commesse * 100 + month_n).astype(str).astype(object),
+        }
+    )[KEY_SEQUENCE]
+
+
+def time_delta(tabellone):
+    timings = []
+    for _ in range(N_REPEATS):
+        start = time.perf_counter()
+        result = get_tabellone_delta(
+            tabellone.copy(), datetime(2023, 1, 1), datetime(2024, 6, 1)
+        )
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main(n_rows):
+    plain = make_tabellone(n_rows)
+    print(f"Tabellone sintetico di {len(plain)} righe")
+
+    start = time.perf_counter()
+    compact = to_compact_dtypes(plain)
+    t_convert = time.perf_counter() - start
+
+    print(
+        f"Memoria: {memory_footprint(plain) / 2**20:.1f} MB -> "
+        f"{memory_footprint(compact) / 2**20:.1f} MB "
+        f"(stima senza tipi compatti: {plain_memory_footprint(compact) / 2**20:.1f}"
+        f" MB; conversione in {t_convert:.2f} s)"
+    )
+
+    t_plain, expected = time_delta(plain)
+    t_compact, result = time_delta(compact)
+    result = result.astype(
+        {
+            column: object
+            for column, dtype in result.dtypes.items()
+            if isinstance(dtype, pd.CategoricalDtype)
+        }
+    )
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    print(f"get_tabellone_delta: {t_plain:.3f} s -> {t_compact:.3f} s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else N_ROWS)
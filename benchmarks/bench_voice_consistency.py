@@ -0,0 +1,118 @@
+"""Confronta i tempi di fix_voice_consistency e sum_selected_columns con le vecchie
+implementazioni con groupby.apply, su un file sintetico di 50k voci di costo.
+
+Uso:
+    python benchmarks/bench_voice_consistency.py [n_righe]
+"""
+
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from pyconsolida.budget_reader_utils import fix_voice_consistency
+from pyconsolida.df_utils import sum_selected_columns
+from pyconsolida.sheet_specs import HEADERS, SHEET_COL_SEQ_FASE, TO_AGGREGATE
+
+N_ROWS = 50_000
+N_REPEATS = 3
+N_CODICI = 5000
+
+
+def _diagnose_consistence_loop(df, key):
+    if not len(set(df[key])) == 1:
+        return set(df[key])
+    else:
+        return np.nan
+
+
+def _map_consistent_voce_loop(df, key):
+    return df[key].values[0]
+
+
+def fix_voice_consistency_loop(df):
+    """Vecchia implementazione di fix_voice_consistency, una funzione per codice."""
+    consistence_report = df.groupby("codice").apply(_diagnose_consistence_loop, "voce")
+    consistence_report = consistence_report[
+        consistence_report.apply(lambda x: type(x) is not float)
+    ]
+    codice_mapping = df.groupby("codice").apply(_map_consistent_voce_loop, "voce")
+    df["voce"] = df["codice"].map(codice_mapping)
+    return df, consistence_report
+
+
+def _take_voce_static_vals_loop(df, exclude=None):
+    if len(exclude) > 0:
+        df = df.drop(exclude, axis=1)
+    return df.iloc[0, :]
+
+
+def sum_selected_columns_loop(df, groupby_key, cols_to_sum):
+    """Vecchia implementazione di sum_selected_columns, una funzione per codice."""
+    summed_quantities = df.groupby(groupby_key)[cols_to_sum].sum()
+    info_quantities = df.groupby(groupby_key).apply(
+        _take_voce_static_vals_loop, exclude=cols_to_sum
+    )
+    return pd.concat([summed_quantities, info_quantities], axis=1)
+
+
+def make_voci(n_rows, seed=0):
+    """Voci di costo sintetiche, con codici ripetuti su piu' fasi e qualche codice
+    con descrizioni diverse.
+    """
+    rng = np.random.default_rng(seed)
+    codici = rng.integers(100, 100 + N_CODICI, n_rows)
+    voci = np.array([f"voce {c}" for c in codici], dtype=object)
+    altered = rng.random(n_rows) < 0.02
+    voci[altered] = [f"{v} (bis)" for v in voci[altered]]
+    voci[rng.random(n_rows) < 0.005] = np.nan
+
+    return pd.DataFrame(
+        {
+            HEADERS["codice"]: codici,
+            HEADERS["tipologia"]: "Materiali",
+            HEADERS["voce"]: voci,
+            HEADERS["costo_unit"]: np.round(rng.random(n_rows) * 100, 2),
+            HEADERS["units"]: "m",
+            HEADERS["quantita"]: np.round(rng.random(n_rows) * 10, 3),
+            HEADERS["imp_unit"]: np.round(rng.random(n_rows) * 100, 2),
+            HEADERS["imp_comp"]: np.round(rng.random(n_rows) * 1000, 2),
+            HEADERS["fase"]: rng.choice(["fase 1", "fase 2", "fase 3"], n_rows),
+        }
+    )[SHEET_COL_SEQ_FASE]
+
+
+def time_function(function, df, *args):
+    timings = []
+    for _ in range(N_REPEATS):
+        df_copy = df.copy()
+        start = time.perf_counter()
+        result = function(df_copy, *args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main(n_rows):
+    warnings.simplefilter("ignore", category=FutureWarning)
+    df = make_voci(n_rows)
+    print(f"File sintetico di {len(df)} voci")
+
+    t_loop, (expected_df, expected_report) = time_function(
+        fix_voice_consistency_loop, df
+    )
+    t_vect, (result_df, result_report) = time_function(fix_voice_consistency, df)
+    pd.testing.assert_frame_equal(result_df, expected_df)
+    pd.testing.assert_series_equal(result_report, expected_report)
+    print(f"fix_voice_consistency: {t_loop:.3f} s -> {t_vect:.3f} s")
+
+    args = (HEADERS["codice"], TO_AGGREGATE)
+    t_loop, expected = time_function(sum_selected_columns_loop, result_df, *args)
+    t_vect, result = time_function(sum_selected_columns, result_df, *args)
+    pd.testing.assert_frame_equal(result, expected)
+    print(f"sum_selected_columns:  {t_loop:.3f} s -> {t_vect:.3f} s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else N_ROWS)
@@ -1,95 +1,402 @@
 import logging
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
-from pyconsolida.budget_reader import read_full_budget_cached
-from pyconsolida.cache_utils import get_folder_hash
+from pyconsolida.budget_reader import pop_failures, read_full_budget_cached
+from pyconsolida.budget_reader_utils import compile_tipologie_skip
+from pyconsolida.cache_utils import (
+    CACHE_MAX_BYTES,
+    DEFAULT_CACHE_FORMAT,
+    collect_garbage,
+    get_args_hash,
+    get_folder_hash,
+    get_hash_stats,
+    get_parser_fingerprint,
+    get_set_hash,
+    merge_manifests_updates,
+    pop_manifests_updates,
+    save_manifests,
+    store_lock,
+)
+from pyconsolida.delta import get_interval_folders
 from pyconsolida.folder_read_utils import (
     data_from_commessa_folder,
+    get_commessa_months,
     months_between_dates,
+    select_analisi_files,
 )
+from pyconsolida.logging_config import get_log_path, setup_logging
 from pyconsolida.posthoc_fix_utils import fix_tipologie_df
-from pyconsolida.sheet_specs import KEY_SEQUENCE, PATTERNS, SUFFIXES
+from pyconsolida.rule_engine import MATCHES_FILENAME
+from pyconsolida.schema import (
+    concat_compact,
+    memory_footprint,
+    plain_memory_footprint,
+    to_compact_dtypes,
+)
+from pyconsolida.sheet_specs import (
+    CACHE_PATH,
+    KEY_SEQUENCE,
+    PATTERNS,
+    SUFFIXES,
+)
+from pyconsolida.tabellone_store import (
+    STORE_FILENAME,
+    TabelloneStore,
+    get_folder_id,
+)
 
 logging.info(f"Patterns files analisi: {PATTERNS}")
 logging.info(f"Formati files analisi: {SUFFIXES}")
 
 
 def find_all_files(path):
-    """Find suitable files for data extraction."""
-    possible_files = []
-    for pattern in PATTERNS:
-        for suffix in SUFFIXES:
-            possible_files.extend(list(path.glob(pattern + suffix)))
-    return possible_files
+    """Find suitable files for data extraction, listing the folder only once."""
+    with os.scandir(path) as dir_entries:
+        entries = [(entry.name, entry.is_dir()) for entry in dir_entries]
+    return select_analisi_files(path, entries)
+
+
+def add_constant_columns(df, values):
+    """Add columns with the same value on all rows. Strings are added as
+    categorical columns with a single category (8 bit codes), instead of arrays
+    of repeated objects.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Dataframe to extend.
+    values : dict
+        Value of each new column.
+
+    Returns
+    -------
+    pd.DataFrame
+        A new dataframe with the added columns.
+    """
+    n_rows = len(df)
+    columns = {}
+    for column, value in values.items():
+        if isinstance(value, str):
+            columns[column] = pd.Categorical.from_codes(
+                np.zeros(n_rows, dtype=np.int8), categories=[value]
+            )
+        else:
+            columns[column] = np.full(n_rows, value)
+    return df.assign(**columns)
+
+
+def plain_constant_columns(df):
+    """Convert back to objects the categorical columns of `add_constant_columns`,
+    as expected in the reports.
+    """
+    categorical = [
+        column
+        for column, dtype in df.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    ]
+    return df.astype({column: object for column in categorical})
 
 
-def read_all_valid_budgets(path, path_list, tipologie_skip=None, cache=True):
-    """Read valid budget files from a folder."""
-    files = find_all_files(path)
+def read_all_valid_budgets(
+    path,
+    commessa_months,
+    tipologie_skip=None,
+    cache=True,
+    verify_hashes=False,
+    cache_format=DEFAULT_CACHE_FORMAT,
+    quarantine=False,
+    files=None,
+    cache_root=CACHE_PATH,
+):
+    """Read valid budget files from a folder.
+
+    `commessa_months` is the index of the months of each commessa (see
+    `get_commessa_months`), used for the months since the commessa start; `files`
+    can be passed if already known (eg from a `FolderCatalogue`). File and folder
+    hashes and the read files are cached in `cache_root`.
+    """
+    if files is None:
+        files = find_all_files(path)
     commessa = path.name
     data = data_from_commessa_folder(path)
 
-    # Pre-filter relevant folders once
-    commessa_folders = [f for f in path_list if f.name == commessa]
-    all_months = sorted(
-        data_from_commessa_folder(folder) for folder in commessa_folders
-    )
-
-    mesi_da_inizio = months_between_dates(data, all_months[0])
+    mesi_da_inizio = months_between_dates(data, commessa_months[commessa][0])
     mese, anno = data.month, data.year
-    folder_hash = get_folder_hash(path)
+    folder_hash = get_folder_hash(path, verify=verify_hashes, cache_root=cache_root)
     data = f"{anno}-{mese:02d}"
 
-    # Initialize empty DataFrames with correct columns
-    loaded = None
-    reports = None
-
-    # Process files one by one without accumulating lists
+    # Frames of the single files, concatenated once at the end:
+    loaded = []
+    reports = []
     for file in files:
         fasi, cons_report = read_full_budget_cached(
             file,
-            folder_hash,
             sum_fasi=False,
             tipologie_skip=tipologie_skip,
             cache=cache,
+            cache_root=cache_root,
+            verify_hashes=verify_hashes,
+            cache_format=cache_format,
+            quarantine=quarantine,
         )
         if fasi is not None:
-            if loaded is None:
-                loaded = fasi
-            else:
-                # Use DataFrame.append which is more efficient for single DataFrame
-                loaded = loaded._append(fasi, ignore_index=True)
+            loaded.append(fasi)
 
         if len(cons_report) > 0:
-            report_df = pd.DataFrame(cons_report)
-            if reports is None:
-                reports = report_df
-            else:
-                reports = reports._append(report_df, ignore_index=True)
+            reports.append(pd.DataFrame(cons_report))
+
+    loaded = pd.concat(loaded, ignore_index=True) if len(loaded) > 0 else None
+    reports = pd.concat(reports, ignore_index=True) if len(reports) > 0 else None
 
     if loaded is None or loaded.empty:
         logging.info(f"No file validi in {path}")
         return None, None
 
     # Add metadata columns
-    loaded.loc[:, "commessa"] = commessa
-    loaded.loc[:, "mese"] = mese
-    loaded.loc[:, "anno"] = anno
-    loaded.loc[:, "data"] = data
-    loaded.loc[:, "mesi-da-inizio"] = mesi_da_inizio
-    loaded.loc[:, "file-hash"] = folder_hash
-
+    metadata = {"commessa": commessa, "mese": mese, "anno": anno, "data": data}
+    loaded = add_constant_columns(
+        loaded, {**metadata, "mesi-da-inizio": mesi_da_inizio, "file-hash": folder_hash}
+    )
+    # Voci nei tipi compatti del tabellone gia' alla lettura (vedi `schema`):
+    loaded = to_compact_dtypes(loaded)
     if reports is not None:
-        reports.loc[:, "commessa"] = commessa
-        reports.loc[:, "mese"] = mese
-        reports.loc[:, "anno"] = anno
-        reports.loc[:, "data"] = data
+        reports = add_constant_columns(reports, metadata)
 
     return loaded, reports
 
 
+def _analisi_size(files):
+    """Total size in bytes of the analisi files of a folder, used for scheduling."""
+    return sum(file.stat().st_size for file in files)
+
+
+def _init_worker(log_path):
+    """Make worker processes log to the same file as the main process."""
+    if log_path is not None:
+        setup_logging(log_path)
+
+
+def _hash_stats_since(stats_start):
+    """Hash hits and misses counted after `stats_start` was taken."""
+    hash_stats = Counter(get_hash_stats())
+    hash_stats.subtract(stats_start)
+    return hash_stats
+
+
+def _read_folder(folder, commessa_months, **kwargs):
+    """Read a folder, returning also the failed reads of its files."""
+    loaded, reports = read_all_valid_budgets(folder, commessa_months, **kwargs)
+    return loaded, reports, pop_failures()
+
+
+def _read_folder_worker(folder, commessa_months, **kwargs):
+    """Read a folder in a worker process, returning also the changes to the cache
+    manifests so that the main process can save them, and the hash cache counters.
+    """
+    stats_start = get_hash_stats()
+    loaded, reports, failures = _read_folder(folder, commessa_months, **kwargs)
+    return (
+        loaded,
+        reports,
+        failures,
+        pop_manifests_updates(),
+        _hash_stats_since(stats_start),
+    )
+
+
+def _read_folders_parallel(
+    folders, commessa_months, workers, folder_files, progress_bar=True, **kwargs
+):
+    """Read folders on a process pool, scheduling the largest workbooks first.
+
+    Results are returned in the same order as `folders`, so that the output does
+    not depend on the order in which the workers complete, together with the hash
+    cache counters of all the workers.
+    """
+    schedule = sorted(
+        range(len(folders)),
+        key=lambda i: _analisi_size(folder_files[folders[i]]),
+        reverse=True,
+    )
+
+    results = [None] * len(folders)
+    hash_stats = Counter()
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(get_log_path(),)
+    ) as executor:
+        futures = {
+            executor.submit(
+                _read_folder_worker,
+                folders[i],
+                # Each worker only needs the months of the same commessa:
+                {folders[i].name: commessa_months[folders[i].name]},
+                files=folder_files[folders[i]],
+                **kwargs,
+            ): i
+            for i in schedule
+        }
+        completed = as_completed(futures)
+        if progress_bar:
+            completed = tqdm(completed, total=len(futures))
+        for future in completed:
+            loaded, reports, failures, manifests_updates, folder_hash_stats = (
+                future.result()
+            )
+            merge_manifests_updates(manifests_updates)
+            hash_stats.update(folder_hash_stats)
+            results[futures[future]] = loaded, reports, failures
+
+    return results, hash_stats
+
+
+def _folder_month(folder):
+    """(commessa, anno, mese) of a folder, as in `_months_with_voci`."""
+    data = data_from_commessa_folder(folder)
+    return folder.name, data.year, data.month
+
+
+def _get_store_keys(folder_hashes, commessa_months, tipologie_skip=None):
+    """Keys of the folders in the tabellone store, from the hashes of the folders
+    (see `get_folder_hash`). A key changes if any file of the folder changes, or the
+    first month of the commessa (for mesi-da-inizio), the tipologie to skip or the
+    parser.
+    """
+    return {
+        folder: get_args_hash(
+            folder_hash=folder_hash,
+            first_month=commessa_months[folder.name][0],
+            tipologie_skip=(
+                None if tipologie_skip is None else get_set_hash(tipologie_skip)
+            ),
+            parser=get_parser_fingerprint(),
+        )
+        for folder, folder_hash in folder_hashes.items()
+    }
+
+
+def _load_folders(
+    folders,
+    commessa_months,
+    workers,
+    folder_files,
+    tabellone_store=None,
+    progress_bar=True,
+    **kwargs,
+):
+    """Read the voci and reports of `folders`, through the tabellone store if given
+    (re-reading only the folders that changed).
+
+    Returns
+    -------
+    tuple
+        Lists of the voci and of the reports DataFrames (only the non-empty ones),
+        and list of the failed reads of the files.
+    """
+    # Con l'archivio del tabellone si leggono solo le cartelle cambiate:
+    folders_to_read = folders
+    if tabellone_store is not None:
+        # Each folder is hashed once, for its key and for its entry in the store:
+        folder_hashes = {
+            folder: get_folder_hash(
+                folder, verify=kwargs["verify_hashes"], cache_root=kwargs["cache_root"]
+            )
+            for folder in folders
+        }
+        store_keys = _get_store_keys(
+            folder_hashes, commessa_months, kwargs["tipologie_skip"]
+        )
+        saved_keys = tabellone_store.get_keys()
+        folders_to_read = [
+            folder
+            for folder in folders
+            if saved_keys.get(get_folder_id(folder)) != store_keys[folder]
+        ]
+        logging.info(
+            f"Archivio tabellone {tabellone_store.filename}: "
+            f"{len(folders_to_read)} cartelle da aggiornare"
+        )
+
+    # File analisi di ogni cartella da leggere, se non gia' noti da un catalogo:
+    folder_files = {
+        folder: (
+            folder_files[folder] if folder in folder_files else find_all_files(folder)
+        )
+        for folder in folders_to_read
+    }
+
+    if workers > 1:
+        logging.info(f"Lettura parallela con {workers} processi")
+        results, hash_stats = _read_folders_parallel(
+            folders_to_read,
+            commessa_months,
+            workers,
+            folder_files,
+            progress_bar=progress_bar,
+            **kwargs,
+        )
+    else:
+        # Use list comprehension to gather data more efficiently
+        wrapper = tqdm if progress_bar else lambda x: x
+        stats_start = get_hash_stats()
+        results = [
+            _read_folder(folder, commessa_months, files=folder_files[folder], **kwargs)
+            for folder in wrapper(folders_to_read)
+        ]
+        hash_stats = _hash_stats_since(stats_start)
+
+    logging.info(f"Hash riusati (hits) e ricalcolati (misses): {dict(hash_stats)}")
+
+    failures = [
+        failure for *_, folder_failures in results for failure in folder_failures
+    ]
+
+    if tabellone_store is not None:
+        # Aggiorna le cartelle lette e leggi le cartelle richieste in una volta:
+        for folder, (loaded, folder_reports, folder_failures) in zip(
+            folders_to_read, results
+        ):
+            data = data_from_commessa_folder(folder)
+            tabellone_store.upsert(
+                folder,
+                # Cartelle con file in quarantena da rileggere (e riportare) sempre:
+                store_keys[folder] if len(folder_failures) == 0 else None,
+                commessa=folder.name,
+                anno=data.year,
+                mese=data.month,
+                file_hash=folder_hashes[folder],
+                tables={"voci": loaded, "reports": folder_reports},
+            )
+        tabellone_store.commit()
+        tables = tabellone_store.read(folders)
+        budgets = [tables["voci"]] if len(tables["voci"]) > 0 else []
+        reports = [tables["reports"]] if len(tables["reports"]) > 0 else []
+    else:
+        # Separate budgets and reports, filtering out None values
+        budgets = [loaded for loaded, _, _ in results if loaded is not None]
+        reports = [report for _, report, _ in results if report is not None]
+
+    return budgets, reports, failures
+
+
+def _months_with_voci(budgets):
+    """(commessa, anno, mese) of the folders with at least one voce in `budgets`."""
+    return {
+        (str(commessa), int(anno), int(mese))
+        for budget in budgets
+        for commessa, anno, mese in zip(
+            budget["commessa"], budget["anno"], budget["mese"]
+        )
+    }
+
+
 def load_loop_and_concat(
     folders,
     key_sequence=KEY_SEQUENCE,
@@ -98,36 +405,131 @@ def load_loop_and_concat(
     progress_bar=True,
     report_filename=None,
     cache=True,
+    workers=1,
+    all_folders=None,
+    verify_hashes=False,
+    cache_format=DEFAULT_CACHE_FORMAT,
+    store=False,
+    cache_max_bytes=CACHE_MAX_BYTES,
+    quarantine=False,
+    failures_filename=None,
+    folder_files=None,
+    cache_root=CACHE_PATH,
+    date_intervals=None,
 ):
-    # Use list comprehension to gather data more efficiently
-    wrapper = tqdm if progress_bar else lambda x: x
-    logging.info(f"Processing {len(folders)} folders...")
-
-    # Gather all data in one pass
-    results = [
-        read_all_valid_budgets(
-            folder, folders, tipologie_skip=tipologie_skip, cache=cache
-        )
-        for folder in wrapper(folders)
-    ]
+    # All the folders are needed anyway to count months since the commessa start
+    # (as paths, or as the `CommessaFolder` of a catalogue with their dates):
+    if all_folders is None:
+        all_folders = folders
+    # Index of the months of each commessa, computed once for all the folders:
+    commessa_months = get_commessa_months(all_folders)
+
+    # Lookup set for the headers to skip, computed once for all files:
+    if isinstance(tipologie_skip, pd.DataFrame):
+        tipologie_skip = compile_tipologie_skip(tipologie_skip)
+
+    # Con `date_intervals` si leggono solo le cartelle necessarie ai delta: inizio e
+    # fine di ogni intervallo, e i mesi precedenti solo se la fine risulta senza voci
+    # (vedi `get_interval_folders`):
+    if date_intervals is None:
+        folders_round = folders
+    else:
+        folders_round = get_interval_folders(folders, date_intervals)
+    logging.info(f"Processing {len(folders_round)} folders...")
+
+    budgets, reports, failures = [], [], []
+    with ExitStack() as stack:
+        tabellone_store = None
+        if store and cache:
+            stack.enter_context(store_lock(cache_root))
+            tabellone_store = stack.enter_context(
+                TabelloneStore(Path(cache_root) / STORE_FILENAME)
+            )
 
-    # Separate budgets and reports, filtering out None values
-    budgets, reports = zip(*results)
-    budgets = [b for b in budgets if b is not None]
-    reports = [r for r in reports if r is not None]
+        read_folders, empty_folders = set(), set()
+        while len(folders_round) > 0:
+            round_budgets, round_reports, round_failures = _load_folders(
+                folders_round,
+                commessa_months,
+                workers,
+                {} if folder_files is None else folder_files,
+                tabellone_store=tabellone_store,
+                progress_bar=progress_bar,
+                tipologie_skip=tipologie_skip,
+                cache=cache,
+                cache_root=cache_root,
+                verify_hashes=verify_hashes,
+                cache_format=cache_format,
+                quarantine=quarantine,
+            )
+            budgets += round_budgets
+            reports += round_reports
+            failures += round_failures
+            if date_intervals is None:
+                break
+
+            months_with_voci = _months_with_voci(round_budgets)
+            read_folders.update(folders_round)
+            empty_folders.update(
+                folder
+                for folder in folders_round
+                if _folder_month(folder) not in months_with_voci
+            )
+            folders_round = [
+                folder
+                for folder in get_interval_folders(
+                    folders, date_intervals, empty_folders
+                )
+                if folder not in read_folders
+            ]
+            if len(folders_round) > 0:
+                logging.info(
+                    f"Fine intervallo senza voci, leggo {len(folders_round)} cartelle "
+                    "dei mesi precedenti"
+                )
+
+    # Salva hash dei file e voci della cache per la prossima esecuzione, dopo aver
+    # cancellato le voci usate meno di recente se la cache e' troppo grande:
+    if cache:
+        collect_garbage(cache_root, max_bytes=cache_max_bytes)
+        save_manifests()
+
+    # Riassunto dei file non letti (in quarantena):
+    if len(failures) > 0:
+        logging.warning(f"File in quarantena, non letti: {len(failures)}")
+        if failures_filename is not None:
+            pd.DataFrame(failures).to_excel(failures_filename, index=False)
+
+    # Single concat operations, with one dictionary for each categorical column:
+    if len(budgets) > 0:
+        budgets = concat_compact(budgets)[key_sequence]
+    else:
+        # Nessuna voce (tutte le cartelle vuote o in quarantena):
+        budgets = to_compact_dtypes(pd.DataFrame(columns=key_sequence))
+    reports = pd.concat(reports, axis=0, ignore_index=True) if reports else None
+
+    if reports is not None:
+        reports = plain_constant_columns(reports)
 
-    # Single concat operations
-    budgets = pd.concat(budgets, axis=0, ignore_index=True)[key_sequence]
     logging.info(f"File consolidato: {len(budgets)} entrate")
+    logging.info(
+        f"Memoria tabellone: {plain_memory_footprint(budgets) / 2**20:.2f} MB "
+        f"senza tipi compatti, {memory_footprint(budgets) / 2**20:.2f} MB compatto"
+    )
 
-    if reports:
-        reports = pd.concat(reports, axis=0, ignore_index=True)
+    if reports is not None:
         logging.info(f"Report sul file consolidato: {len(reports)} entrate")
     else:
         reports = pd.DataFrame()
 
     if tipologie_fix is not None:
         logging.info("Correggo le tipologie...")
-        fix_tipologie_df(budgets, tipologie_fix, report_filename=report_filename)
+        fix_tipologie_df(
+            budgets,
+            tipologie_fix,
+            report_filename=report_filename,
+            # Match delle voci gia' viste nelle esecuzioni precedenti:
+            matches_filename=Path(cache_root) / MATCHES_FILENAME if cache else None,
+        )
 
     return budgets, reports
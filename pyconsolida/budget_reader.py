@@ -1,74 +1,81 @@
 import logging
-import pickle
-import warnings
+import re
+import traceback
 
 import numpy as np
 import pandas as pd
 
 from pyconsolida.budget_reader_utils import (
     add_tipologia_column,
+    commessa_number,
+    compile_tipologie_skip,
     crop_costi,
     fix_types,
     fix_voice_consistency,
-    translate_df,
+    value_types,
 )
 from pyconsolida.cache_utils import (
+    DEFAULT_CACHE_FORMAT,
+    FAILURE_FORMAT,
+    entry_lock,
+    find_cache_entry,
     get_args_hash,
-    get_cache_directory,
-    get_repo_version,
+    get_cache_manifest,
+    get_file_hash,
+    get_parser_fingerprint,
+    get_set_hash,
+    read_cache_entry,
+    read_failure_entry,
+    write_cache_entry,
+    write_failure_entry,
 )
 from pyconsolida.df_utils import sum_selected_columns
+from pyconsolida.excel_readers import get_engine, read_budget_sheets
 from pyconsolida.sheet_specs import (
     CACHE_PATH,
     CODICE_COSTO_COL,
-    EXCLUDED_FASI,
     HEADERS,
     SHEET_COL_SEQ,
     SHEET_COL_SEQ_FASE,
     TO_AGGREGATE,
+    TOTALE_COSTI_LABELS,
 )
 
-
-def _is_valid_costo_code(val):
-    """Ritorna True se il valore e' un codice costo valido, False altrimenti."""
-    if isinstance(val, int):
-        return True
-    elif isinstance(val, str):
-        try:
-            int(val[:-1])
-            return True
-        except ValueError:
-            return False
-    return False
+# Codice costo valido: un intero (come accettato da int()) seguito da un carattere
+# qualsiasi, oppure un intero nella cella:
+VALID_CODICE_REGEX = r"\s*[+-]?\d+(?:_\d+)*\s*."
 
 
 def _get_valid_costo_rows(df):
     """Localizza righe con voci costo valide in base al fatto che hanno un intero
     nella colonna codici costo.
     """
-    try:
-        max_n = np.nonzero(df.iloc[:, CODICE_COSTO_COL].values == "Totale costi")[0][0]
-    except IndexError:
-        try:
-            max_n = np.nonzero(df.iloc[:, CODICE_COSTO_COL].values == "Total dépenses")[
-                0
-            ][0]
-        except IndexError:
-            max_n = len(df)  # Tanto verosimilmente questo non e' un foglio di budget
-    select = [
-        _is_valid_costo_code(cost_id) and i < max_n and i > 0
-        for i, cost_id in enumerate(df.iloc[:, CODICE_COSTO_COL])
-    ]
-    return select
+    codici = df.iloc[:, CODICE_COSTO_COL]
+
+    max_n = len(df)  # Tanto verosimilmente questo non e' un foglio di budget
+    for label in TOTALE_COSTI_LABELS:
+        (totale_rows,) = np.nonzero((codici == label).to_numpy())
+        if len(totale_rows) > 0:
+            max_n = totale_rows[0]
+            break
+
+    tipi = value_types(codici)
+    select = (tipi == int) | (tipi == bool)
+    is_str = tipi == str
+    if is_str.any():
+        select[is_str] = (
+            codici[is_str].str.fullmatch(VALID_CODICE_REGEX, flags=re.DOTALL).to_numpy()
+        )
+
+    row_n = np.arange(len(df))
+    return select & (row_n > 0) & (row_n < max_n)
 
 
 def _read_raw_budget_sheet(df, commessa, fase, tipologie_skip=None):
     """Legge i costi da una pagina di una singola fase del file analisi."""
 
-    # Traduci se necessario:
-    df = translate_df(df)
-
-    # Trova l'inizio delle righe costi, e return se non ce ne sono:
+    # Trova l'inizio delle righe costi (traducendo gli header se necessario), e
+    # return se non ce ne sono:
     df_costi = crop_costi(df)
 
     if df_costi is None:
@@ -125,42 +132,36 @@ def _read_raw_budget_sheet(df, commessa, fase, tipologie_skip=None):
 def _read_full_budget(filename, sum_fasi=True, tipologie_skip=None):
     log_messages = []
 
-    # Leggi file:
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        df = pd.read_excel(filename, sheet_name=None)
-
-    # Cicla su tutti i fogli del file per leggere le fasi:
+    # Leggi le fasi dal file (i fogli esclusi non vengono neanche letti):
+    engine = get_engine(filename)
+    log_messages.append(f"Leggo {filename} con engine {engine}")
     all_fasi = []
-    for fase, df_fase in df.items():
-        if fase not in EXCLUDED_FASI:
-            try:
-                costi_fase = _read_raw_budget_sheet(
-                    df_fase,
-                    filename.parent.name,
-                    fase,
-                    tipologie_skip=tipologie_skip,
+    for fase, df_fase in read_budget_sheets(filename, engine=engine):
+        try:
+            costi_fase = _read_raw_budget_sheet(
+                df_fase,
+                filename.parent.name,
+                fase,
+                tipologie_skip=tipologie_skip,
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            if "['inc.%'] not found in axis" in str(e):
+                log_messages.append(
+                    f"Skipping fase'{fase}' in '{filename}': no costi validi"
                 )
-            except (KeyError, TypeError, ValueError) as e:
-                if "['inc.%'] not found in axis" in str(e):
-                    log_messages.append(
-                        f"Skipping fase'{fase}' in '{filename}': no costi validi"
-                    )
-                    costi_fase = None
-                else:
-                    raise RuntimeError(
-                        f"Problem while analyzing fase '{fase}' of file '{filename}'"
-                    )
-                # to debug you can use notebook.
-                # Common problems are: 1. Leftovers on the gray lower part of the sheet; 2. typos replacing labels with eg numbers.from
+                costi_fase = None
+            else:
+                raise RuntimeError(
+                    f"Problem while analyzing fase '{fase}' of file '{filename}'"
+                )
+            # to debug you can use notebook.
+            # Common problems are: 1. Leftovers on the gray lower part of the sheet; 2. typos replacing labels with eg numbers.from
 
-            if costi_fase is not None:
-                if (
-                    not sum_fasi
-                ):  # ci interessa identita' delle fasi solo se non sommiamo:
-                    costi_fase[HEADERS["fase"]] = fase
+        if costi_fase is not None:
+            if not sum_fasi:  # ci interessa identita' delle fasi solo se non sommiamo:
+                costi_fase[HEADERS["fase"]] = fase
 
-                all_fasi.append(costi_fase)
+            all_fasi.append(costi_fase)
 
     # Aggreghiamo per cantiere per sommare voci costo identiche:
     all_fasi_concat = pd.concat(all_fasi, axis=0, ignore_index=True)
@@ -188,77 +189,214 @@ def _read_full_budget(filename, sum_fasi=True, tipologie_skip=None):
     return all_fasi_concat, consistency_report, log_messages
 
 
+# Letture fallite in questo processo, vedi `quarantine` in `read_full_budget_cached`:
+_failures = []
+
+
+def pop_failures():
+    """Return and forget the failed reads recorded in this process since the last
+    call, one dict per file with the error and its traceback.
+    """
+    failures = list(_failures)
+    _failures.clear()
+    return failures
+
+
+def _read_full_budget_quarantined(filename, sum_fasi, tipologie_skip, quarantine):
+    """Legge un file; con `quarantine`, se la lettura fallisce ritorna il traceback
+    dell'errore invece di sollevarlo.
+
+    Returns
+    -------
+    tuple
+        Risultato di `_read_full_budget` (o None) e traceback (o None).
+    """
+    logging.info(f"Reading from scratch {filename}")
+    try:
+        return _read_full_budget(filename, sum_fasi, tipologie_skip), None
+    except Exception:
+        if not quarantine:
+            raise
+        return None, traceback.format_exc()
+
+
+# Segnaposto del percorso del file nei messaggi salvati in cache: la stessa voce e'
+# usata anche per le copie identiche del file in altre cartelle.
+CACHED_FILENAME_PLACEHOLDER = "<file>"
+
+
+def _to_cached_text(text, filename):
+    return text.replace(str(filename), CACHED_FILENAME_PLACEHOLDER)
+
+
+def _from_cached_text(text, filename):
+    return text.replace(CACHED_FILENAME_PLACEHOLDER, str(filename))
+
+
+def _get_read_args_hash(filename, sum_fasi, tipologie_skip):
+    """Hash degli argomenti da cui dipende la lettura di un file. La commessa conta
+    solo per le sue tipologie da saltare, cosi' che file identici in commesse diverse
+    siano letti una volta sola.
+    """
+    commessa = filename.parent.name
+    try:
+        int_commessa = commessa_number(commessa)
+    except ValueError:
+        # Senza numero di commessa la lettura dipende dal nome della cartella:
+        return get_args_hash(
+            commessa=commessa,
+            sum_fasi=sum_fasi,
+            tipologie_skip=(
+                None if tipologie_skip is None else get_set_hash(tipologie_skip)
+            ),
+        )
+
+    commessa_skip = frozenset(
+        key for key in (tipologie_skip or ()) if key[0] == int_commessa
+    )
+    return get_args_hash(
+        sum_fasi=sum_fasi,
+        tipologie_skip=get_set_hash(commessa_skip) if commessa_skip else None,
+    )
+
+
+def _is_usable_entry(entry_format, quarantine):
+    # Senza quarantena le letture fallite in precedenza vengono riprovate:
+    return entry_format is not None and (quarantine or entry_format != FAILURE_FORMAT)
+
+
+def _read_cached_entry(cache_base, entry_format):
+    """Legge una voce della cache: ritorna il risultato della lettura del file e il
+    traceback se la lettura era fallita, come `_read_full_budget_quarantined`.
+    """
+    if entry_format == FAILURE_FORMAT:
+        return None, read_failure_entry(cache_base)
+    return read_cache_entry(cache_base, cache_format=entry_format), None
+
+
 def read_full_budget_cached(
     filename,
-    folder_hash,
     sum_fasi=True,
     tipologie_skip=None,
     cache=True,
     cache_root=CACHE_PATH,
+    verify_hashes=False,
+    cache_format=DEFAULT_CACHE_FORMAT,
+    quarantine=False,
 ):
-    """Read the full budget from a file, using caching."""
-
-    # Define cached filename:
-    script_hash = get_repo_version()
-    args_hash = get_args_hash(sum_fasi=sum_fasi, tipologie_skip=tipologie_skip)
-
-    if cache:
-        # This relying on relative path could be slippery depedning on the precise data structure
-        cached_folder = get_cache_directory(
-            filename.parent,
-            data_path=filename.parent.parent.parent.parent,
-            cache_root=cache_root,
-        )
-        cached_filename_base = (
-            cached_folder
-            / f"{filename.stem}_cache_{args_hash}_{folder_hash}_{script_hash}"
-        )
-        all_fasi_filename = cached_folder / f"{cached_filename_base.stem}.pickle"
-        consistency_filename = (
-            cached_folder / f"{cached_filename_base.stem}_consistency.pickle"
+    """Read the full budget from a file, using caching.
+
+    The cache is content-addressed: entries are keyed by the hash of the file
+    content, so identical files found in different month folders are read once.
+    The hash is recomputed only if the file size, mtime or inode changed, or if
+    `verify_hashes` is True. New entries are saved in `cache_format` (see
+    `cache_utils.CACHE_FORMATS`), existing entries are read in any format.
+
+    Hashes and entries are looked up in the manifest of the cache, which is saved
+    only at the end of the run (see `cache_utils.save_manifests`). On a miss, the
+    file is read holding a lock on the entry shared with other processes using
+    the same cache, so that concurrent runs read each file only once.
+
+    With `quarantine`, an error while reading the file does not stop the run: the
+    traceback is saved in the cache in place of the result, so that the file is
+    not read again until its content or the parser change, the failure is
+    recorded (see `pop_failures`) and (None, []) is returned.
+    """
+
+    # Better to compile it once before looping on the files, see load_loop_and_concat:
+    if isinstance(tipologie_skip, pd.DataFrame):
+        tipologie_skip = compile_tipologie_skip(tipologie_skip)
+
+    if not cache:
+        from_cache = False
+        result, failure = _read_full_budget_quarantined(
+            filename, sum_fasi, tipologie_skip, quarantine
         )
-        log_filename = cached_folder / f"{cached_filename_base.stem}_log.txt"
-
-    # Controlla se c'è già un csv generato con la stessa versione dello script:
-    if cache and all(
-        [f.exists() for f in [all_fasi_filename, consistency_filename, log_filename]]
-    ):
-        logging.info(f"Leggo cache da {all_fasi_filename}")
-        loaded_from_cache = True
-        # Leggi cache:
-        all_fasi_concat = pd.read_pickle(all_fasi_filename)
-        with open(consistency_filename, "rb") as f:
-            consistency_report = pickle.load(f)
-        with open(log_filename, "r") as f:
-            log_messages = f.readlines()
-
-        # Remove all the other cached files that do not match the current script and folder version:
-        for cached_file in cached_folder.glob(
-            f"{filename.stem}_cache_{args_hash}*.pickle"
-        ):
-            if cached_file not in [
-                all_fasi_filename,
-                consistency_filename,
-                log_filename,
-            ]:
-                cached_file.unlink()
 
     else:
-        logging.info(f"Reading from scratch {filename}")
-        all_fasi_concat, consistency_report, log_messages = _read_full_budget(
-            filename, sum_fasi, tipologie_skip
-        )
+        # Tutte le informazioni sulla cache sono nel manifest, senza accessi al disco:
+        manifest = get_cache_manifest(cache_root)
+
+        # Il risultato dipende dal contenuto del file, dagli argomenti e dalla
+        # versione del parser:
+        file_hash = get_file_hash(filename, manifest=manifest, verify=verify_hashes)
+        args_hash = _get_read_args_hash(filename, sum_fasi, tipologie_skip)
+        script_hash = get_parser_fingerprint()
+
+        entry_key = f"{file_hash}_{args_hash}"
+        cache_base = manifest.store_directory / f"{entry_key}_{script_hash}"
+
+        # Controlla se il file e' gia' stato letto con la stessa versione dello script:
+        from_cache = True
+        result, failure = None, None
+        entry_format = manifest.get_entry_format(entry_key, script_hash)
+        if _is_usable_entry(entry_format, quarantine):
+            try:
+                result, failure = _read_cached_entry(cache_base, entry_format)
+                manifest.touch_entry(entry_key)
+            except FileNotFoundError:
+                manifest.remove_entry(entry_key)
+
+        if result is None and failure is None:
+            # Se un altro processo sta leggendo lo stesso file si aspetta e si usa il
+            # suo risultato, invece di leggerlo due volte:
+            with entry_lock(cache_root, entry_key):
+                entry_format = find_cache_entry(cache_base)
+                if _is_usable_entry(entry_format, quarantine):
+                    result, failure = _read_cached_entry(cache_base, entry_format)
+                    manifest.add_entry(entry_key, script_hash, entry_format)
 
-        loaded_from_cache = False
+                else:
+                    from_cache = False
+                    result, failure = _read_full_budget_quarantined(
+                        filename, sum_fasi, tipologie_skip, quarantine
+                    )
 
-    if cache and not loaded_from_cache:
-        # Salva con versione dello script e dei file:
-        all_fasi_concat.to_pickle(all_fasi_filename)
+                    # Salva con versione dello script e dei file:
+                    if failure is None:
+                        all_fasi_concat, consistency_report, log_messages = result
+                        saved_format = write_cache_entry(
+                            cache_base,
+                            all_fasi_concat,
+                            consistency_report,
+                            [_to_cached_text(m, filename) for m in log_messages],
+                            cache_format=cache_format,
+                        )
+                    else:
+                        saved_format = write_failure_entry(
+                            cache_base, _to_cached_text(failure, filename)
+                        )
+                    manifest.add_entry(entry_key, script_hash, saved_format)
+
+        # I messaggi salvati nominano il file che e' stato letto, che puo' essere una
+        # copia in un'altra cartella:
+        if from_cache:
+            if failure is not None:
+                failure = _from_cached_text(failure, filename)
+            else:
+                all_fasi_concat, consistency_report, log_messages = result
+                result = (
+                    all_fasi_concat,
+                    consistency_report,
+                    [_from_cached_text(m, filename) for m in log_messages],
+                )
+
+    if failure is not None:
+        error = failure.strip().splitlines()[-1]
+        logging.warning(f"Lettura di {filename} fallita, file in quarantena: {error}")
+        _failures.append(
+            {
+                "file": str(filename),
+                "errore": error,
+                "traceback": failure,
+                "da_cache": from_cache,
+            }
+        )
+        return None, []
 
-        pickle.dump(consistency_report, open(consistency_filename, "wb"))
-        with open(log_filename, "w") as f:
-            for log_message in log_messages:
-                f.write(log_message)
+    if from_cache:
+        logging.info(f"Leggo cache di {filename} da {cache_base}")
+    all_fasi_concat, consistency_report, log_messages = result
 
     for log_message in log_messages:
         logging.info(log_message)
@@ -1,7 +1,7 @@
 import logging
-import warnings
 
 import numpy as np
+import pandas as pd
 
 from pyconsolida.sheet_specs import (
     HEADER_TRASLATIONS_DICT,
@@ -13,16 +13,89 @@ from pyconsolida.sheet_specs import (
     TYPES_MAP,
 )
 
+# Mappa inversa da ogni variante al nome standard dell'header:
+HEADER_ALIASES = {
+    val: key for key, vals in HEADER_TRASLATIONS_DICT.items() for val in vals
+}
 
-def translate_df(df):
-    """Traduce le parti essenziali del file se necessario, come per la Francia,
-    o gli eventuali header cambiati.
+# Tutte le varianti della casella da cui iniziano i costi:
+COSTI_START_LABELS = [HEADERS["costi_start"]] + HEADER_TRASLATIONS_DICT[
+    HEADERS["costi_start"]
+]
+
+
+# type() applicato elemento per elemento, senza passare da Series.map:
+_element_type = np.frompyfunc(type, 1, 1)
+
+
+def value_types(series):
+    """Tipo Python di ogni valore della colonna, come array object."""
+    return _element_type(series.to_numpy(dtype=object))
+
+
+def type_mask(series, *types):
+    """Maschera booleana dei valori della colonna il cui tipo e' esattamente uno
+    di quelli dati (senza sottoclassi, come `type(val) is str`).
     """
+    series_types = value_types(series)
+    mask = np.zeros(len(series), dtype=bool)
+    for typ in types:
+        mask |= series_types == typ
+    return mask
 
-    for key, vals in HEADER_TRASLATIONS_DICT.items():
-        for val in vals:
-            df = df.where(df != val, key)
-    return df
+
+def _translate_header(value):
+    """Traduce una singola casella di header, se necessario."""
+    try:
+        return HEADER_ALIASES.get(value, value)
+    except TypeError:  # valori non hashable
+        return value
+
+
+def _codici_to_int(codici):
+    """Converte la colonna dei codici costo a interi, togliendo l'eventuale
+    carattere in fondo. Versione vettoriale di `fix_codice_costo_alphanum`.
+    """
+    # Su array object astype(int) chiama int() su ogni valore:
+    values = codici.to_numpy(dtype=object, copy=True)
+    try:
+        return pd.Series(values.astype(np.int64), index=codici.index)
+    except (ValueError, OverflowError):
+        pass
+
+    # Togli il carattere in fondo ai codici che non finiscono con una cifra:
+    is_str = type_mask(codici, str)
+    codici_str = codici[is_str]
+    alphanum = ~codici_str.str[-1:].str.isdigit()
+    values[is_str] = codici_str.where(~alphanum, codici_str.str[:-1])
+    try:
+        return pd.Series(values.astype(np.int64), index=codici.index)
+    except (ValueError, OverflowError):
+        # Casi particolari, con la conversione originale:
+        return codici.map(fix_codice_costo_alphanum)
+
+
+def _costi_to_float(costi):
+    """Converte i costi unitari a float, accettando stringhe con spazi e virgola
+    come separatore decimale.
+    """
+    # Su array object astype(float) chiama float() su ogni valore, ma converte None
+    # a nan: come float(None), le celle None sono un errore:
+    values = costi.to_numpy(dtype=object, copy=True)
+    if type_mask(costi, type(None)).any():
+        raise TypeError("float() argument must be a string or a real number, not None")
+    try:
+        return pd.Series(values.astype(float), index=costi.index)
+    except ValueError:
+        pass
+
+    is_str = type_mask(costi, str)
+    values[is_str] = (
+        costi[is_str]
+        .str.replace(" ", "", regex=False)
+        .str.replace(",", ".", regex=False)
+    )
+    return pd.Series(values.astype(float), index=costi.index)
 
 
 def fix_types(df):
@@ -33,15 +106,9 @@ def fix_types(df):
     for k, typ in TYPES_MAP.items():
         if k == HEADERS["codice"]:
             # ogni tanto qualcuno aggiunge carattere in fondo a numero codice costo:
-            df.loc[:, k] = df.loc[:, k].apply(fix_codice_costo_alphanum)
+            df.loc[:, k] = _codici_to_int(df.loc[:, k])
         if k == HEADERS["costo_unit"]:
-            df.loc[:, k] = df.loc[:, k].apply(
-                lambda x: (
-                    typ(x.replace(" ", "").replace(",", "."))
-                    if type(x) is str
-                    else typ(x)
-                )
-            )
+            df.loc[:, k] = _costi_to_float(df.loc[:, k])
         else:
             df.loc[:, k] = df.loc[:, k].astype(typ)
 
@@ -63,12 +130,12 @@ def crop_costi(df):
         return
 
     # Foglio non vuoto ma nessuna voce valida (letto con nans):
-    if df.values.dtype == np.float64:
+    if all(dtype == np.float64 for dtype in df.dtypes):
         return
 
     try:
-        # Trova COSTI e salta un certo numero di righe fissato
-        costi_cells = np.argwhere(df.values == HEADERS["costi_start"])
+        # Trova COSTI (o traduzioni) e salta un certo numero di righe fissato
+        costi_cells = np.argwhere(df.isin(COSTI_START_LABELS).values)
         if (
             costi_cells.shape[0] > 1
         ):  # Found at least 1 funny case of a duplicated COSTI row, invisible in the xls file
@@ -81,8 +148,8 @@ def crop_costi(df):
     # Setta la prima riga come header:
     cropped_df = df.iloc[start_costi:, :N_COLONNE].copy()
 
-    # Trova headers delle colonne nella prima riga:
-    colonne = list(cropped_df.iloc[0, :])
+    # Trova headers delle colonne nella prima riga, traducendoli se serve:
+    colonne = [_translate_header(val) for val in cropped_df.iloc[0, :]]
     # Per come è fatto il file questa cella ha una tipologia anzichè un header:
     colonne[1] = HEADERS["voce"]
 
@@ -94,42 +161,73 @@ def crop_costi(df):
     return cropped_df
 
 
-def _is_tipologia_header(row, commessa, fase, tipologie_skip=None):
-    """Controlla se la riga corrente e' una voce o l'header di una
-    nuova tipologia di voci ("Personale", "Noli", etc).
+def compile_tipologie_skip(tipologie_skip):
+    """Converte la tabella delle tipologie da saltare in un set di chiavi
+    (commessa, fase, tipologia), da calcolare una volta sola per run.
 
-    Siccome alcune correzione sono fatte su fogli specifici, per ora
-    serve propagare fino a qui l'info su commessa e fase.
+    Parameters
+    ----------
+    tipologie_skip : pd.DataFrame
+        Tabella con colonne "commessa", "fase" e "tipologia".
+
+    Returns
+    -------
+    frozenset of tuple
+        Le chiavi delle tipologie da saltare.
     """
-    if type(row.iloc[1]) is not str:
-        return False
+    if tipologie_skip is None:
+        return None
+
+    return frozenset(
+        zip(
+            tipologie_skip["commessa"],
+            tipologie_skip["fase"],
+            tipologie_skip["tipologia"],
+        )
+    )
 
+
+def commessa_number(commessa):
+    """Numero della commessa dal nome della sua cartella."""
     try:
-        int_commessa = int(commessa)
+        return int(commessa)
     except ValueError:
-        int_commessa = int(commessa[:4])  # Alcune cartelle hanno XXX-Preventivo
+        return int(commessa[:4])  # Alcune cartelle hanno XXX-Preventivo
+
+
+def _tipologia_header_mask(df, commessa, fase, tipologie_skip=None):
+    """Controlla quali righe sono l'header di una nuova tipologia di voci
+    ("Personale", "Noli", etc) anziche' delle voci.
+
+    Siccome alcune correzione sono fatte su fogli specifici, per ora
+    serve propagare fino a qui l'info su commessa e fase.
+    """
+    labels = df.iloc[:, TIPOLOGIA_IDX]
+    units = df.iloc[:, TIPOLOGIA_IDX + 1]
+
+    is_header = type_mask(labels, str)
+    if not is_header.any():
+        return is_header
+
+    int_commessa = commessa_number(commessa)
 
     # Esclusione a mano di alcuni casi specifici in cui pseudo headers di
     # tipologia sono a uso interno commessa e quindi da evitare::
     if tipologie_skip is not None:
-        conditions_matched = sum(
-            (tipologie_skip["tipologia"] == row.iloc[1])
-            & (tipologie_skip["commessa"] == int_commessa)
-            & (tipologie_skip["fase"] == fase)
-        )
-
-        if conditions_matched:
-            logging.warning(f"Ignoro header '{row.iloc[1]}' in  {commessa}/{fase}")
-            return False
+        for i in np.flatnonzero(is_header):
+            if (int_commessa, fase, labels.iat[i]) in tipologie_skip:
+                logging.warning(
+                    f"Ignoro header '{labels.iat[i]}' in  {commessa}/{fase}"
+                )
+                is_header[i] = False
 
-    if type(row.iloc[2]) is str:
-        if row.iloc[2] != HEADERS["units"]:
-            return False
-    else:
-        if not np.isnan(row.iloc[2]):
-            return False
+    # La colonna delle unita' di misura deve essere vuota o contenere l'header:
+    units_is_str = type_mask(units, str)
+    units_ok = np.where(
+        units_is_str, (units == HEADERS["units"]).to_numpy(), units.isna().to_numpy()
+    )
 
-    return True
+    return is_header & units_ok
 
 
 def add_tipologia_column(df, commessa, fase, tipologie_skip=None):
@@ -139,6 +237,8 @@ def add_tipologia_column(df, commessa, fase, tipologie_skip=None):
     Parameters
     ----------
     df : pd.DataFrame
+    tipologie_skip : frozenset of tuple, optional
+        Chiavi (commessa, fase, tipologia) da `compile_tipologie_skip`.
 
     Returns
     -------
@@ -148,49 +248,43 @@ def add_tipologia_column(df, commessa, fase, tipologie_skip=None):
     """
     df = df.copy()  # lavora in copia
 
-    df[HEADERS["tipologia"]] = ""
+    # Ogni header di tipologia vale per tutte le righe seguenti, fino al prossimo:
+    is_header = _tipologia_header_mask(
+        df, commessa, fase, tipologie_skip=tipologie_skip
+    )
+    tipologie = df.iloc[:, TIPOLOGIA_IDX].where(is_header).ffill()
 
-    current_tipologia = ""  # sovrascriveremo il valore nel loop
-    for row_i, row in enumerate(df.index):
-        # Se c'è una nuova tipologia, aggiorna current_tipologia:
-        if _is_tipologia_header(
-            df.iloc[row_i, :], commessa, fase, tipologie_skip=tipologie_skip
-        ):
-            current_tipologia = df.iloc[row_i, TIPOLOGIA_IDX]
-
-        df.loc[row, HEADERS["tipologia"]] = current_tipologia
+    df[HEADERS["tipologia"]] = tipologie.fillna("").to_numpy()
 
     return df
 
 
-def _diagnose_consistence(df, key):
-    if not len(set(df[key])) == 1:
-        return set(df[key])
-    else:
-        return np.nan
-
-
-def _map_consistent_voce(df, key):
-    return df[key].values[0]
-
-
 def fix_voice_consistency(df):
-    # Create report of inconsistent voices:
-    consistence_report = df.groupby("codice").apply(_diagnose_consistence, "voce")
+    """Uniforma la descrizione delle voci con lo stesso codice costo, usando quella
+    della prima riga, e riporta i codici con descrizioni diverse.
 
-    with warnings.catch_warnings():
-        warnings.filterwarnings(
-            "ignore",
-            message="Boolean Series key will be reindexed to match DataFrame index.",
-        )
-        consistence_report = consistence_report[
-            consistence_report.apply(lambda x: type(x) is not float)
-        ]
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Voci di costo; la colonna "voce" viene sostituita.
 
-    # Fix inconsistent voices:
-    codice_mapping = df.groupby("codice").apply(_map_consistent_voce, "voce")
-    # try:
+    Returns
+    -------
+    pd.DataFrame
+        Il dataframe con le voci corrette.
+    pd.Series
+        Per ogni codice con descrizioni diverse, il set delle descrizioni.
+    """
+    # Create report of inconsistent voices (sets only for the inconsistent codici):
+    n_voci = df.groupby("codice")["voce"].nunique(dropna=False)
+    inconsistent = df[df["codice"].isin(n_voci.index[n_voci > 1])]
+    consistence_report = (
+        inconsistent.groupby("codice")["voce"].unique().map(set).rename(None)
+    )
+
+    # Fix inconsistent voices, using the first row of each codice:
+    first_rows = df[df["codice"].notna()].drop_duplicates("codice")
+    codice_mapping = first_rows.set_index("codice")["voce"]
     df["voce"] = df["codice"].map(codice_mapping)
-    # except ValueError:
 
     return df, consistence_report
@@ -1,10 +1,71 @@
 import hashlib
+import importlib.util
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import lru_cache
 from pathlib import Path
 
-import git
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from pyconsolida.sheet_specs import CACHE_PATH, DATA_PATH
+from pyconsolida.sheet_specs import CACHE_PATH
+from pyconsolida.tabellone_store import STORE_FILENAME
+
+try:
+    import fcntl
+except ImportError:  # Windows: niente lock tra processi
+    fcntl = None
+
+# Sottocartella della cache con i file letti, indicizzati per contenuto:
+STORE_SUBDIR = "store"
+
+# Formati dei file della cache. Con "parquet" ogni file letto e' salvato in un unico
+# file, con report di consistenza e log nei metadati; con "pickle" in tre file
+# (dati, report e log). Se un file non si puo' salvare in parquet si usa pickle.
+CACHE_FORMATS = ["parquet", "pickle"]
+DEFAULT_CACHE_FORMAT = "parquet"
+PARQUET_METADATA_KEY = b"pyconsolida"
+# Formato delle voci dei file la cui lettura e' fallita (vedi `quarantine` in
+# `read_full_budget_cached`), che contengono solo il traceback dell'errore:
+FAILURE_FORMAT = "failure"
+
+# Sottocartella della cache con i file di lock, condivisi tra tutti i processi:
+LOCKS_SUBDIR = "locks"
+
+# Indice della cache, con gli hash dei file dati e le voci salvate:
+MANIFEST_FILENAME = "manifest.json"
+HASH_BUFFER_SIZE = 1024 * 1024  # byte letti alla volta per calcolare gli hash
+FOLDER_HASH_CACHE_SIZE = 4096  # hash di cartelle tenuti in memoria
+
+# Dimensione massima in byte delle voci della cache: oltre, a fine esecuzione si
+# cancellano quelle usate meno di recente (None per non porre limiti). E' qui e non
+# in sheet_specs perche' modificarla non deve invalidare la cache.
+CACHE_MAX_BYTES = 2 * 1024**3
+# File nella cartella store senza voce nel manifest, cancellati solo se piu' vecchi
+# di cosi' (secondi) per non toccare file appena scritti da un'altra esecuzione:
+ORPHAN_MIN_AGE = 24 * 3600
+
+# Moduli il cui codice determina il risultato della lettura dei file analisi: una
+# modifica a uno di questi invalida la cache.
+PARSER_MODULES = [
+    "pyconsolida.budget_reader",
+    "pyconsolida.budget_reader_utils",
+    "pyconsolida.df_utils",
+    "pyconsolida.excel_readers",
+    "pyconsolida.sheet_specs",
+]
+
+# Da incrementare a mano per invalidare tutta la cache quando cambia il risultato
+# della lettura senza modifiche ai moduli sopra (es. nuova versione di pandas):
+PARSER_SCHEMA_VERSION = 1
 
 
 def _remove_cache_folder(folder: Path):
@@ -24,6 +85,11 @@ def flush_cache_subfolder(folder: Path):
 
 def flush_all_cache(folder: Path = CACHE_PATH):
     """Remove all cached data folders and their contents."""
+    # (import locali: folder_read_utils e rule_engine usano `atomic_write` di questo
+    # modulo)
+    from pyconsolida.folder_read_utils import CATALOGUE_FILENAME
+    from pyconsolida.rule_engine import MATCHES_FILENAME
+
     folder = Path(folder)
 
     # Find all cache folders matching the pattern /*/*/*/cached
@@ -31,38 +97,542 @@ def flush_all_cache(folder: Path = CACHE_PATH):
     for cache_folder in cache_folders:
         _remove_cache_folder(cache_folder)
 
+    for subfolder in [STORE_SUBDIR, LOCKS_SUBDIR]:
+        if (folder / subfolder).exists():
+            _remove_cache_folder(folder / subfolder)
 
-@lru_cache(maxsize=1)
-def get_repo_version():
-    N_HASH_CHARS = 6
+    for cache_filename in [
+        MANIFEST_FILENAME,
+        STORE_FILENAME,
+        CATALOGUE_FILENAME,
+        MATCHES_FILENAME,
+    ]:
+        if (folder / cache_filename).exists():
+            (folder / cache_filename).unlink()
+    _cache_manifests.pop(folder, None)
+
+
+@contextmanager
+def file_lock(lock_path: Path, description=None):
+    """Lock esclusivo tra processi sul file `lock_path` (advisory, con flock):
+    se un altro processo ha il lock, si aspetta che lo rilasci.
+
+    Parameters
+    ----------
+    lock_path : Path
+        File di lock, creato se non esiste e mai cancellato.
+    description : str, optional
+        Cosa si sta aspettando, per il log.
+    """
+    lock_path = Path(lock_path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logging.info(f"Attendo un altro processo: {description or lock_path}")
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def entry_lock(cache_root: Path, entry_key: str):
+    """Lock su una voce della cache, da tenere mentre la si calcola e la si scrive.
+
+    Per non accumulare file, le voci condividono 256 file di lock in base ai primi
+    due caratteri (esadecimali) della chiave: due voci diverse con lo stesso lock
+    vengono solo calcolate una dopo l'altra.
+    """
+    return file_lock(
+        Path(cache_root) / LOCKS_SUBDIR / f"{entry_key[:2]}.lock",
+        description=f"voce della cache {entry_key}",
+    )
+
+
+def store_lock(cache_root: Path):
+    """Lock sull'archivio del tabellone (vedi `tabellone_store`), da tenere finche'
+    lo si usa: su cartelle di rete i lock di SQLite non sono affidabili, per cui
+    l'archivio e' usato da un'esecuzione alla volta.
+    """
+    return file_lock(
+        Path(cache_root) / LOCKS_SUBDIR / "tabellone_store.lock",
+        description="archivio del tabellone",
+    )
 
-    repo = git.Repo(search_parent_directories=True)
-    sha = repo.head.object.hexsha
-    return sha[:N_HASH_CHARS]
+
+@contextmanager
+def atomic_write(filename: Path):
+    """Fornisce un file temporaneo nella stessa cartella di `filename`, rinominato in
+    `filename` solo a scrittura completata: chi legge non trova mai file a meta'.
+    """
+    filename = Path(filename)
+    temp_filename = filename.with_name(f"{filename.name}.{os.getpid()}.tmp")
+    try:
+        yield temp_filename
+        os.replace(temp_filename, filename)
+    finally:
+        temp_filename.unlink(missing_ok=True)
+
+
+def collect_garbage(
+    cache_root: Path = CACHE_PATH, max_bytes=CACHE_MAX_BYTES, dry_run=False
+):
+    """Cancella le voci della cache usate meno di recente, finche' la dimensione
+    totale non rientra in `max_bytes`.
+
+    Dimensioni e ultimi accessi sono quelli registrati nel manifest (vedi
+    `CacheManifest`), senza leggere i metadati dei file. I file della cartella store
+    che non appartengono a nessuna voce (es. scritti da esecuzioni interrotte) sono
+    cancellati comunque, prima delle altre voci. Le modifiche al manifest vanno
+    salvate con `save_manifests`.
+
+    Parameters
+    ----------
+    cache_root : Path
+        Cartella della cache.
+    max_bytes : int, optional
+        Dimensione massima in byte; se None si cancellano solo i file orfani.
+    dry_run : bool
+        Se True non cancella nulla, e riporta solo cosa verrebbe cancellato.
+
+    Returns
+    -------
+    pd.DataFrame
+        Voci cancellate (o da cancellare), dalla meno recente, con nome, formato,
+        dimensione, ultimo accesso e se si tratta di un file orfano.
+    """
+    manifest = get_cache_manifest(cache_root)
+    store_directory = get_store_directory(cache_root, create_if_missing=False)
+
+    rows = []
+    entries_files = {}
+    for entry_key, entry in manifest.entries.items():
+        script_hash, cache_format, size, last_access = _full_entry(entry)
+        entry_files = _cache_entry_files(
+            store_directory / f"{entry_key}_{script_hash}", cache_format
+        )
+        if size is None:
+            size = sum(f.stat().st_size for f in entry_files if f.exists())
+        entries_files[entry_key] = entry_files
+        rows.append((entry_key, cache_format, size, last_access, False))
+
+    known_files = {f.name for files in entries_files.values() for f in files}
+    now = time.time()
+    if store_directory.exists():
+        with os.scandir(store_directory) as dir_entries:
+            for dir_entry in dir_entries:
+                if dir_entry.name in known_files or not dir_entry.is_file():
+                    continue
+                stat = dir_entry.stat()
+                if now - stat.st_mtime >= ORPHAN_MIN_AGE:
+                    rows.append(
+                        (dir_entry.name, None, stat.st_size, stat.st_mtime, True)
+                    )
+
+    report = pd.DataFrame(
+        rows, columns=["voce", "formato", "byte", "ultimo_accesso", "orfano"]
+    )
+    # Prima gli orfani, poi le voci dalla meno recente:
+    report = report.sort_values(
+        ["orfano", "ultimo_accesso"], ascending=[False, True], ignore_index=True
+    )
+    total_bytes = report["byte"].sum()
+    remaining_bytes = total_bytes - report["byte"].cumsum() + report["byte"]
+    to_remove = report["orfano"].astype(bool)
+    if max_bytes is not None:
+        to_remove = to_remove | (remaining_bytes > max_bytes)
+    report = report[to_remove].reset_index(drop=True)
+    report["ultimo_accesso"] = pd.to_datetime(report["ultimo_accesso"], unit="s")
+
+    if not dry_run:
+        for entry_key, orphan in zip(report["voce"], report["orfano"]):
+            if orphan:
+                (store_directory / entry_key).unlink(missing_ok=True)
+                continue
+            for entry_file in entries_files[entry_key]:
+                entry_file.unlink(missing_ok=True)
+            manifest.remove_entry(entry_key)
+
+    logging.info(
+        f"Cache {cache_root}: {total_bytes / 1e6:.1f} MB, limite "
+        f"{'nessuno' if max_bytes is None else f'{max_bytes / 1e6:.1f} MB'}; "
+        f"{'da cancellare' if dry_run else 'cancellate'} {len(report)} voci "
+        f"({report['byte'].sum() / 1e6:.1f} MB)"
+    )
+    return report
 
 
 @lru_cache(maxsize=1)
-def get_folder_hash(folder_path):
-    """Compute SHA-256 hash of all files in a folder using pathlib."""
-    N_HASH_CHARS = 10
-    SUFFIX_TO_EXCLUDE = [".pdf", ".docx", ".doc", ".msg"]
+def get_parser_fingerprint():
+    """Compute SHA-256 hash of the source of the parser modules and of the schema
+    version. Unlike the git commit, it changes only when the parsing code changes.
+    """
+    N_HASH_CHARS = 6
     sha256_hash = hashlib.sha256()
-    # Create a Path object for the folder
-    folder = Path(folder_path)
-    # Iterate over all files in the folder, excluding subfolders
-    # It used to be including subfolders, but it was slow and not really needed
-    for file_path in sorted(folder.glob("*")):
-        # escludo cache e empty folders:
+    sha256_hash.update(f"schema:{PARSER_SCHEMA_VERSION}".encode("utf-8"))
+    for module_name in PARSER_MODULES:
+        module_path = Path(importlib.util.find_spec(module_name).origin)
+        sha256_hash.update(module_path.read_bytes())
+    return sha256_hash.hexdigest()[:N_HASH_CHARS]
+
+
+def hash_file_content(file_path):
+    """Compute BLAKE2 hash of the content of a file, reading it in large blocks."""
+    blake2_hash = hashlib.blake2b(digest_size=32)
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        while n_bytes := f.readinto(buffer):
+            blake2_hash.update(view[:n_bytes])
+    return blake2_hash.hexdigest()
+
+
+def get_stat_fingerprint(stat):
+    """Metadati di un file che cambiano quando cambia il contenuto."""
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+class HashCache:
+    """Cache LRU di hash in memoria, di dimensione limitata e thread-safe.
+
+    Le chiavi devono includere i metadati dei file (vedi `get_stat_fingerprint`),
+    cosi' che un file modificato non restituisca un hash vecchio.
+
+    Parameters
+    ----------
+    maxsize : int
+        Numero massimo di hash tenuti in memoria; oltre vengono scartati quelli
+        usati meno di recente.
+    """
+
+    def __init__(self, maxsize=FOLDER_HASH_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the hash for `key`, or None if not in the cache."""
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CacheManifest:
+    """Indice di una cartella cache, letto una volta all'inizio e salvato alla fine
+    dell'esecuzione, per non interrogare il filesystem per ogni file.
+
+    Contiene:
+     - gli hash del contenuto dei file dati, salvati insieme ai metadati del file
+       (dimensione, mtime e inode): finche' questi non cambiano il file non viene
+       riletto;
+     - le voci della cache dei file letti (vedi `write_cache_entry`), con versione del
+       parser, formato, dimensione in byte e ultimo accesso (per `collect_garbage`).
+
+    Parameters
+    ----------
+    cache_root : Path, optional
+        Cartella della cache. Se None, il manifest resta in memoria e non viene
+        salvato.
+    """
+
+    def __init__(self, cache_root=None):
+        self.cache_root = None if cache_root is None else Path(cache_root)
+        self.files = {}
+        self.entries = {}
+        self.updates = {"files": {}, "entries": {}}
+        self.obsolete = set()  # voci da cancellare dalla cache al salvataggio
+        self.verified = set()  # file riletti in questa esecuzione
+        self.hits = 0
+        self.misses = 0
+        self._store_directory = None
+
+        if self.filename is not None:
+            saved = self._load()
+            self.files = saved["files"]
+            self.entries = saved["entries"]
+
+    @property
+    def filename(self):
+        if self.cache_root is None:
+            return None
+        return self.cache_root / MANIFEST_FILENAME
+
+    def _load(self):
+        try:
+            with open(self.filename, "r") as f:
+                saved = json.load(f)
+            return {"files": saved["files"], "entries": saved["entries"]}
+        except (OSError, ValueError, KeyError):
+            # Un manifest mancante o illeggibile vuol dire solo ricalcolare tutto:
+            return {"files": {}, "entries": {}}
+
+    @property
+    def store_directory(self):
+        """Cartella delle voci della cache, creata alla prima richiesta."""
+        if self._store_directory is None:
+            self._store_directory = get_store_directory(self.cache_root)
+        return self._store_directory
+
+    def get_file_hash(self, file_path, verify=False, stat=None):
+        """Hash del contenuto di un file, ricalcolato solo se i metadati del file
+        sono cambiati o se `verify` e' True (in questo caso una volta sola per
+        esecuzione). Si puo' passare `stat` se gia' letto.
+        """
+        file_path = Path(file_path).absolute()
+        if stat is None:
+            stat = file_path.stat()
+        stat_fingerprint = get_stat_fingerprint(stat)
+
+        key = str(file_path)
+        entry = self.files.get(key)
         if (
-            file_path.is_file()
-            and file_path.parent.name != "cached"
-            and file_path.suffix not in SUFFIX_TO_EXCLUDE
+            entry is not None
+            and entry[:-1] == stat_fingerprint
+            and (not verify or key in self.verified)
         ):
-            # Hash each file
-            with open(file_path, "rb") as f:
-                for byte_block in iter(lambda: f.read(4096), b""):
-                    sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()[:N_HASH_CHARS]
+            self.hits += 1
+            return entry[-1]
+
+        self.misses += 1
+        entry = stat_fingerprint + [hash_file_content(file_path)]
+        self.files[key] = entry
+        self.updates["files"][key] = entry
+        self.verified.add(key)
+        return entry[-1]
+
+    def get_entry_format(self, entry_key, script_hash):
+        """Formato della voce della cache `entry_key` salvata con la versione del
+        parser `script_hash`, o None se non c'e'.
+        """
+        entry = self.entries.get(entry_key)
+        if entry is None or entry[0] != script_hash:
+            return None
+        return entry[1]
+
+    def add_entry(self, entry_key, script_hash, cache_format):
+        """Registra una voce scritta nella cache. Una voce con la stessa chiave e
+        un'altra versione del parser viene cancellata al salvataggio.
+        """
+        entry_files = _cache_entry_files(
+            self.store_directory / f"{entry_key}_{script_hash}", cache_format
+        )
+        size = sum(entry_file.stat().st_size for entry_file in entry_files)
+        entry = [script_hash, cache_format, size, time.time()]
+
+        old_entry = self.entries.get(entry_key)
+        if old_entry is not None and old_entry[0] != script_hash:
+            self.obsolete.add(f"{entry_key}_{old_entry[0]}")
+        self.entries[entry_key] = entry
+        self.updates["entries"][entry_key] = entry
+
+    def touch_entry(self, entry_key):
+        """Registra l'accesso a una voce letta dalla cache."""
+        entry = self.entries.get(entry_key)
+        if entry is None:
+            return
+        entry = _full_entry(entry)
+        entry[3] = time.time()
+        self.entries[entry_key] = entry
+        self.updates["entries"][entry_key] = entry
+
+    def remove_entry(self, entry_key):
+        """Dimentica una voce i cui file non si trovano piu'."""
+        self.entries.pop(entry_key, None)
+        self.updates["entries"][entry_key] = None
+
+    def pop_updates(self):
+        """Return and forget the changes made since the last call, to be merged in
+        the manifest of another process with `merge`.
+        """
+        updates = dict(self.updates, obsolete=sorted(self.obsolete))
+        self.updates = {"files": {}, "entries": {}}
+        self.obsolete = set()
+        return updates
+
+    def _apply(self, updates):
+        self.files.update(updates["files"])
+        for entry_key, entry in updates["entries"].items():
+            if entry is None:
+                self.entries.pop(entry_key, None)
+            else:
+                self.entries[entry_key] = entry
+
+    def merge(self, updates):
+        self._apply(updates)
+        self.updates["files"].update(updates["files"])
+        self.updates["entries"].update(updates["entries"])
+        self.obsolete.update(updates["obsolete"])
+
+    def save(self):
+        """Save the changes, if any, in a single write.
+
+        The changes are applied on the manifest currently on disk, under a lock
+        shared by all the processes, so that entries written in the meantime by
+        other runs are not lost, and the file is replaced atomically. The files of
+        obsolete entries are deleted.
+        """
+        if self.filename is None or not (
+            self.updates["files"] or self.updates["entries"] or self.obsolete
+        ):
+            return
+
+        for entry_name in self.obsolete:
+            for entry_file in get_cache_entry_files(self.store_directory / entry_name):
+                entry_file.unlink(missing_ok=True)
+
+        with file_lock(
+            self.cache_root / LOCKS_SUBDIR / f"{MANIFEST_FILENAME}.lock",
+            description=f"salvataggio di {self.filename}",
+        ):
+            saved = self._load()
+            self.files, self.entries = saved["files"], saved["entries"]
+            self._apply(self.updates)
+
+            with atomic_write(self.filename) as temp_filename:
+                with open(temp_filename, "w") as f:
+                    json.dump({"files": self.files, "entries": self.entries}, f)
+        self.updates = {"files": {}, "entries": {}}
+        self.obsolete = set()
+
+
+def _full_entry(entry):
+    # Le voci salvate senza dimensione e accesso contano come mai usate:
+    return list(entry) + [None, 0.0][len(entry) - 2 :]
+
+
+_cache_manifests = {}
+
+
+def get_cache_manifest(cache_root: Path = CACHE_PATH):
+    """Manifest della cache in `cache_root`, caricato una volta sola per processo."""
+    cache_root = Path(cache_root)
+    if cache_root not in _cache_manifests:
+        _cache_manifests[cache_root] = CacheManifest(cache_root)
+    return _cache_manifests[cache_root]
+
+
+def pop_manifests_updates():
+    """Changes made by this process since the last call, for all the manifests.
+    Used to send the changes made in worker processes to the main process.
+    """
+    return {
+        cache_root: manifest.pop_updates()
+        for cache_root, manifest in _cache_manifests.items()
+    }
+
+
+def merge_manifests_updates(updates):
+    """Merge the changes returned by `pop_manifests_updates` in another process."""
+    for cache_root, manifest_updates in updates.items():
+        get_cache_manifest(cache_root).merge(manifest_updates)
+
+
+def save_manifests():
+    """Save all the manifests loaded in this process."""
+    for manifest in _cache_manifests.values():
+        manifest.save()
+
+
+_folder_hash_cache = HashCache(maxsize=FOLDER_HASH_CACHE_SIZE)
+
+
+def get_folder_hash(folder_path, verify=False, cache_root: Path = CACHE_PATH):
+    """Compute BLAKE2 hash of all files in a folder, from the hashes of the single
+    files in the manifest of the cache in `cache_root`. The result is kept in
+    memory, keyed on the folder path and the metadata of its files.
+    """
+    N_HASH_CHARS = 10
+    SUFFIX_TO_EXCLUDE = [".pdf", ".docx", ".doc", ".msg"]
+    folder = Path(folder_path).absolute()
+    # Only the files in the folder, excluding subfolders (it used to include them,
+    # but it was slow and not really needed). With scandir the file type comes with
+    # the listing and each file is stat'ed once:
+    files_stats = []
+    if folder.name != "cached":
+        with os.scandir(folder) as dir_entries:
+            for entry in dir_entries:
+                if (
+                    entry.is_file()
+                    and os.path.splitext(entry.name)[1] not in SUFFIX_TO_EXCLUDE
+                ):
+                    files_stats.append((entry.name, entry.stat()))
+    files_stats.sort()
+
+    key = (
+        str(folder),
+        tuple((name, *get_stat_fingerprint(stat)) for name, stat in files_stats),
+    )
+    if not verify:
+        folder_hash = _folder_hash_cache.get(key)
+        if folder_hash is not None:
+            return folder_hash
+
+    manifest = get_cache_manifest(cache_root)
+    blake2_hash = hashlib.blake2b()
+    for name, stat in files_stats:
+        blake2_hash.update(
+            manifest.get_file_hash(folder / name, verify=verify, stat=stat).encode(
+                "utf-8"
+            )
+        )
+    folder_hash = blake2_hash.hexdigest()[:N_HASH_CHARS]
+
+    _folder_hash_cache.put(key, folder_hash)
+    return folder_hash
+
+
+def get_hash_stats():
+    """Contatori di hash riusati (hits) e calcolati (misses) in questo processo,
+    per le cartelle e per i singoli file.
+    """
+    stats = {
+        "cartelle_hits": _folder_hash_cache.hits,
+        "cartelle_misses": _folder_hash_cache.misses,
+        "file_hits": 0,
+        "file_misses": 0,
+    }
+    for manifest in _cache_manifests.values():
+        stats["file_hits"] += manifest.hits
+        stats["file_misses"] += manifest.misses
+    return stats
+
+
+def get_file_hash(file_path, manifest=None, verify=False, cache_root=CACHE_PATH):
+    """Compute BLAKE2 hash of the content of a file, using the hash manifest (by
+    default the one of the cache in `cache_root`) to skip files that did not change.
+    """
+    N_HASH_CHARS = 16
+    if manifest is None:
+        manifest = get_cache_manifest(cache_root)
+    return manifest.get_file_hash(file_path, verify=verify)[:N_HASH_CHARS]
 
 
 def get_args_hash(**kwargs):
@@ -74,24 +644,250 @@ def get_args_hash(**kwargs):
     return sha256_hash.hexdigest()[:N_HASH_CHARS]
 
 
-def get_cache_directory(
-    target_subdir: str,
-    data_path: Path = DATA_PATH,
-    cache_root: Path = CACHE_PATH,
-    create_if_missing: bool = True,
-):
-    """Ensure the corresponding cache directory exists."""
-    data_path = Path(data_path).resolve()
-    target_subdir = Path(target_subdir).resolve()
+def _to_plain(value):
+    """Convert numpy scalars to plain Python types, also inside tuples."""
+    if isinstance(value, tuple):
+        return tuple(_to_plain(v) for v in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
 
-    if not target_subdir.is_relative_to(data_path):
-        print(
-            f"Target subdirectory {target_subdir} is not inside data_path {data_path}"
-        )
-        raise ValueError("Target subdirectory is not inside data_path")
 
-    relative_subdir = target_subdir.relative_to(data_path)
-    cache_dir = Path(cache_root) / relative_subdir / "cached"
+def get_set_hash(values: frozenset):
+    """Compute a SHA-256 hash of a set that does not depend on iteration order.
+
+    Values (and the elements of tuple values, as the (commessa, fase, tipologia) keys
+    of `compile_tipologie_skip`) are converted to plain Python types first, so that
+    the hash depends neither on the numpy version nor on numpy vs Python integers.
+    """
+    return _get_plain_set_hash(frozenset(_to_plain(v) for v in values))
+
+
+@lru_cache(maxsize=8)
+def _get_plain_set_hash(values: frozenset):
+    N_HASH_CHARS = 10
+    sha256_hash = hashlib.sha256()
+    for value in sorted(json.dumps(v, default=str) for v in values):
+        sha256_hash.update(value.encode("utf-8"))
+    return sha256_hash.hexdigest()[:N_HASH_CHARS]
+
+
+def get_store_directory(cache_root: Path = CACHE_PATH, create_if_missing: bool = True):
+    """Directory of the content-addressed store shared by all data folders."""
+    store_dir = Path(cache_root) / STORE_SUBDIR
     if create_if_missing:
-        cache_dir.mkdir(parents=True, exist_ok=True)
-    return cache_dir
+        store_dir.mkdir(parents=True, exist_ok=True)
+    return store_dir
+
+
+def _cache_entry_files(cache_base: Path, cache_format: str):
+    """Files that make up a cache entry in the given format."""
+    if cache_format == "parquet":
+        return [cache_base.parent / f"{cache_base.name}.parquet"]
+    elif cache_format == "pickle":
+        return [
+            cache_base.parent / f"{cache_base.name}.pickle",
+            cache_base.parent / f"{cache_base.name}_consistency.pickle",
+            cache_base.parent / f"{cache_base.name}_log.txt",
+        ]
+    elif cache_format == FAILURE_FORMAT:
+        return [cache_base.parent / f"{cache_base.name}_failure.txt"]
+    raise ValueError(f"Formato cache non valido: {cache_format}, usare {CACHE_FORMATS}")
+
+
+def find_cache_entry(cache_base: Path):
+    """Formato di una voce completa trovata su disco (es. scritta da un altro
+    processo e non ancora nel manifest), o None se non c'e'.
+    """
+    for cache_format in CACHE_FORMATS + [FAILURE_FORMAT]:
+        if all(f.exists() for f in _cache_entry_files(cache_base, cache_format)):
+            return cache_format
+    return None
+
+
+def get_cache_entry_files(cache_base: Path):
+    """All the files that a cache entry could have, in any format."""
+    return [
+        entry_file
+        for cache_format in CACHE_FORMATS + [FAILURE_FORMAT]
+        for entry_file in _cache_entry_files(cache_base, cache_format)
+    ]
+
+
+def _report_to_json(consistency_report):
+    # Il report e' una lista vuota o una serie codice -> set di voci:
+    if len(consistency_report) == 0:
+        return None
+    return {
+        "name": consistency_report.name,
+        "index_name": consistency_report.index.name,
+        "index": consistency_report.index.tolist(),
+        "values": [list(voci) for voci in consistency_report],
+    }
+
+
+def _report_from_json(report_json):
+    if report_json is None:
+        return []
+    return pd.Series(
+        [set(voci) for voci in report_json["values"]],
+        index=pd.Index(report_json["index"], name=report_json["index_name"]),
+        name=report_json["name"],
+        dtype=object,
+    )
+
+
+def _write_parquet_entry(cache_base, df, consistency_report, log_messages):
+    metadata = {
+        "consistency_report": _report_to_json(consistency_report),
+        "log_messages": list(log_messages),
+        "dtypes": {column: str(dtype) for column, dtype in df.dtypes.items()},
+    }
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {
+            **(table.schema.metadata or {}),
+            PARQUET_METADATA_KEY: json.dumps(metadata).encode("utf-8"),
+        }
+    )
+    # Le stringhe sono salvate con dictionary encoding (default di parquet):
+    (entry_file,) = _cache_entry_files(cache_base, "parquet")
+    with atomic_write(entry_file) as temp_file:
+        pq.write_table(table, temp_file, use_dictionary=True)
+
+
+def _read_parquet_entry(cache_base, columns=None):
+    (entry_file,) = _cache_entry_files(cache_base, "parquet")
+    table = pq.read_table(entry_file, columns=columns, memory_map=True)
+    metadata = json.loads(table.schema.metadata[PARQUET_METADATA_KEY])
+
+    # Ripristina i tipi originali (es. colonne object con interi):
+    df = table.to_pandas()
+    df = df.astype(
+        {
+            column: dtype
+            for column, dtype in metadata["dtypes"].items()
+            if column in df.columns
+        }
+    )
+    return (
+        df,
+        _report_from_json(metadata["consistency_report"]),
+        metadata["log_messages"],
+    )
+
+
+def _write_pickle_entry(cache_base, df, consistency_report, log_messages):
+    data_file, consistency_file, log_file = _cache_entry_files(cache_base, "pickle")
+    # Il file dei dati per ultimo, cosi' che la voce sia completa quando compare:
+    with atomic_write(log_file) as temp_file:
+        with open(temp_file, "w") as f:
+            for log_message in log_messages:
+                f.write(f"{log_message}\n")
+    with atomic_write(consistency_file) as temp_file:
+        with open(temp_file, "wb") as f:
+            pickle.dump(consistency_report, f)
+    with atomic_write(data_file) as temp_file:
+        df.to_pickle(temp_file, compression=None)
+
+
+def _read_pickle_entry(cache_base, columns=None):
+    data_file, consistency_file, log_file = _cache_entry_files(cache_base, "pickle")
+    df = pd.read_pickle(data_file)
+    if columns is not None:
+        df = df[columns]
+    with open(consistency_file, "rb") as f:
+        consistency_report = pickle.load(f)
+    with open(log_file, "r") as f:
+        log_messages = f.read().splitlines()
+    return df, consistency_report, log_messages
+
+
+def write_cache_entry(
+    cache_base: Path,
+    df,
+    consistency_report,
+    log_messages,
+    cache_format: str = DEFAULT_CACHE_FORMAT,
+):
+    """Save the result of reading a file in the cache.
+
+    Parameters
+    ----------
+    cache_base : Path
+        Path of the entry, without extension.
+    df : pd.DataFrame
+        Voci di costo lette.
+    consistency_report : pd.Series or list
+        Report di consistenza delle voci.
+    log_messages : list of str
+        Messaggi di log della lettura.
+    cache_format : str
+        One of `CACHE_FORMATS`.
+
+    Returns
+    -------
+    str
+        Format actually used: falls back to pickle if the data can not be
+        converted to parquet (eg columns with mixed types).
+    """
+    _cache_entry_files(cache_base, cache_format)  # valida il formato
+    if cache_format == "parquet":
+        try:
+            _write_parquet_entry(cache_base, df, consistency_report, log_messages)
+            return "parquet"
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            logging.info(f"Salvo {cache_base} in pickle, non convertibile: {e}")
+
+    _write_pickle_entry(cache_base, df, consistency_report, log_messages)
+    return "pickle"
+
+
+def read_cache_entry(
+    cache_base: Path, cache_format: str = DEFAULT_CACHE_FORMAT, columns=None
+):
+    """Read an entry saved with `write_cache_entry`.
+
+    The format is the one returned by `write_cache_entry` and recorded in the
+    manifest, so that no check on the existing files is needed.
+
+    Parameters
+    ----------
+    cache_base : Path
+        Path of the entry, without extension.
+    cache_format : str
+        Format of the entry.
+    columns : list of str, optional
+        Columns to read; for parquet entries the others are not read at all.
+
+    Returns
+    -------
+    tuple
+        (df, consistency_report, log_messages).
+
+    Raises
+    ------
+    FileNotFoundError
+        If the files of the entry are missing.
+    """
+    if cache_format == "parquet":
+        return _read_parquet_entry(cache_base, columns=columns)
+    elif cache_format == "pickle":
+        return _read_pickle_entry(cache_base, columns=columns)
+    raise ValueError(f"Formato cache non valido: {cache_format}, usare {CACHE_FORMATS}")
+
+
+def write_failure_entry(cache_base: Path, error_traceback: str):
+    """Save in the cache the traceback of a file that could not be read, so that
+    it is not read again until its content or the parser change.
+    """
+    (failure_file,) = _cache_entry_files(cache_base, FAILURE_FORMAT)
+    with atomic_write(failure_file) as temp_file:
+        temp_file.write_text(error_traceback)
+    return FAILURE_FORMAT
+
+
+def read_failure_entry(cache_base: Path):
+    """Traceback saved with `write_failure_entry`."""
+    (failure_file,) = _cache_entry_files(cache_base, FAILURE_FORMAT)
+    return failure_file.read_text()
@@ -1,7 +1,10 @@
+from collections import defaultdict
 from datetime import datetime
 
 import pandas as pd
 
+from pyconsolida.folder_read_utils import data_from_commessa_folder
+
 
 def get_multiple_date_intervals(debug_mode=False):
     """Get multiple start-stop date intervals from user input."""
@@ -38,6 +41,54 @@ def input_data(data_name):
     return datetime(year=int(year), month=int(month), day=1)
 
 
+def get_interval_folders(folders, date_intervals, empty_folders=()):
+    """Seleziona le sole cartelle necessarie a calcolare i delta sugli intervalli.
+
+    Per ogni commessa e intervallo `get_tabellone_delta` usa solo il mese di inizio
+    (se esiste) e l'ultimo mese con voci entro la data di fine. Si selezionano quindi
+    la cartella del mese di inizio e l'ultima cartella entro la fine; se questa si e'
+    rivelata senza voci (file vuoti o in quarantena), la precedente, e cosi' via: le
+    cartelle vuote si scoprono solo leggendole, per cui la selezione va ripetuta dopo
+    ogni lettura (vedi `aggregations.load_loop_and_concat`).
+
+    Parameters
+    ----------
+    folders : list of Path
+        Tutte le cartelle commessa disponibili.
+    date_intervals : list of tuple
+        Coppie (inizio, fine) degli intervalli richiesti.
+    empty_folders : iterable of Path, optional
+        Cartelle gia' lette e risultate senza voci.
+
+    Returns
+    -------
+    list of Path
+        Le cartelle da leggere (incluse quelle vuote gia' lette), ordinate.
+    """
+    commessa_dates = defaultdict(lambda: defaultdict(list))
+    for folder in folders:
+        commessa_dates[folder.name][data_from_commessa_folder(folder)].append(folder)
+    empty_folders = set(empty_folders)
+
+    selected = set()
+    for dates in commessa_dates.values():
+        for t_start_date, t_stop_date in date_intervals:
+            in_range = sorted(d for d in dates if t_start_date <= d <= t_stop_date)
+            if not in_range:
+                continue
+
+            if in_range[0] == t_start_date:
+                selected.update(dates[t_start_date])
+
+            # Fine intervallo: ultimo mese non ancora risultato vuoto:
+            for data in reversed(in_range):
+                selected.update(dates[data])
+                if not empty_folders.issuperset(dates[data]):
+                    break
+
+    return sorted(selected)
+
+
 def _sum_repetitive_rows(input_df):
     new_index = ["commessa", "codice", "fase"]
     columns_to_sum = ["quantita", "imp.comp."]
@@ -47,11 +98,12 @@ def _sum_repetitive_rows(input_df):
     # ensure we first sum together all rows with identical ["commessa", "codice", "fase"] for columns
     # supporting summing, and we leave the rest as is - it will be filled with the first row
     df_summed = input_df.loc[:, new_index + columns_to_sum]
-    df_summed = df_summed.groupby(new_index).sum()
+    # observed: with categorical columns, only the combinations in the data
+    df_summed = df_summed.groupby(new_index, observed=True).sum()
 
     # for the other columns, we just take the first row:
     df_firstrow = input_df.loc[:, new_index + other_cols]
-    df_firstrow = df_firstrow.groupby(new_index).first()
+    df_firstrow = df_firstrow.groupby(new_index, observed=True).first()
     return pd.concat([df_summed, df_firstrow], axis=1)
 
 
@@ -81,29 +133,32 @@ def get_tabellone_delta(tabellone_df, t_start_date, t_stop_date):
             x, (pd.Timestamp, type(datetime.now()))
         ):  # Fixed: use concrete datetime type
             return x
+        if isinstance(x, pd.Period):
+            return x.to_timestamp()
         if isinstance(x, str):
             if len(x) == 7:  # YYYY-MM format
                 return pd.to_datetime(x + "-01")
             return pd.to_datetime(x)
         return pd.NaT
 
-    # Convert dates
-    tabellone_df["data"] = tabellone_df["data"].apply(convert_to_datetime)
-    in_range = tabellone_df[
-        (tabellone_df["data"] >= t_start_date) & (tabellone_df["data"] <= t_stop_date)
-    ]
-
-    min_dates = in_range.groupby("commessa")["data"].min()
-    max_dates = in_range.groupby("commessa")["data"].max()
-
-    start_df = in_range[in_range["data"] == in_range["commessa"].map(min_dates)]
+    # Convert dates, without changing the tabellone: in the compact schema the dates
+    # are monthly periods (see `schema`):
+    if isinstance(tabellone_df["data"].dtype, pd.PeriodDtype):
+        dates = tabellone_df["data"].dt.to_timestamp()
+    else:
+        dates = tabellone_df["data"].apply(convert_to_datetime)
+    in_range_mask = (dates >= t_start_date) & (dates <= t_stop_date)
+    in_range = tabellone_df[in_range_mask].assign(data=dates[in_range_mask])
+
+    by_commessa = in_range.groupby("commessa", observed=True)["data"]
+    start_df = in_range[in_range["data"] == by_commessa.transform("min")]
     # Ensure we do not subtract eg march 2024 if we are computing delta since december 2023
     # If beginning does not match t_start, the actual starting point is 0:
     start_df = start_df[start_df["data"] == t_start_date]
 
     start_df = _sum_repetitive_rows(start_df)
 
-    end_df = in_range[in_range["data"] == in_range["commessa"].map(max_dates)]
+    end_df = in_range[in_range["data"] == by_commessa.transform("max")]
     end_df = _sum_repetitive_rows(end_df)
 
     # Align:
@@ -113,7 +168,7 @@ def get_tabellone_delta(tabellone_df, t_start_date, t_stop_date):
     line_info_df = end_al_df.loc[:, ["tipologia", "voce", "u.m.", "costo u."]]
     # Trova indice campi rimasti nan:
     missing_info_idx = line_info_df[
-        line_info_df["tipologia"].apply(lambda x: type(x) is not str)
+        [type(x) is not str for x in line_info_df["tipologia"]]
     ].index
     line_info_df.loc[missing_info_idx, :] = start_al_df.loc[
         missing_info_idx, ["tipologia", "voce", "u.m.", "costo u."]
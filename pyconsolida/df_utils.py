@@ -18,31 +18,12 @@ def sum_selected_columns(df, groupby_key, cols_to_sum):
     """
     # Somma entrate da sommare:
     summed_quantities = df.groupby(groupby_key)[cols_to_sum].sum()
-    # Prendi valori statici per tutti gli altri:
-    info_quantities = df.groupby(groupby_key).apply(
-        _take_voce_static_vals, exclude=cols_to_sum
+    # Prendi valori statici per tutti gli altri, dalla prima riga di ogni chiave:
+    first_rows = df[df[groupby_key].notna()].drop_duplicates(groupby_key)
+    info_quantities = (
+        first_rows.drop(columns=cols_to_sum)
+        .set_index(groupby_key, drop=False)
+        .sort_index()
     )
 
     return pd.concat([summed_quantities, info_quantities], axis=1)
-
-
-def _take_voce_static_vals(df, exclude=None):
-    """Prende le info statiche (tutte salvo quantita' e importo complessivo)
-    relative alla voce costo, selezionando i valori della prima riga del dataframe.
-    Da usare sul dataframe aggregato per codice costo.
-
-    Parameters
-    ----------
-    df : pd.DataFrame
-        Input dataframe.
-    exclude : list of str
-        Colonne da escludere.
-
-    Returns
-    -------
-
-    """
-    if len(exclude) > 0:
-        df = df.drop(exclude, axis=1)
-
-    return df.iloc[0, :]
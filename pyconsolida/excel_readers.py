@@ -0,0 +1,236 @@
+"""Lettura dei fogli dei file analisi.
+
+Per ogni formato si usa il piu' veloce tra gli engine di lettura installati
+(vedi `ENGINES_PRIORITY`): calamine (libreria in Rust, opzionale) se disponibile,
+altrimenti openpyxl per i file .xlsx/.xlsm e xlrd per i .xls.
+
+Con openpyxl i fogli vengono letti in streaming in modalita' read_only, tenendo
+solo le prime `N_COLONNE` colonne e fermandosi alla riga dei totali, dopo la quale
+non ci sono costi da leggere.
+"""
+
+import importlib.util
+import warnings
+from functools import lru_cache, partial
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+
+from pyconsolida.budget_reader_utils import COSTI_START_LABELS
+from pyconsolida.sheet_specs import (
+    CODICE_COSTO_COL,
+    EXCLUDED_FASI,
+    N_COLONNE,
+    TOTALE_COSTI_LABELS,
+)
+
+
+def _convert_cell(cell):
+    """Converte il valore di una cella come fa pandas.read_excel con openpyxl."""
+    if cell.value is None:
+        return ""
+    elif cell.data_type == TYPE_ERROR:
+        return np.nan
+    elif cell.data_type == TYPE_NUMERIC:
+        val = int(cell.value)
+        if val == cell.value:
+            return val
+        return float(cell.value)
+
+    return cell.value
+
+
+def _read_sheet_rows(sheet, n_cols=N_COLONNE):
+    """Legge le righe di un foglio fino alla riga dei totali inclusa.
+
+    Ci si ferma solo a una riga dei totali che segue la casella "COSTI", e la
+    prima riga e' saltata nella ricerca perche' viene usata come header.
+    """
+    sheet.reset_dimensions()
+
+    data = []
+    last_row_with_data = -1
+    costi_found = False
+    for row in sheet.iter_rows(max_col=n_cols):
+        converted_row = [_convert_cell(cell) for cell in row]
+        while converted_row and converted_row[-1] == "":
+            converted_row.pop()
+        if converted_row:
+            last_row_with_data = len(data)
+        data.append(converted_row)
+
+        if len(data) == 1 or not converted_row:
+            continue
+        if any(val in COSTI_START_LABELS for val in converted_row):
+            costi_found = True
+        elif (
+            costi_found
+            and len(converted_row) > CODICE_COSTO_COL
+            and converted_row[CODICE_COSTO_COL] in TOTALE_COSTI_LABELS
+        ):
+            break
+
+    data = data[: last_row_with_data + 1]
+
+    if len(data) > 0:
+        max_width = max(len(data_row) for data_row in data)
+        data = [data_row + [""] * (max_width - len(data_row)) for data_row in data]
+
+    return data
+
+
+def _rows_to_dataframe(data):
+    """Converte le righe lette in un DataFrame, con la prima riga come header,
+    applicando le stesse conversioni di pandas.read_excel.
+    """
+    if not data:
+        return pd.DataFrame()
+
+    try:
+        return TextParser(data, header=0, skip_blank_lines=False).read()
+    except EmptyDataError:
+        return pd.DataFrame()
+
+
+def stream_budget_sheets(filename, excluded_fasi=EXCLUDED_FASI, n_cols=N_COLONNE):
+    """Legge in streaming i fogli di un file .xlsx/.xlsm.
+
+    I fogli in `excluded_fasi` non vengono letti affatto, e di ogni altro foglio
+    si tengono solo le prime `n_cols` colonne e le righe fino ai totali.
+
+    Parameters
+    ----------
+    filename : Path
+        File da leggere.
+    excluded_fasi : list of str
+        Nomi dei fogli da saltare.
+    n_cols : int
+        Numero di colonne da leggere.
+
+    Yields
+    ------
+    tuple of (str, pd.DataFrame)
+        Nome del foglio e relativo contenuto.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        workbook = openpyxl.load_workbook(
+            filename, read_only=True, data_only=True, keep_links=False
+        )
+
+    try:
+        for sheet in workbook.worksheets:
+            if sheet.title in excluded_fasi:
+                continue
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                data = _read_sheet_rows(sheet, n_cols=n_cols)
+
+            yield sheet.title, _rows_to_dataframe(data)
+    finally:
+        workbook.close()
+
+
+def read_sheets_pandas(filename, engine, excluded_fasi=EXCLUDED_FASI, n_cols=N_COLONNE):
+    """Legge i fogli di un file con pandas usando l'engine specificato, tenendo
+    solo le prime `n_cols` colonne. I fogli in `excluded_fasi` non vengono letti.
+
+    Yields
+    ------
+    tuple of (str, pd.DataFrame)
+        Nome del foglio e relativo contenuto.
+    """
+    with pd.ExcelFile(filename, engine=engine) as excel_file:
+        for fase in excel_file.sheet_names:
+            if fase in excluded_fasi:
+                continue
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                df = excel_file.parse(fase)
+
+            yield fase, df.iloc[:, :n_cols]
+
+
+# Funzioni di lettura per ogni engine:
+ENGINES = {
+    "calamine": partial(read_sheets_pandas, engine="calamine"),
+    "openpyxl": stream_budget_sheets,
+    "xlrd": partial(read_sheets_pandas, engine="xlrd"),
+}
+
+# Moduli richiesti da ogni engine:
+ENGINES_MODULES = {
+    "calamine": "python_calamine",
+    "openpyxl": "openpyxl",
+    "xlrd": "xlrd",
+}
+
+# Engine da usare per ogni formato, in ordine di preferenza:
+ENGINES_PRIORITY = {
+    ".xlsx": ["calamine", "openpyxl"],
+    ".xlsm": ["calamine", "openpyxl"],
+    ".xls": ["calamine", "xlrd"],
+}
+
+
+@lru_cache
+def is_engine_available(engine):
+    """Controlla se i moduli richiesti da un engine sono installati."""
+    return importlib.util.find_spec(ENGINES_MODULES[engine]) is not None
+
+
+def get_engine(filename):
+    """Sceglie l'engine di lettura per un file in base al suo formato.
+
+    Parameters
+    ----------
+    filename : Path
+        File da leggere.
+
+    Returns
+    -------
+    str
+        Nome dell'engine, chiave di `ENGINES`.
+    """
+    suffix = filename.suffix.lower()
+    if suffix not in ENGINES_PRIORITY:
+        raise ValueError(f"Formato file non supportato: {filename}")
+
+    for engine in ENGINES_PRIORITY[suffix]:
+        if is_engine_available(engine):
+            return engine
+
+    raise ImportError(
+        f"Nessun engine disponibile per {filename}; "
+        f"installare uno tra {ENGINES_PRIORITY[suffix]}"
+    )
+
+
+def read_budget_sheets(filename, excluded_fasi=EXCLUDED_FASI, engine=None):
+    """Legge i fogli di un file analisi, escludendo quelli in `excluded_fasi`.
+
+    Parameters
+    ----------
+    filename : Path
+        File da leggere.
+    excluded_fasi : list of str
+        Nomi dei fogli da saltare.
+    engine : str, optional
+        Engine di lettura (chiave di `ENGINES`). Se None viene scelto in base al
+        formato del file con `get_engine`.
+
+    Yields
+    ------
+    tuple of (str, pd.DataFrame)
+        Nome del foglio e relativo contenuto.
+    """
+    if engine is None:
+        engine = get_engine(filename)
+
+    yield from ENGINES[engine](filename, excluded_fasi=excluded_fasi)
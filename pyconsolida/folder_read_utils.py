@@ -1,37 +1,126 @@
+import fnmatch
+import json
+import os
+import re
+from collections import defaultdict
+from dataclasses import dataclass
 from datetime import datetime
+from pathlib import Path
+from typing import Tuple
 
 from dateutil.relativedelta import relativedelta
 
+from pyconsolida.cache_utils import atomic_write
+from pyconsolida.sheet_specs import PATTERNS, SUFFIXES
+
+# Cartelle commessa dentro la cartella dati, come componenti anno/mese/commessa di
+# un glob:
+FOLDER_PATTERNS = [
+    ("202[1-9]", "[0-1][0-9]_*", "*"),
+    ("202[1-9]", "*_[0-1][0-9]*", "[0-9][0-9][0-9][0-9]*"),
+]
+
+# File del catalogo salvato nella cartella della cache:
+CATALOGUE_FILENAME = "catalogo.json"
+
+
+def compile_name_pattern(pattern):
+    """Compila un pattern glob per il nome di un file, distinguendo maiuscole e
+    minuscole come pathlib (tranne che su Windows).
+    """
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    return re.compile(fnmatch.translate(pattern), flags).match
+
+
+# Pattern dei file analisi, nello stesso ordine in cui li cerca `find_all_files`:
+ANALISI_FILE_PATTERNS = [
+    compile_name_pattern(pattern + suffix)
+    for pattern in PATTERNS
+    for suffix in SUFFIXES
+]
+
+
+def select_analisi_files(folder, entries):
+    """File analisi di una cartella, dal suo contenuto.
+
+    Parameters
+    ----------
+    folder : Path
+        Cartella.
+    entries : list of tuple
+        Nome e se e' una cartella per ogni elemento di `folder`.
+
+    Returns
+    -------
+    list of Path
+        I file, nello stesso ordine (e con gli stessi eventuali doppioni) dei glob
+        per ogni pattern in `PATTERNS` e suffisso in `SUFFIXES`.
+    """
+    file_names = [name for name, is_dir in entries if not is_dir]
+    return [
+        folder / name
+        for match in ANALISI_FILE_PATTERNS
+        for name in file_names
+        if match(name)
+    ]
+
+
+# Mesi nei nomi delle cartelle:
+MESE_MAP = dict(
+    zip(
+        [
+            "gennaio",
+            "febbraio",
+            "marzo",
+            "aprile",
+            "maggio",
+            "giugno",
+            "luglio",
+            "agosto",
+            "settembre",
+            "ottobre",
+            "novembre",
+            "dicembre",
+        ],
+        range(1, 13),
+    )
+)
+
 
 def data_from_commessa_folder(folder):
     """Read year and month from folder and generate a datetime object."""
 
     anno = int(folder.parent.parent.name)
     mese_raw = folder.parent.name.replace(" ", "_").split("_")[-1].lower()
-    mese_map = dict(
-        zip(
-            [
-                "gennaio",
-                "febbraio",
-                "marzo",
-                "aprile",
-                "maggio",
-                "giugno",
-                "luglio",
-                "agosto",
-                "settembre",
-                "ottobre",
-                "novembre",
-                "dicembre",
-            ],
-            range(1, 13),
-        )
-    )
-    mese = mese_map[mese_raw]
+    mese = MESE_MAP[mese_raw]
 
     return datetime(anno, mese, 1)
 
 
+def get_commessa_months(folders):
+    """Indice dei mesi di ogni commessa, calcolato una volta per tutte le cartelle.
+
+    Parameters
+    ----------
+    folders : list of Path or CommessaFolder
+        Cartelle commessa; per le voci di un `FolderCatalogue` si usano commessa e
+        data gia' nel catalogo, senza rileggerle dal percorso.
+
+    Returns
+    -------
+    dict
+        Per ogni commessa, i mesi (datetime) delle sue cartelle, ordinati e senza
+        ripetizioni.
+    """
+    commessa_months = defaultdict(set)
+    for folder in folders:
+        if isinstance(folder, CommessaFolder):
+            commessa_months[folder.commessa].add(folder.data)
+        else:
+            commessa_months[folder.name].add(data_from_commessa_folder(folder))
+    return {commessa: sorted(months) for commessa, months in commessa_months.items()}
+
+
 def months_between_dates(date1, date2):
     """Date difference in number of months."""
     date_diff = relativedelta(date1, date2)
@@ -44,3 +133,125 @@ def months_from_start(folder_list):
     all_months = sorted(all_months)
     print(all_months)
     return [months_between_dates(month, all_months[0]) for month in all_months]
+
+
+@dataclass(frozen=True)
+class CommessaFolder:
+    """Cartella di una commessa in un mese, con i file analisi che contiene."""
+
+    path: Path
+    commessa: str
+    data: datetime
+    files: Tuple[Path, ...]
+
+
+class FolderCatalogue:
+    """Catalogo delle cartelle commessa della cartella dati e dei loro file analisi.
+
+    Il catalogo si costruisce con un'unica visita dell'albero anno/mese/commessa,
+    elencando ogni cartella una sola volta con os.scandir. Il contenuto di ogni
+    cartella viene salvato con il suo mtime, che cambia quando si aggiungono,
+    tolgono o rinominano file: aggiornando il catalogo, le cartelle non modificate
+    non vengono rielencate.
+
+    Parameters
+    ----------
+    directory : Path
+        Cartella dati.
+    filename : Path, optional
+        File in cui salvare il catalogo; se None il catalogo non viene salvato.
+    """
+
+    def __init__(self, directory, filename=None):
+        self.directory = Path(directory)
+        self.filename = None if filename is None else Path(filename)
+        self.folders = []
+        self.n_listed = 0  # cartelle elencate nell'ultimo aggiornamento
+
+        self._visited = {}
+        self._listings = {}
+        if self.filename is not None:
+            try:
+                with open(self.filename, "r") as f:
+                    self._listings = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def _list_directory(self, path, full):
+        """Nome e se e' una cartella per ogni elemento di `path`, rielencati solo
+        se il suo mtime e' cambiato (o se `full`).
+        """
+        key = str(path.absolute())
+        if key in self._visited:
+            return self._visited[key][1]
+
+        mtime = os.stat(path).st_mtime_ns
+        listing = self._listings.get(key)
+        if full or listing is None or listing[0] != mtime:
+            with os.scandir(path) as dir_entries:
+                entries = [[entry.name, entry.is_dir()] for entry in dir_entries]
+            listing = [mtime, entries]
+            self.n_listed += 1
+
+        self._visited[key] = listing
+        return listing[1]
+
+    def _find_folders(self, path, patterns, full):
+        if len(patterns) == 0:
+            yield path
+            return
+        for name, is_dir in self._list_directory(path, full):
+            if is_dir and patterns[0](name):
+                yield from self._find_folders(path / name, patterns[1:], full)
+
+    def refresh(self, full=False):
+        """Aggiorna il catalogo.
+
+        Parameters
+        ----------
+        full : bool
+            Se True rielenca tutte le cartelle, anche quelle con mtime invariato.
+
+        Returns
+        -------
+        list of CommessaFolder
+            Le cartelle commessa, ordinate per percorso.
+        """
+        self._visited = {}
+        self.n_listed = 0
+        paths = [
+            path
+            for folder_pattern in FOLDER_PATTERNS
+            for path in self._find_folders(
+                self.directory,
+                [compile_name_pattern(pattern) for pattern in folder_pattern],
+                full,
+            )
+        ]
+        self.folders = [
+            CommessaFolder(
+                path=path,
+                commessa=path.name,
+                data=data_from_commessa_folder(path),
+                files=tuple(
+                    select_analisi_files(path, self._list_directory(path, full))
+                ),
+            )
+            for path in sorted(paths)
+        ]
+
+        # Si tengono solo le cartelle ancora presenti:
+        self._listings = self._visited
+        return self.folders
+
+    def get_folder_files(self):
+        """File analisi di ogni cartella commessa."""
+        return {folder.path: list(folder.files) for folder in self.folders}
+
+    def save(self):
+        if self.filename is None:
+            return
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(self.filename) as temp_filename:
+            with open(temp_filename, "w") as f:
+                json.dump(self._listings, f)
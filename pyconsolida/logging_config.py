@@ -1,5 +1,6 @@
 import logging
 from pathlib import Path
+from typing import Optional
 
 
 def setup_logging(log_path: Path) -> None:
@@ -16,3 +17,11 @@ def setup_logging(log_path: Path) -> None:
         datefmt="%H:%M:%S",
         level=logging.INFO,
     )
+
+
+def get_log_path() -> Optional[Path]:
+    """Return the path of the log file currently configured, if any."""
+    for handler in logging.root.handlers:
+        if isinstance(handler, logging.FileHandler):
+            return Path(handler.baseFilename)
+    return None
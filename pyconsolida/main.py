@@ -5,8 +5,12 @@ from pathlib import Path
 import pandas as pd
 
 from pyconsolida.aggregations import load_loop_and_concat
+from pyconsolida.cache_utils import CACHE_MAX_BYTES, DEFAULT_CACHE_FORMAT
 from pyconsolida.delta import get_multiple_date_intervals, get_tabellone_delta
+from pyconsolida.folder_read_utils import CATALOGUE_FILENAME, FolderCatalogue
 from pyconsolida.logging_config import setup_logging
+from pyconsolida.schema import to_plain_dtypes
+from pyconsolida.sheet_specs import CACHE_PATH
 
 
 def process_tabellone(
@@ -15,6 +19,13 @@ def process_tabellone(
     progress_bar=True,
     debug_mode=True,
     cache=True,
+    workers=1,
+    intervals_only=False,
+    verify_hashes=False,
+    cache_format=DEFAULT_CACHE_FORMAT,
+    store=False,
+    cache_max_bytes=CACHE_MAX_BYTES,
+    quarantine=False,
 ) -> Path:
     """Process tabellone data and generate delta reports.
 
@@ -24,6 +35,20 @@ def process_tabellone(
         progress_bar: Whether to show progress bar
         debug_mode: Whether to run in debug mode
         cache: Whether to use caching
+        workers: Number of processes used to parse the files in parallel
+        intervals_only: Whether to read only the month folders needed for the
+            deltas of the requested intervals, instead of the full history
+        verify_hashes: Whether to recompute the hashes of all the data files, instead
+            of trusting the saved ones for files whose size and mtime did not change,
+            and to list again all the folders of the catalogue
+        cache_format: Format of the new cache entries, "parquet" or "pickle"
+        store: Whether to keep the tabellone in a consolidated store in the cache
+            folder, re-reading only the folders that changed since the last run
+        cache_max_bytes: Size limit of the cache entries, above which the least
+            recently used ones are deleted at the end of the run (None for no limit)
+        quarantine: Whether to skip the files that can not be read instead of
+            stopping, listing them in the export folder; failed files are not
+            read again until they change
 
     Returns:
         Path to the destination directory
@@ -52,11 +77,18 @@ def process_tabellone(
     logging.info(f"File di correzione tipologie: {directory / 'tipologie_fix.xlsx'}")
     logging.info(f"File di tipologie da saltare: {directory / 'tipologie_fix.xlsx'}")
 
-    # Find folders with latest formatting
-    all_folders = list(directory.glob("202[1-9]/[0-1][0-9]_*/*"))
-    all_folders += list(directory.glob("202[1-9]/*_[0-1][0-9]*/[0-9][0-9][0-9][0-9]*"))
-    all_folders = sorted([f for f in all_folders if f.is_dir()])
-    logging.info(f"Cartelle da analizzare trovate: {len(all_folders)}")
+    # Find folders with latest formatting, and their files, with a single walk
+    # (re-listing only the folders changed since the last run if using the cache):
+    catalogue = FolderCatalogue(
+        directory, filename=Path(CACHE_PATH) / CATALOGUE_FILENAME if cache else None
+    )
+    catalogue.refresh(full=verify_hashes)
+    catalogue.save()
+    all_folders = [folder.path for folder in catalogue.folders]
+    logging.info(
+        f"Cartelle da analizzare trovate: {len(all_folders)} "
+        f"({catalogue.n_listed} cartelle rielencate)"
+    )
 
     # Main processing
     budget, reports = load_loop_and_concat(
@@ -66,10 +98,21 @@ def process_tabellone(
         progress_bar=progress_bar,
         report_filename=str(dest_dir / f"{tstamp}_report_fixed_tipologie.xlsx"),
         cache=cache,
+        workers=workers,
+        all_folders=catalogue.folders,
+        verify_hashes=verify_hashes,
+        cache_format=cache_format,
+        store=store,
+        cache_max_bytes=cache_max_bytes,
+        quarantine=quarantine,
+        folder_files=catalogue.get_folder_files(),
+        failures_filename=str(dest_dir / f"{tstamp}_file-in-quarantena.xlsx"),
+        # Solo le cartelle necessarie ai delta:
+        date_intervals=date_intervals if intervals_only else None,
     )
 
-    # Save debug files
-    budget.to_pickle(str(dest_dir / f"{tstamp}_tabellone.pickle"))
+    # Save debug files (the tabellone in the usual types, not the compact ones):
+    to_plain_dtypes(budget).to_pickle(str(dest_dir / f"{tstamp}_tabellone.pickle"))
     reports.to_pickle(str(dest_dir / f"{tstamp}_reports.pickle"))
 
     # Generate delta for each interval
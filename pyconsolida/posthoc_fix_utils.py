@@ -1,4 +1,6 @@
+import logging
 import warnings
+from pathlib import Path
 from typing import List, Optional, Tuple, Union
 
 import numpy as np
@@ -6,6 +8,8 @@ import pandas as pd
 from numba import njit
 from numba.core.errors import NumbaPendingDeprecationWarning
 
+from pyconsolida.rule_engine import MatchesMemo, TipologieRules, get_rules_hash
+
 warnings.simplefilter("ignore", category=NumbaPendingDeprecationWarning)
 
 
@@ -13,9 +17,10 @@ def fix_tipologie_df(
     input_df: pd.DataFrame,
     tipologie_fix_df: pd.DataFrame,
     report_filename: Optional[str] = None,
+    matches_filename: Optional[Path] = None,
 ) -> None:
     # Make everything lowercase and replace nans with not-searchable string:
-    to_change = isinlist(input_df, tipologie_fix_df)
+    to_change = isinlist(input_df, tipologie_fix_df, matches_filename=matches_filename)
 
     # Ensures that no ambiguous category conversions are defined:
     check_consistency_of_matches(
@@ -44,7 +49,18 @@ def fix_tipologie_df(
 
         report_df.to_excel(report_filename)
 
+    # New tipologie must be added to the dictionary of categorical columns:
+    if isinstance(input_df["tipologia"].dtype, pd.CategoricalDtype):
+        new_tipologie = set(tipologie_fix_df["a"].dropna()) - set(
+            input_df["tipologia"].cat.categories
+        )
+        input_df["tipologia"] = input_df["tipologia"].cat.add_categories(
+            sorted(new_tipologie, key=str)
+        )
+
     # Fix inplace tipologia in the dataframe:
+    if len(indexes_to_change) == 0:
+        return
     prev = indexes_to_change[0, 0]
     for i, j in indexes_to_change:
         # sanity check - would not work because of duplicated vals, hence the prev:
@@ -88,7 +104,8 @@ def _isinlist(
     exclude_list: Tuple[str, ...],
     tipologie_list: Tuple[str, ...],
 ) -> np.ndarray:
-    """Fast match of occurrences satisfying a condition.
+    """Fast match of occurrences satisfying a condition (reference implementation
+    of `rule_engine.TipologieRules.match`).
 
     Parameters
     ----------
@@ -134,16 +151,46 @@ def isinlist(
     se_contiene_key: str = "se contiene",
     se_non_contiene_key: str = "e non contiene",
     se_tipologia_key: str = "da",
+    matches_filename: Optional[Path] = None,
 ) -> np.ndarray:
-    # print(tipologie_fix_df)
-    return _isinlist(
-        format_to_check(input_df[voce_key]),
-        format_to_check(input_df[tipologia_key]),
-        format_check(tipologie_fix_df[se_contiene_key]),
-        format_check(tipologie_fix_df[se_non_contiene_key]),
-        format_check(tipologie_fix_df[se_tipologia_key]),
+    """Match of each tipologie fix rule on each row of `input_df`, with the
+    automaton of `rule_engine` (same results as `_isinlist`).
+
+    The same voci repeat in every month of every commessa: rules are matched only
+    on the distinct (voce, tipologia) pairs, and the results are broadcast back to
+    the rows. With `matches_filename`, the matches of the pairs are also saved for
+    the next runs with the same rules (see `rule_engine.MatchesMemo`).
+    """
+    check_list = format_check(tipologie_fix_df[se_contiene_key])
+    exclude_list = format_check(tipologie_fix_df[se_non_contiene_key])
+    tipologie_list = format_check(tipologie_fix_df[se_tipologia_key])
+    memo = MatchesMemo(
+        TipologieRules(check_list, exclude_list, tipologie_list),
+        get_rules_hash(check_list, exclude_list, tipologie_list),
+        filename=matches_filename,
     )
 
+    # Integer codes of the distinct (voce, tipologia) pairs:
+    voce_codes, voci = pd.factorize(input_df[voce_key], use_na_sentinel=False)
+    tipologia_codes, tipologie = pd.factorize(
+        input_df[tipologia_key], use_na_sentinel=False
+    )
+    pair_codes, unique_pairs = pd.factorize(
+        voce_codes.astype(np.int64) * len(tipologie) + tipologia_codes
+    )
+
+    matches_table = memo.match(
+        format_to_check(voci[unique_pairs // len(tipologie)]),
+        format_to_check(tipologie[unique_pairs % len(tipologie)]),
+    )
+    logging.info(
+        f"Correzione tipologie: {len(unique_pairs)} coppie voce/tipologia distinte, "
+        f"{memo.n_new} mai viste prima"
+    )
+    memo.save()
+
+    return matches_table[pair_codes]
+
 
 def check_consistency_of_matches(
     matches_mat: np.ndarray,
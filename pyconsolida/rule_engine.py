@@ -0,0 +1,253 @@
+"""Rule engine for the tipologie fixes, on an Aho-Corasick automaton.
+
+All the fragments of the rules ("se contiene" and each ";"-separated "e non
+contiene" fragment) are compiled once into a single automaton, which finds all the
+fragments contained in a voce with a single scan of its characters. The rules to
+check for a row are then looked up by its tipologia, so that the cost per row
+depends on the length of the voce and on the rules of its tipologia only, instead
+of on all the rules as in `posthoc_fix_utils._isinlist`.
+
+The matches of the (voce, tipologia) pairs already seen are kept in a `MatchesMemo`,
+saved in the cache across runs as long as the rules do not change.
+"""
+
+import hashlib
+import json
+from collections import deque
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from pyconsolida.cache_utils import atomic_write
+
+# Separator of multiple exclusion criteria in "e non contiene":
+EXCLUDE_SEPARATOR = ";"
+
+# File of the memo of the matches, in the cache folder:
+MATCHES_FILENAME = "tipologie_fix_match.json"
+
+# To be increased to invalidate the saved matches if the matching logic changes:
+MATCHES_SCHEMA_VERSION = 1
+
+
+class AhoCorasick:
+    """Multi-pattern substring search automaton.
+
+    Parameters
+    ----------
+    patterns : Sequence[str]
+        Patterns to search; the empty string is contained in every text.
+    """
+
+    def __init__(self, patterns: Sequence[str]) -> None:
+        self.patterns = list(patterns)
+
+        # Trie of the patterns, with the ids of the patterns ending in each node:
+        self._goto: List[Dict[str, int]] = [{}]
+        outputs: List[set] = [set()]
+        for pattern_id, pattern in enumerate(self.patterns):
+            node = 0
+            for char in pattern:
+                if char not in self._goto[node]:
+                    self._goto.append({})
+                    outputs.append(set())
+                    self._goto[node][char] = len(self._goto) - 1
+                node = self._goto[node][char]
+            outputs[node].add(pattern_id)
+
+        # Failure links in breadth-first order, merging the outputs of the longest
+        # proper suffix of each node that is also in the trie:
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                outputs[child] |= outputs[self._fail[child]]
+                queue.append(child)
+
+        self._outputs: List[FrozenSet[int]] = [frozenset(o) for o in outputs]
+
+    def find(self, text: str) -> FrozenSet[int]:
+        """Ids of all the patterns contained in `text`, with one scan of the text."""
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        found = set(outputs[0])
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if outputs[node]:
+                found.update(outputs[node])
+        return frozenset(found)
+
+
+class TipologieRules:
+    """Tipologie fix rules compiled for matching.
+
+    Parameters
+    ----------
+    check_list : Sequence[str]
+        Fragment that the voce of each rule must contain.
+    exclude_list : Sequence[str]
+        Fragments, separated by `EXCLUDE_SEPARATOR`, that the voce of each rule
+        must not contain.
+    tipologie_list : Sequence[str]
+        Tipologia to which each rule applies.
+    """
+
+    def __init__(
+        self,
+        check_list: Sequence[str],
+        exclude_list: Sequence[str],
+        tipologie_list: Sequence[str],
+    ) -> None:
+        self.n_rules = len(check_list)
+
+        fragment_ids: Dict[str, int] = {}
+
+        def fragment_id(fragment: str) -> int:
+            return fragment_ids.setdefault(fragment, len(fragment_ids))
+
+        # For each tipologia, the rules as (rule index, fragment, exclusions):
+        self._rules_by_tipologia: Dict[str, List[Tuple[int, int, FrozenSet[int]]]] = {}
+        for j, (check, exclude, tipologia) in enumerate(
+            zip(check_list, exclude_list, tipologie_list)
+        ):
+            excluded = frozenset(
+                fragment_id(fragment) for fragment in exclude.split(EXCLUDE_SEPARATOR)
+            )
+            self._rules_by_tipologia.setdefault(tipologia, []).append(
+                (j, fragment_id(check), excluded)
+            )
+
+        self.automaton = AhoCorasick(list(fragment_ids))
+
+    def matching_rules(self, voce: str, tipologia: str) -> Tuple[int, ...]:
+        """Indexes of the rules matching a (voce, tipologia) pair."""
+        rules = self._rules_by_tipologia.get(tipologia)
+        if rules is None:
+            return ()
+
+        found = self.automaton.find(voce)
+        return tuple(
+            j
+            for j, check, excluded in rules
+            if check in found and found.isdisjoint(excluded)
+        )
+
+    def match(self, voci: Sequence[str], tipologie: Sequence[str]) -> np.ndarray:
+        """Match of each rule on each (voce, tipologia) row.
+
+        Parameters
+        ----------
+        voci : Sequence[str]
+            Voci to check.
+        tipologie : Sequence[str]
+            Tipologia of each voce.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean array (rows x rules) of matches, as `_isinlist`.
+        """
+        matches_table = np.full((len(voci), self.n_rules), False)
+        for i, (voce, tipologia) in enumerate(zip(voci, tipologie)):
+            rules_idx = self.matching_rules(voce, tipologia)
+            if rules_idx:
+                matches_table[i, list(rules_idx)] = True
+        return matches_table
+
+
+def get_rules_hash(
+    check_list: Sequence[str],
+    exclude_list: Sequence[str],
+    tipologie_list: Sequence[str],
+) -> str:
+    """Hash of the content of the rules (and of `MATCHES_SCHEMA_VERSION`)."""
+    N_HASH_CHARS = 16
+    content = json.dumps(
+        [MATCHES_SCHEMA_VERSION, list(check_list), list(exclude_list)]
+        + [list(tipologie_list)]
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:N_HASH_CHARS]
+
+
+class MatchesMemo:
+    """Matches of the rules on the (voce, tipologia) pairs already seen, so that
+    each distinct pair is matched only once, also across runs with the same rules.
+
+    Parameters
+    ----------
+    rules : TipologieRules
+        The rules to match.
+    rules_hash : str
+        Hash of the rules, see `get_rules_hash`; saved matches of other rules are
+        discarded.
+    filename : Path, optional
+        File in which the matches are saved; if None they are kept only in memory.
+    """
+
+    def __init__(
+        self, rules: TipologieRules, rules_hash: str, filename: Optional[Path] = None
+    ) -> None:
+        self.rules = rules
+        self.rules_hash = rules_hash
+        self.filename = None if filename is None else Path(filename)
+        self.n_new = 0  # pairs matched in the last call to `match`
+
+        # Indexes of the matching rules for each (voce, tipologia) pair:
+        self._matches: Dict[Tuple[str, str], Tuple[int, ...]] = {}
+        if self.filename is not None:
+            try:
+                with open(self.filename, "r") as f:
+                    saved = json.load(f)
+                if saved["rules_hash"] == rules_hash:
+                    self._matches = {
+                        (voce, tipologia): tuple(rules_idx)
+                        for voce, tipologia, rules_idx in saved["matches"]
+                    }
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def match(self, voci: Sequence[str], tipologie: Sequence[str]) -> np.ndarray:
+        """As `TipologieRules.match`, matching only the pairs never seen before."""
+        pairs = list(zip(voci, tipologie))
+        new_pairs = [pair for pair in dict.fromkeys(pairs) if pair not in self._matches]
+        self.n_new = len(new_pairs)
+        if new_pairs:
+            new_voci, new_tipologie = zip(*new_pairs)
+            new_table = self.rules.match(new_voci, new_tipologie)
+            for pair, row in zip(new_pairs, new_table):
+                self._matches[pair] = tuple(np.flatnonzero(row).tolist())
+
+        matches_table = np.full((len(pairs), self.rules.n_rules), False)
+        for i, pair in enumerate(pairs):
+            rules_idx = self._matches[pair]
+            if rules_idx:
+                matches_table[i, list(rules_idx)] = True
+        return matches_table
+
+    def save(self) -> None:
+        """Save the matches, if there are new ones. With concurrent runs the last
+        one to save wins, and the pairs of the other are matched again next time.
+        """
+        if self.filename is None or self.n_new == 0:
+            return
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(self.filename) as temp_filename:
+            with open(temp_filename, "w") as f:
+                json.dump(
+                    {
+                        "rules_hash": self.rules_hash,
+                        "matches": [
+                            [voce, tipologia, list(rules_idx)]
+                            for (voce, tipologia), rules_idx in self._matches.items()
+                        ],
+                    },
+                    f,
+                )
@@ -0,0 +1,208 @@
+"""Tipi compatti delle colonne del tabellone.
+
+Le colonne di testo (commesse, fasi, tipologie, voci...) hanno pochi valori distinti
+che si ripetono su tutti i mesi, e sono salvate come categoriche: ogni riga contiene
+un codice intero e ogni stringa e' salvata una volta sola, in un dizionario comune a
+tutto il tabellone (vedi `concat_compact`). Gli interi usano 16 o 32 bit se i valori
+ci stanno e la data e' un periodo mensile.
+
+I tipi compatti sono usati solo in memoria: il tabellone esportato torna ai tipi di
+sempre con `to_plain_dtypes`.
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Tipo di ogni colonna di KEY_SEQUENCE (vedi sheet_specs):
+TABELLONE_DTYPES = {
+    "commessa": "category",
+    "fase": "category",
+    "anno": "int16",
+    "mese": "int16",
+    "data": "period[M]",
+    "mesi-da-inizio": "int16",
+    "codice": "int32",
+    "tipologia": "category",
+    "voce": "category",
+    "costo u.": "float64",
+    "u.m.": "category",
+    "quantita": "float64",
+    "imp. unit.": "float64",
+    "imp.comp.": "float64",
+    "file-hash": "category",
+}
+
+# Dimensione di un puntatore in un array di oggetti Python:
+_POINTER_BYTES = np.dtype(object).itemsize
+
+
+def _narrow_integers(values, dtype):
+    """Converte a `dtype` una colonna di interi, se tutti i valori ci stanno;
+    altrimenti la lascia invariata (es. valori mancanti o non interi).
+    """
+    try:
+        integers = values.astype(np.int64)
+    except (TypeError, ValueError):
+        return values
+    if not (integers == values).all():
+        return values
+
+    limits = np.iinfo(dtype)
+    if len(integers) > 0 and (
+        integers.min() < limits.min or integers.max() > limits.max
+    ):
+        return integers
+    return integers.astype(dtype)
+
+
+def _to_periods(values, dtype):
+    """Converte una colonna di date a periodi, convertendo solo i valori distinti
+    (le date si ripetono su tutte le righe di un mese).
+    """
+    values = values.astype("category")
+    periods = pd.PeriodIndex(values.cat.categories, dtype=dtype).take(
+        values.cat.codes.to_numpy(), allow_fill=True, fill_value=pd.NaT
+    )
+    return pd.Series(periods, index=values.index, name=values.name)
+
+
+def _from_periods(values):
+    """Converte una colonna di periodi mensili a stringhe "AAAA-MM", convertendo solo
+    i valori distinti.
+    """
+    codes, uniques = pd.factorize(values)
+    strings = np.append(np.asarray(uniques.strftime("%Y-%m"), dtype=object), np.nan)
+    return pd.Series(strings.take(codes), index=values.index, name=values.name)
+
+
+def _sorted_categories(categories):
+    # Con tipi misti (es. numeri tra le voci) l'ordine resta quello di comparsa:
+    try:
+        return categories.sort_values()
+    except TypeError:
+        return categories
+
+
+def to_compact_dtypes(df, dtypes=TABELLONE_DTYPES):
+    """Converte le colonne di `df` ai tipi compatti dello schema.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Tabellone (o parte di esso); le colonne non nello schema restano invariate.
+    dtypes : dict, optional
+        Tipo di ogni colonna, di default `TABELLONE_DTYPES`.
+
+    Returns
+    -------
+    pd.DataFrame
+        Un nuovo DataFrame con le colonne convertite.
+    """
+    columns = {}
+    for column, dtype in dtypes.items():
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+        if dtype.startswith("int"):
+            columns[column] = _narrow_integers(df[column], dtype)
+        elif dtype.startswith("period"):
+            columns[column] = _to_periods(df[column], dtype)
+        else:
+            columns[column] = df[column].astype(dtype)
+    return df.assign(**columns)
+
+
+def to_plain_dtypes(df):
+    """Converte le colonne nei tipi compatti ai tipi del tabellone esportato: testo
+    e date "AAAA-MM" come oggetti Python, interi e float a 64 bit.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Tabellone nei tipi compatti (vedi `to_compact_dtypes`).
+
+    Returns
+    -------
+    pd.DataFrame
+        Un nuovo DataFrame con le colonne convertite.
+    """
+    columns = {}
+    for column, values in df.items():
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            columns[column] = values.astype(object)
+        elif isinstance(values.dtype, pd.PeriodDtype):
+            columns[column] = _from_periods(values)
+        elif values.dtype.kind in "iu":
+            columns[column] = values.astype(np.int64)
+    return df.assign(**columns)
+
+
+def concat_compact(frames, dtypes=TABELLONE_DTYPES):
+    """Concatena parti del tabellone nei tipi compatti, con un unico dizionario
+    ordinato per ogni colonna categorica (`pd.concat` convertirebbe a oggetti le
+    categoriche con dizionari diversi).
+
+    Parameters
+    ----------
+    frames : list of pd.DataFrame
+        Parti del tabellone, con le stesse colonne.
+    dtypes : dict, optional
+        Tipo di ogni colonna, di default `TABELLONE_DTYPES`.
+
+    Returns
+    -------
+    pd.DataFrame
+        Il tabellone concatenato.
+    """
+    frames = [to_compact_dtypes(frame, dtypes) for frame in frames]
+    categorical = [
+        column
+        for column, dtype in frames[0].dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    ]
+    for column in categorical:
+        categories = _sorted_categories(
+            pd.Index(
+                np.concatenate(
+                    [frame[column].cat.categories.to_numpy() for frame in frames]
+                )
+            ).unique()
+        )
+        frames = [
+            frame.assign(**{column: frame[column].cat.set_categories(categories)})
+            for frame in frames
+        ]
+    return pd.concat(frames, axis=0, ignore_index=True)
+
+
+def memory_footprint(df):
+    """Memoria occupata da `df` in byte, incluse le stringhe."""
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+
+def plain_memory_footprint(df):
+    """Stima della memoria che `df` occuperebbe senza lo schema compatto, con le
+    stringhe (e le date "AAAA-MM") come oggetti Python e i numeri a 64 bit, senza
+    convertirlo.
+    """
+    total = 0
+    for _, values in df.items():
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            sizes = np.array(
+                [sys.getsizeof(value) for value in values.cat.categories],
+                dtype=np.int64,
+            )
+            codes = values.cat.codes.to_numpy()
+            counts = np.bincount(codes[codes >= 0], minlength=len(sizes))
+            total += int(counts @ sizes) + int((codes < 0).sum()) * sys.getsizeof(
+                np.nan
+            )
+            total += _POINTER_BYTES * len(values)
+        elif isinstance(values.dtype, pd.PeriodDtype):
+            total += (_POINTER_BYTES + sys.getsizeof("2023-12")) * len(values)
+        elif values.dtype.kind in "iuf":
+            total += 8 * len(values)
+        else:
+            total += int(values.memory_usage(index=False, deep=True))
+    return total
@@ -52,6 +52,9 @@ TIPOLOGIA_IDX = 1  # indice colonna con tipologie costo
 SKIP_COSTI_HEAD = 4  # indice di riga sotto casella "COSTI" a cui leggere gli headers
 N_COLONNE = 8  # colonne da tenere nella lettura del file
 
+# Righe che chiudono la lista dei costi, in ordine di priorita':
+TOTALE_COSTI_LABELS = ["Totale costi", "Total dépenses"]
+
 # Dizionario di colonne chiave del file. Lo definiamo per astrarre il valore specifico
 # delle stringhe nel caso debba mutare:
 HEADERS = {
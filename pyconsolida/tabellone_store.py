@@ -0,0 +1,233 @@
+"""Archivio consolidato del tabellone su disco (database SQLite).
+
+Per ogni cartella commessa/mese l'archivio contiene le voci di costo e i report di
+consistenza gia' letti, insieme a una chiave che riassume tutto cio' da cui dipende
+la lettura (hash dei file, parametri e versione del parser). A ogni esecuzione si
+rileggono e si aggiornano solo le cartelle la cui chiave e' cambiata, e il tabellone
+viene poi letto con un'unica query.
+"""
+
+import json
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from pyconsolida.sheet_specs import CACHE_PATH
+
+STORE_FILENAME = "tabellone.sqlite"
+
+# Tabelle con le righe di ogni cartella:
+STORE_TABLES = ["voci", "reports"]
+
+# Secondi di attesa se l'archivio e' bloccato da un'altra esecuzione:
+STORE_TIMEOUT = 600
+
+# SQLite non conosce i tipi numpy:
+for _numpy_type in [np.int64, np.int32, np.int16, np.int8]:
+    sqlite3.register_adapter(_numpy_type, int)
+sqlite3.register_adapter(np.bool_, bool)
+
+
+def get_folder_id(folder):
+    """Identificativo di una cartella indipendente dalla posizione dei dati, es.
+    "2023/12_Dicembre/1434".
+    """
+    return "/".join(Path(folder).parts[-3:])
+
+
+def _encode_value(value):
+    # I report contengono set di voci, salvati come liste json:
+    if isinstance(value, (set, frozenset)):
+        return json.dumps(sorted(value, key=str))
+    # Le date mensili del tabellone (vedi `schema`) come testo "AAAA-MM":
+    if isinstance(value, pd.Period):
+        return str(value)
+    return value
+
+
+class TabelloneStore:
+    """Archivio del tabellone, con aggiornamento per cartella.
+
+    Parameters
+    ----------
+    filename : Path, optional
+        File del database; di default `STORE_FILENAME` nella cartella della cache.
+    """
+
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = Path(CACHE_PATH) / STORE_FILENAME
+        self.filename = Path(filename)
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+
+        # L'archivio si usa tenendo `cache_utils.store_lock` (i lock di SQLite non
+        # sono affidabili su cartelle di rete); in ogni caso si aspetta il proprio turno:
+        self.connection = sqlite3.connect(self.filename, timeout=STORE_TIMEOUT)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS folders (folder TEXT PRIMARY KEY, "
+            "commessa TEXT, anno INTEGER, mese INTEGER, file_hash TEXT, key TEXT)"
+        )
+        # Nomi, tipi e codifica delle colonne delle tabelle delle righe:
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS columns (table_name TEXT, position INTEGER, "
+            "name TEXT, dtype TEXT, is_set INTEGER, PRIMARY KEY (table_name, position))"
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_keys(self):
+        """Chiave salvata per ogni cartella nell'archivio."""
+        return dict(self.connection.execute("SELECT folder, key FROM folders"))
+
+    def _get_columns(self, table):
+        return self.connection.execute(
+            "SELECT position, name, dtype, is_set FROM columns "
+            "WHERE table_name = ? ORDER BY position",
+            (table,),
+        ).fetchall()
+
+    def _update_columns(self, table, df):
+        """Registra le colonne di `df`, creando la tabella o aggiungendo colonne se
+        serve, e ritorna le colonne del database corrispondenti a quelle di `df`.
+        """
+        columns = {json.loads(row[1]): row for row in self._get_columns(table)}
+        if not columns:
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (folder TEXT, row INTEGER)"
+            )
+            self.connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_folder ON {table} (folder)"
+            )
+
+        db_columns = []
+        for column in df.columns:
+            dtype = str(df[column].dtype)
+            is_set = bool(
+                dtype == "object"
+                and df[column].map(lambda x: isinstance(x, (set, frozenset))).any()
+            )
+            if column not in columns:
+                position = len(columns)
+                self.connection.execute(f"ALTER TABLE {table} ADD COLUMN c{position}")
+                columns[column] = (position, json.dumps(column), dtype, is_set)
+            else:
+                position, _, old_dtype, old_is_set = columns[column]
+                # Se le cartelle hanno tipi diversi, le colonne restano generiche:
+                if old_dtype != dtype:
+                    dtype = "object"
+                is_set = is_set or bool(old_is_set)
+
+            self.connection.execute(
+                "INSERT OR REPLACE INTO columns VALUES (?, ?, ?, ?, ?)",
+                (table, position, json.dumps(column), dtype, int(is_set)),
+            )
+            db_columns.append(f"c{position}")
+
+        return db_columns
+
+    def upsert(self, folder, key, commessa, anno, mese, file_hash, tables):
+        """Sostituisce i dati di una cartella.
+
+        Parameters
+        ----------
+        folder : Path
+            Cartella letta.
+        key : str
+            Chiave della lettura, vedi `get_keys`.
+        commessa, anno, mese, file_hash
+            Identificativi della cartella.
+        tables : dict
+            Per ogni tabella in `STORE_TABLES`, il DataFrame letto o None.
+        """
+        folder_id = get_folder_id(folder)
+        for table, df in tables.items():
+            if table not in STORE_TABLES:
+                raise ValueError(f"Tabella non valida: {table}")
+            if self._get_columns(table):
+                self.connection.execute(
+                    f"DELETE FROM {table} WHERE folder = ?", (folder_id,)
+                )
+            if df is None or len(df) == 0:
+                continue
+
+            db_columns = self._update_columns(table, df)
+            values = zip(*[df[column].map(_encode_value) for column in df.columns])
+            self.connection.executemany(
+                f"INSERT INTO {table} (folder, row, {', '.join(db_columns)}) "
+                f"VALUES (?, ?, {', '.join('?' * len(db_columns))})",
+                (
+                    (folder_id, row_n, *row_values)
+                    for row_n, row_values in enumerate(values)
+                ),
+            )
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?, ?)",
+            (folder_id, commessa, int(anno), int(mese), file_hash, key),
+        )
+
+    def commit(self):
+        self.connection.commit()
+
+    def read(self, folders):
+        """Legge le righe delle cartelle in `folders`, nello stesso ordine, con
+        un'unica query per tabella.
+
+        Returns
+        -------
+        dict
+            Per ogni tabella in `STORE_TABLES`, il DataFrame con le righe di tutte
+            le cartelle (vuoto se non ce ne sono).
+        """
+        self.connection.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS selected "
+            "(folder TEXT PRIMARY KEY, position INTEGER)"
+        )
+        self.connection.execute("DELETE FROM selected")
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO selected VALUES (?, ?)",
+            [(get_folder_id(folder), i) for i, folder in enumerate(folders)],
+        )
+
+        tables = {}
+        for table in STORE_TABLES:
+            columns = self._get_columns(table)
+            if not columns:
+                tables[table] = pd.DataFrame()
+                continue
+
+            db_columns = [f"{table}.c{position}" for position, _, _, _ in columns]
+            df = pd.read_sql_query(
+                f"SELECT {', '.join(db_columns)} FROM {table} "
+                f"JOIN selected ON {table}.folder = selected.folder "
+                f"ORDER BY selected.position, {table}.row",
+                self.connection,
+                coerce_float=False,
+            )
+            df.columns = [json.loads(name) for _, name, _, _ in columns]
+
+            # Ripristina tipi e valori mancanti come nelle tabelle originali:
+            for column, (_, _, dtype, is_set) in zip(df.columns, columns):
+                values = df[column].astype(dtype)
+                if dtype == "object":
+                    values = values.mask(values.isna(), np.nan)
+                if is_set:
+                    values = values.map(
+                        lambda x: set(json.loads(x)) if isinstance(x, str) else x
+                    )
+                df[column] = values
+
+            tables[table] = df
+
+        self.connection.execute("DELETE FROM selected")
+        return tables
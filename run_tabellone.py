@@ -3,10 +3,47 @@
 The input folder (specified as DIRECTORY) has to be organized in the following way:
 """
 
+import argparse
+
+import pandas as pd
+
+from pyconsolida.cache_utils import CACHE_MAX_BYTES, collect_garbage
 from pyconsolida.main import process_tabellone
 from pyconsolida.sheet_specs import DATA_PATH
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estrazione tabellone e delta")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="ricalcola gli hash di tutti i file dati, anche quelli non modificati",
+    )
+    parser.add_argument(
+        "--intervals-only",
+        action="store_true",
+        help="leggi solo i mesi necessari ai delta (il tabellone esportato sarà "
+        "parziale)",
+    )
+    parser.add_argument(
+        "--store",
+        action="store_true",
+        help="tieni il tabellone in un archivio nella cache, rileggendo solo le "
+        "cartelle cambiate",
+    )
+    parser.add_argument(
+        "--gc-dry-run",
+        action="store_true",
+        help="mostra le voci che verrebbero cancellate dalla cache, senza estrarre",
+    )
+    args = parser.parse_args()
+
+    if args.gc_dry_run:
+        report = collect_garbage(max_bytes=CACHE_MAX_BYTES, dry_run=True)
+        with pd.option_context("display.max_rows", None, "display.width", None):
+            print(report)
+        print(f"Spazio liberabile: {report['byte'].sum() / 1e6:.1f} MB")
+        raise SystemExit
+
     # Configuration
     # DIRECTORY = (
     #     Path("/Users/vigji/Desktop/Cantieri_test")
@@ -16,6 +53,9 @@ if __name__ == "__main__":
     PROGRESS_BAR = True
     OUTPUT_DIR = None  # Path("/Users/vigji/Desktop/exports")
     DEBUG_MODE = False
+    WORKERS = 4  # processi in parallelo per la lettura dei file analisi
+    # Salta i file che non si riescono a leggere invece di fermarsi (vedi export):
+    QUARANTINE = True
 
     # Run main process
     output_dir = process_tabellone(
@@ -24,4 +64,9 @@ if __name__ == "__main__":
         progress_bar=PROGRESS_BAR,
         debug_mode=DEBUG_MODE,
         cache=True,
+        workers=WORKERS,
+        intervals_only=args.intervals_only,
+        verify_hashes=args.verify,
+        store=args.store,
+        quarantine=QUARANTINE,
     )
@@ -20,14 +20,13 @@ setup(
         "openpyxl>=3.0.0",
         "tqdm",
         "xlrd",
-        "GitPython",
         "pyarrow",
         "tabulate",
     ],
     long_description=long_description,
     long_description_content_type="text/markdown",
     python_requires=">=3.9",
-    extras_require=dict(dev=requirements_dev),
+    extras_require=dict(dev=requirements_dev, calamine=["python-calamine"]),
     packages=find_packages(),
     include_package_data=True,
     url="https://github.com/vigji/pyconsolida",
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyconsolida.aggregations import (
+    add_constant_columns,
+    plain_constant_columns,
+)
+
+METADATA = {
+    "commessa": "1434",
+    "mese": 12,
+    "anno": 2023,
+    "data": "2023-12",
+    "mesi-da-inizio": 5,
+    "file-hash": "abc123",
+}
+
+
+@pytest.mark.parametrize("n_rows", [0, 1, 3])
+def test_add_constant_columns(n_rows):
+    df = pd.DataFrame({"codice": np.arange(n_rows), "voce": ["sabbia"] * n_rows})
+    result = add_constant_columns(df, METADATA)
+
+    # Le colonne originali non cambiano, e `df` non viene modificato:
+    assert list(result.columns) == ["codice", "voce", *METADATA]
+    pd.testing.assert_frame_equal(result[["codice", "voce"]], df)
+    assert list(df.columns) == ["codice", "voce"]
+
+    for column, value in METADATA.items():
+        if isinstance(value, str):
+            # Stringhe come categoriche con un'unica categoria e codici a 8 bit:
+            assert isinstance(result[column].dtype, pd.CategoricalDtype)
+            assert list(result[column].cat.categories) == [value]
+            assert result[column].cat.codes.dtype == np.int8
+        else:
+            assert result[column].dtype == np.asarray(value).dtype
+        assert result[column].tolist() == [value] * n_rows
+
+
+@pytest.mark.parametrize("n_rows", [0, 3])
+def test_plain_constant_columns_round_trip(n_rows):
+    df = pd.DataFrame({"codice": np.arange(n_rows), "voce": ["sabbia"] * n_rows})
+    result = plain_constant_columns(add_constant_columns(df, METADATA))
+
+    # Come assegnando i valori direttamente, con le stringhe come oggetti:
+    expected = df.assign(**METADATA).astype(
+        {column: object for column, value in METADATA.items() if isinstance(value, str)}
+    )
+    pd.testing.assert_frame_equal(result, expected)
+    assert not any(isinstance(dtype, pd.CategoricalDtype) for dtype in result.dtypes)
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyconsolida.budget_reader_utils import (
+    _costi_to_float,
+    add_tipologia_column,
+    compile_tipologie_skip,
+    crop_costi,
+    fix_voice_consistency,
+)
+from pyconsolida.df_utils import sum_selected_columns
+from pyconsolida.sheet_specs import HEADERS, TIPOLOGIA_IDX
+
+
+def _voci():
+    return pd.DataFrame(
+        {
+            "codice": [102, 101, 102, 103, 101],
+            "voce": ["gru", "sabbia", "gru mobile", np.nan, "sabbia"],
+            "quantita": [1.0, 2.0, 3.0, 4.0, 5.0],
+            "fase": ["f1", "f1", "f2", "f2", "f2"],
+        }
+    )
+
+
+def test_fix_voice_consistency():
+    df, report = fix_voice_consistency(_voci())
+
+    assert df["voce"].tolist() == ["gru", "sabbia", "gru", np.nan, "sabbia"]
+    assert report.index.tolist() == [102]
+    assert report.name is None
+    assert report[102] == {"gru", "gru mobile"}
+
+
+def test_sum_selected_columns():
+    summed = sum_selected_columns(_voci(), "codice", ["quantita"])
+
+    assert summed.index.tolist() == [101, 102, 103]
+    assert summed["quantita"].tolist() == [7.0, 4.0, 4.0]
+    assert summed["fase"].tolist() == ["f1", "f1", "f2"]
+    assert summed["codice"].tolist() == [101, 102, 103]
+
+
+def test_crop_costi_empty_sheets():
+    # Fogli senza voci valide, letti come soli nan:
+    assert crop_costi(pd.DataFrame({0: [np.nan, np.nan], 1: [np.nan, np.nan]})) is None
+
+    # Con tipi misti (es. una colonna di date) il foglio non e' scartato in partenza,
+    # e senza casella COSTI non ha costi:
+    mixed = pd.DataFrame(
+        {
+            0: [np.nan, 1.0],
+            1: pd.to_datetime(["2024-01-01", "2024-02-01"]),
+        }
+    )
+    assert crop_costi(mixed) is None
+
+
+def test_costi_to_float():
+    costi = pd.Series([1.5, "2,5", " 1 000,25", 3, np.nan], dtype=object)
+    assert _costi_to_float(costi).tolist()[:4] == [1.5, 2.5, 1000.25, 3.0]
+    assert np.isnan(_costi_to_float(costi).iloc[4])
+
+    # Come float(None), una cella None non e' un costo valido:
+    with pytest.raises(TypeError):
+        _costi_to_float(pd.Series([1.5, None], dtype=object))
+
+
+def _add_tipologia_column_loop(df, commessa, fase, tipologie_skip=None):
+    """Implementazione originale di add_tipologia_column, riga per riga."""
+
+    def is_tipologia_header(row):
+        if type(row.iloc[1]) is not str:
+            return False
+        try:
+            int_commessa = int(commessa)
+        except ValueError:
+            int_commessa = int(commessa[:4])
+        if tipologie_skip is not None and sum(
+            (tipologie_skip["tipologia"] == row.iloc[1])
+            & (tipologie_skip["commessa"] == int_commessa)
+            & (tipologie_skip["fase"] == fase)
+        ):
+            return False
+        if type(row.iloc[2]) is str:
+            return row.iloc[2] == HEADERS["units"]
+        return np.isnan(row.iloc[2])
+
+    df = df.copy()
+    df[HEADERS["tipologia"]] = ""
+    current_tipologia = ""
+    for row_i, row in enumerate(df.index):
+        if is_tipologia_header(df.iloc[row_i, :]):
+            current_tipologia = df.iloc[row_i, TIPOLOGIA_IDX]
+        df.loc[row, HEADERS["tipologia"]] = current_tipologia
+    return df
+
+
+@pytest.mark.parametrize("commessa", ["1434", "1434-Preventivo"])
+def test_add_tipologia_column(commessa):
+    rows = [
+        [100, "voce prima degli header", "h", 1.0],
+        [np.nan, "Personale", np.nan, np.nan],  # header
+        [101, "operaio", "h", 2.0],
+        [np.nan, np.nan, np.nan, np.nan],  # codice nan, riga vuota
+        [np.nan, "Noli", HEADERS["units"], np.nan],  # header con u.m.
+        [102, "gru", "h", 1.0],
+        [np.nan, "Interno", np.nan, np.nan],  # header da saltare
+        [103, "cls", "mc", 3.0],
+        [np.nan, "Noli", np.nan, np.nan],  # header ripetuto
+        [104, "gru mobile", "h", 1.0],
+        [np.nan, "nota", "mc", np.nan],  # non header: u.m. diversa
+        [105, 3.5, np.nan, 2.0],  # non header: non testo
+    ]
+    df = pd.DataFrame(
+        rows, columns=["codice", "voce", "u.m.", "quantita"], dtype=object
+    ).set_index(pd.RangeIndex(10, 10 + len(rows)))
+    tipologie_skip = pd.DataFrame(
+        {"commessa": [1434, 1500], "fase": ["F1", "F1"], "tipologia": ["Interno"] * 2}
+    )
+
+    result = add_tipologia_column(
+        df, commessa, "F1", tipologie_skip=compile_tipologie_skip(tipologie_skip)
+    )
+
+    expected = _add_tipologia_column_loop(
+        df, commessa, "F1", tipologie_skip=tipologie_skip
+    )
+    pd.testing.assert_frame_equal(result, expected)
+    assert result[HEADERS["tipologia"]].tolist() == (
+        [""] + ["Personale"] * 3 + ["Noli"] * 4 + ["Noli"] * 4
+    )
+
+    # Senza tipologie da saltare l'header "Interno" vale per le righe seguenti:
+    pd.testing.assert_frame_equal(
+        add_tipologia_column(df, commessa, "F1"),
+        _add_tipologia_column_loop(df, commessa, "F1"),
+    )
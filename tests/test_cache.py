@@ -1,9 +1,30 @@
+import multiprocessing
+import os
+import shutil
 import time
 
+import numpy as np
+import pandas as pd
 import pytest
 
-from pyconsolida.budget_reader import read_full_budget_cached
-from pyconsolida.cache_utils import flush_all_cache, get_folder_hash
+from pyconsolida import budget_reader, cache_utils
+from pyconsolida.budget_reader import pop_failures, read_full_budget_cached
+from pyconsolida.cache_utils import (
+    CacheManifest,
+    HashCache,
+    atomic_write,
+    collect_garbage,
+    entry_lock,
+    find_cache_entry,
+    flush_all_cache,
+    get_cache_manifest,
+    get_folder_hash,
+    get_parser_fingerprint,
+    get_set_hash,
+    hash_file_content,
+    read_cache_entry,
+    write_cache_entry,
+)
 
 
 def _time_function(func, **kwargs):
@@ -21,7 +42,6 @@ def test_args(temp_source_data, cache_folder, request):
     unique_cache.mkdir(exist_ok=True)
     return {
         "filename": test_file,
-        "folder_hash": get_folder_hash(test_file),
         "sum_fasi": False,
         "tipologie_skip": None,
         "cache": True,
@@ -77,3 +97,340 @@ def test_different_args(test_args):
 
     assert end_time_first_read < end_time_nosum * 10
     assert end_time_first_read > end_time_nosum_second_read * 10
+
+
+def test_parser_fingerprint(tmp_path, monkeypatch):
+    fingerprint = get_parser_fingerprint()
+
+    # Non dipende da git o dalla cartella di lavoro:
+    monkeypatch.chdir(tmp_path)
+    get_parser_fingerprint.cache_clear()
+    assert get_parser_fingerprint() == fingerprint
+
+    # Cambia se si incrementa la versione dello schema:
+    monkeypatch.setattr(cache_utils, "PARSER_SCHEMA_VERSION", 2)
+    get_parser_fingerprint.cache_clear()
+    assert get_parser_fingerprint() != fingerprint
+
+    get_parser_fingerprint.cache_clear()
+
+
+def test_identical_files_share_cache(test_args):
+    fasi, _ = read_full_budget_cached(**test_args)
+    store_entries = sorted(test_args["cache_root"].glob("store/*"))
+
+    # Stesso file copiato in un altro mese della stessa commessa:
+    filename = test_args["filename"]
+    copied_file = (
+        filename.parents[2] / "13_Copia" / filename.parent.name / filename.name
+    )
+    copied_file.parent.mkdir(parents=True)
+    shutil.copy(filename, copied_file)
+
+    copied_args = test_args.copy()
+    copied_args["filename"] = copied_file
+    copied_fasi, _ = read_full_budget_cached(**copied_args)
+
+    assert sorted(test_args["cache_root"].glob("store/*")) == store_entries
+    pd.testing.assert_frame_equal(copied_fasi, fasi)
+
+
+def test_cached_messages_name_current_file(tmp_path, monkeypatch, caplog):
+    def fake_read(filename, sum_fasi, tipologie_skip):
+        return pd.DataFrame({"codice": [1]}), [], [f"Leggo {filename}"]
+
+    monkeypatch.setattr(budget_reader, "_read_full_budget", fake_read)
+    filenames = []
+    for mese in ["11_Novembre", "12_Dicembre"]:
+        filename = tmp_path / "2023" / mese / "1434" / "Analisi.xlsx"
+        filename.parent.mkdir(parents=True)
+        filename.write_bytes(b"stesso contenuto")
+        filenames.append(filename)
+
+    read_full_budget_cached(filenames[0], cache_root=tmp_path / "cache")
+    with caplog.at_level("INFO"):
+        read_full_budget_cached(filenames[1], cache_root=tmp_path / "cache")
+
+    # La copia usa la voce in cache della prima lettura, con il proprio percorso:
+    assert f"Leggo {filenames[1]}" in caplog.messages
+    assert f"Leggo {filenames[0]}" not in caplog.messages
+    flush_all_cache(tmp_path / "cache")
+
+
+def test_identical_files_shared_across_commesse(tmp_path, monkeypatch):
+    read_files = []
+
+    def fake_read(filename, sum_fasi, tipologie_skip):
+        read_files.append(filename)
+        return pd.DataFrame({"codice": [1]}), [], []
+
+    monkeypatch.setattr(budget_reader, "_read_full_budget", fake_read)
+    filenames = {}
+    for commessa in ["1434", "1500", "1501"]:
+        filename = tmp_path / "2023" / "12_Dicembre" / commessa / "Analisi.xlsx"
+        filename.parent.mkdir(parents=True)
+        filename.write_bytes(b"stesso contenuto")
+        filenames[commessa] = filename
+
+    # Tipologie da saltare solo per la commessa 1501:
+    tipologie_skip = frozenset([(1501, "fase 1", "Interno")])
+    for filename in filenames.values():
+        read_full_budget_cached(
+            filename, tipologie_skip=tipologie_skip, cache_root=tmp_path / "cache"
+        )
+
+    # 1500 usa la lettura di 1434, 1501 ha le sue tipologie da saltare:
+    assert read_files == [filenames["1434"], filenames["1501"]]
+    flush_all_cache(tmp_path / "cache")
+
+
+def test_quarantine(tmp_path, monkeypatch):
+    broken_file = tmp_path / "2023" / "12_Dicembre" / "1434" / "Analisi.xlsx"
+    broken_file.parent.mkdir(parents=True)
+    broken_file.write_bytes(b"non e' un file excel")
+    args = {"filename": broken_file, "cache_root": tmp_path / "cache"}
+
+    with pytest.raises(Exception):
+        read_full_budget_cached(**args)
+
+    assert read_full_budget_cached(**args, quarantine=True) == (None, [])
+    (failure,) = pop_failures()
+    assert failure["file"] == str(broken_file) and not failure["da_cache"]
+    assert "Traceback" in failure["traceback"]
+
+    # Il file non viene riletto finche' non cambia:
+    monkeypatch.setattr(budget_reader, "_read_full_budget", None)
+    assert read_full_budget_cached(**args, quarantine=True) == (None, [])
+    (failure,) = pop_failures()
+    assert failure["da_cache"]
+
+    broken_file.write_bytes(b"ancora non un file excel")
+    read_full_budget_cached(**args, quarantine=True)
+    (failure,) = pop_failures()
+    assert not failure["da_cache"] and "NoneType" in failure["errore"]
+    flush_all_cache(tmp_path / "cache")
+
+
+def test_hash_manifest(tmp_path):
+    data_file = tmp_path / "Analisi.xlsx"
+    data_file.write_bytes(b"contenuto")
+    manifest = CacheManifest(tmp_path)
+    file_hash = manifest.get_file_hash(data_file)
+    assert file_hash == hash_file_content(data_file)
+
+    # Stesso contenuto riletto da disco:
+    manifest.save()
+    manifest = CacheManifest(tmp_path)
+    assert manifest.get_file_hash(data_file) == file_hash
+
+    # Contenuto cambiato senza cambiare dimensione e mtime: serve verify
+    stat = data_file.stat()
+    data_file.write_bytes(b"modificat")
+    os.utime(data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert manifest.get_file_hash(data_file) == file_hash
+    assert manifest.get_file_hash(data_file, verify=True) != file_hash
+
+    # Contenuto cambiato con mtime diverso:
+    data_file.write_bytes(b"altro contenuto")
+    assert manifest.get_file_hash(data_file) == hash_file_content(data_file)
+
+
+def _add_test_entry(manifest, entry_key, script_hash, cache_format="parquet"):
+    df = pd.DataFrame({"voce": ["operaio comune", "gru mobile"]})
+    cache_base = manifest.store_directory / f"{entry_key}_{script_hash}"
+    cache_format = write_cache_entry(cache_base, df, [], [], cache_format)
+    manifest.add_entry(entry_key, script_hash, cache_format)
+
+
+def test_manifest_entries(tmp_path):
+    manifest = CacheManifest(tmp_path)
+    _add_test_entry(manifest, "abc_def", "v1")
+    assert manifest.get_entry_format("abc_def", "v1") == "parquet"
+    assert manifest.get_entry_format("abc_def", "v2") is None
+
+    # Nulla viene scritto su disco fino al salvataggio:
+    assert not (tmp_path / "manifest.json").exists()
+    manifest.save()
+    assert CacheManifest(tmp_path).get_entry_format("abc_def", "v1") == "parquet"
+
+    # Una nuova versione del parser rende obsoleta la voce precedente:
+    old_entry = manifest.store_directory / "abc_def_v1.parquet"
+    assert old_entry.exists()
+    _add_test_entry(manifest, "abc_def", "v2", "pickle")
+    manifest.save()
+    assert not old_entry.exists()
+
+    # Le modifiche fatte da altri processi vengono unite a quelle su disco:
+    other_manifest = CacheManifest(tmp_path)
+    _add_test_entry(other_manifest, "ghi_def", "v2")
+    manifest.remove_entry("abc_def")
+    manifest.merge(other_manifest.pop_updates())
+    manifest.save()
+    saved = CacheManifest(tmp_path)
+    assert saved.get_entry_format("abc_def", "v2") is None
+    assert saved.get_entry_format("ghi_def", "v2") == "parquet"
+
+
+def test_collect_garbage(tmp_path):
+    manifest = get_cache_manifest(tmp_path)
+    for n, entry_key in enumerate(["vecchia", "media", "recente"]):
+        _add_test_entry(manifest, entry_key, "v1", "pickle")
+        manifest.entries[entry_key][3] = n
+    manifest.touch_entry("vecchia")  # ora e' la piu' recente
+
+    orphan = manifest.store_directory / "orfano.parquet"
+    orphan.write_bytes(b"orfano")
+    os.utime(orphan, (0, 0))
+
+    entry_size = manifest.entries["media"][2]
+    max_bytes = 2 * entry_size
+
+    report = collect_garbage(tmp_path, max_bytes=max_bytes, dry_run=True)
+    assert report["voce"].tolist() == ["orfano.parquet", "media"]
+    assert orphan.exists() and manifest.get_entry_format("media", "v1") == "pickle"
+
+    report = collect_garbage(tmp_path, max_bytes=max_bytes)
+    assert report["byte"].sum() == entry_size + len(b"orfano")
+    assert not orphan.exists()
+    assert manifest.get_entry_format("media", "v1") is None
+    assert manifest.get_entry_format("vecchia", "v1") == "pickle"
+    assert sorted(f.name for f in manifest.store_directory.iterdir()) == sorted(
+        f"{entry_key}_v1{suffix}"
+        for entry_key in ["recente", "vecchia"]
+        for suffix in [".pickle", "_consistency.pickle", "_log.txt"]
+    )
+
+    # Entro il limite non si cancella nulla:
+    assert len(collect_garbage(tmp_path, max_bytes=max_bytes)) == 0
+    flush_all_cache(tmp_path)
+
+
+def _write_entry_locked(cache_root, started):
+    with entry_lock(cache_root, "abc_def"):
+        started.set()
+        time.sleep(0.5)
+        df = pd.DataFrame({"voce": ["operaio comune"]})
+        write_cache_entry(cache_root / "abc_def_v1", df, [], [], "parquet")
+
+
+def test_entry_lock(tmp_path):
+    # Un processo sta scrivendo la voce, l'altro aspetta e la trova completa:
+    started = multiprocessing.Event()
+    process = multiprocessing.Process(
+        target=_write_entry_locked, args=(tmp_path, started)
+    )
+    process.start()
+    started.wait()
+    assert find_cache_entry(tmp_path / "abc_def_v1") is None
+    with entry_lock(tmp_path, "abc_def"):
+        assert find_cache_entry(tmp_path / "abc_def_v1") == "parquet"
+    process.join()
+
+
+def test_atomic_write(tmp_path):
+    filename = tmp_path / "voce.pickle"
+    filename.write_text("vecchio")
+    with pytest.raises(RuntimeError):
+        with atomic_write(filename) as temp_filename:
+            temp_filename.write_text("a meta'")
+            raise RuntimeError
+    assert filename.read_text() == "vecchio"
+    assert list(tmp_path.iterdir()) == [filename]
+
+    with atomic_write(filename) as temp_filename:
+        temp_filename.write_text("nuovo")
+    assert filename.read_text() == "nuovo"
+    assert list(tmp_path.iterdir()) == [filename]
+
+
+def test_set_hash():
+    assert get_set_hash(frozenset(["a", "b"])) == get_set_hash(frozenset(["b", "a"]))
+    assert get_set_hash(frozenset([np.int64(3), "a"])) == get_set_hash(
+        frozenset([3, "a"])
+    )
+    assert get_set_hash(frozenset(["3"])) != get_set_hash(frozenset([3]))
+
+    # Chiavi (commessa, fase, tipologia) di compile_tipologie_skip, con interi numpy
+    # o Python mescolati, in qualsiasi ordine di calcolo:
+    numpy_keys = frozenset([(np.int64(1434), "f", "t"), (1500, "f", "u")])
+    plain_keys = frozenset([(1434, "f", "t"), (np.int64(1500), "f", "u")])
+    string_keys = frozenset([("1434", "f", "t"), ("1500", "f", "u")])
+    assert get_set_hash(numpy_keys) == get_set_hash(plain_keys)
+    assert get_set_hash(string_keys) != get_set_hash(numpy_keys)
+    assert get_set_hash(plain_keys) == get_set_hash(numpy_keys)
+
+
+def test_hash_cache_lru():
+    hash_cache = HashCache(maxsize=2)
+    hash_cache.put("a", "hash_a")
+    hash_cache.put("b", "hash_b")
+    assert hash_cache.get("a") == "hash_a"
+
+    # "b" e' il meno usato di recente e viene scartato:
+    hash_cache.put("c", "hash_c")
+    assert hash_cache.get("b") is None
+    assert hash_cache.get("c") == "hash_c"
+
+    assert len(hash_cache) == 2
+    assert (hash_cache.hits, hash_cache.misses) == (2, 1)
+
+
+def test_folder_hash_changes_with_files(tmp_path):
+    folder = tmp_path / "1434"
+    folder.mkdir()
+    data_file = folder / "Analisi.xlsx"
+    data_file.write_bytes(b"contenuto")
+    cache_root = tmp_path / "cache"
+    folder_hash = get_folder_hash(folder, cache_root=cache_root)
+    assert get_folder_hash(folder, cache_root=cache_root) == folder_hash
+
+    data_file.write_bytes(b"contenuto modificato")
+    assert get_folder_hash(folder, cache_root=cache_root) != folder_hash
+
+    # Gli hash dei file sono nel manifest della cache data:
+    assert get_cache_manifest(cache_root).misses == 2
+
+
+@pytest.mark.parametrize("cache_format", ["parquet", "pickle"])
+def test_cache_entry_roundtrip(tmp_path, cache_format):
+    df = pd.DataFrame(
+        {
+            "codice": pd.Series([101, 102], dtype=object),
+            "voce": ["operaio comune", "gru mobile"],
+            "quantita": [1.5, 2.0],
+        }
+    )
+    consistency_report = pd.Series(
+        [{"gru", "gru mobile"}], index=pd.Index([102], name="codice")
+    )
+    log_messages = ["primo messaggio", "secondo messaggio"]
+
+    saved_format = write_cache_entry(
+        tmp_path / "entry", df, consistency_report, log_messages, cache_format
+    )
+    assert saved_format == cache_format
+
+    loaded_df, loaded_report, loaded_log = read_cache_entry(
+        tmp_path / "entry", saved_format
+    )
+    pd.testing.assert_frame_equal(loaded_df, df)
+    pd.testing.assert_series_equal(loaded_report, consistency_report)
+    assert loaded_log == log_messages
+
+    loaded_df, _, _ = read_cache_entry(
+        tmp_path / "entry", saved_format, columns=["voce"]
+    )
+    pd.testing.assert_frame_equal(loaded_df, df[["voce"]])
+
+
+def test_cache_entry_pickle_fallback(tmp_path):
+    # Colonna con tipi misti, non convertibile in parquet:
+    df = pd.DataFrame({"codice": pd.Series([101, "102a"], dtype=object)})
+    saved_format = write_cache_entry(tmp_path / "entry", df, [], [], "parquet")
+    assert saved_format == "pickle"
+
+    loaded_df, loaded_report, loaded_log = read_cache_entry(
+        tmp_path / "entry", "pickle"
+    )
+    pd.testing.assert_frame_equal(loaded_df, df)
+    assert loaded_report == [] and loaded_log == []
@@ -1,9 +1,26 @@
 from datetime import datetime
 from unittest.mock import patch
 
+import pandas as pd
 import pytest
 
-from pyconsolida.delta import get_multiple_date_intervals, input_data
+from pyconsolida import aggregations
+from pyconsolida.aggregations import load_loop_and_concat
+from pyconsolida.delta import (
+    get_interval_folders,
+    get_multiple_date_intervals,
+    get_tabellone_delta,
+    input_data,
+)
+from pyconsolida.folder_read_utils import data_from_commessa_folder
+from pyconsolida.sheet_specs import KEY_SEQUENCE
+
+MONTH_NAMES = {
+    11: "11_Novembre",
+    12: "12_Dicembre",
+    1: "01_Gennaio",
+    2: "02_Febbraio",
+}
 
 
 def test_get_multiple_date_intervals_debug_mode():
@@ -76,3 +93,103 @@ def test_input_data_invalid_format(mock_input):
     mock_input.return_value = "invalid"
     with pytest.raises(ValueError):
         input_data("test")
+
+
+def _make_folders(tmp_path, months):
+    folders = []
+    for anno, mese, commessa in months:
+        folder = tmp_path / str(anno) / MONTH_NAMES[mese] / commessa
+        folder.mkdir(parents=True)
+        folders.append(folder)
+    return folders
+
+
+def test_get_interval_folders(tmp_path):
+    folders = _make_folders(
+        tmp_path,
+        [
+            (2023, 11, "1434"),
+            (2023, 12, "1434"),
+            (2024, 1, "1434"),
+            (2024, 2, "1434"),
+            (2024, 1, "1500"),
+            (2024, 2, "1500"),
+        ],
+    )
+    intervals = [(datetime(2023, 12, 1), datetime(2024, 2, 1))]
+
+    # Mese di inizio (se c'e') e ultimo mese di ogni commessa:
+    assert get_interval_folders(folders, intervals) == [
+        folders[1],
+        folders[3],
+        folders[5],
+    ]
+
+    # Se l'ultimo mese e' risultato vuoto, si aggiunge il precedente:
+    assert get_interval_folders(folders, intervals, empty_folders=[folders[3]]) == [
+        folders[1],
+        folders[2],
+        folders[3],
+        folders[5],
+    ]
+
+
+def _voci(folder):
+    data = data_from_commessa_folder(folder)
+    quantita = float(data.month)
+    return pd.DataFrame(
+        {
+            "commessa": [folder.name],
+            "fase": ["fase 1"],
+            "anno": [data.year],
+            "mese": [data.month],
+            "data": [f"{data.year}-{data.month:02d}"],
+            "mesi-da-inizio": [0],
+            "codice": [101],
+            "tipologia": ["Materiali"],
+            "voce": ["sabbia"],
+            "costo u.": [10.0],
+            "u.m.": ["mc"],
+            "quantita": [quantita],
+            "imp. unit.": [10.0],
+            "imp.comp.": [10.0 * quantita],
+            "file-hash": [str(data)],
+        }
+    )[KEY_SEQUENCE]
+
+
+def test_interval_folders_empty_last_month(tmp_path, monkeypatch):
+    # L'ultimo mese non ha voci valide (es. file in quarantena): il delta deve finire
+    # al mese precedente, come leggendo tutte le cartelle.
+    folders = _make_folders(
+        tmp_path,
+        [(2023, 11, "1434"), (2023, 12, "1434"), (2024, 1, "1434"), (2024, 2, "1434")],
+    )
+    read_folders = []
+
+    def fake_read(folder, commessa_months, **kwargs):
+        read_folders.append(folder)
+        if folder == folders[3]:
+            return None, None
+        return _voci(folder), None
+
+    monkeypatch.setattr(aggregations, "read_all_valid_budgets", fake_read)
+    args = dict(cache=False, progress_bar=False, folder_files={f: [] for f in folders})
+    t_start, t_stop = datetime(2023, 12, 1), datetime(2024, 2, 1)
+
+    full, _ = load_loop_and_concat(folders, **args)
+    read_folders.clear()
+    partial, _ = load_loop_and_concat(
+        folders, date_intervals=[(t_start, t_stop)], **args
+    )
+
+    # Inizio e fine, poi il mese precedente alla fine vuota:
+    assert read_folders == [folders[1], folders[3], folders[2]]
+    full_delta = get_tabellone_delta(full, t_start, t_stop)
+    # (i dizionari delle colonne categoriche dipendono dalle cartelle lette):
+    pd.testing.assert_frame_equal(
+        get_tabellone_delta(partial, t_start, t_stop),
+        full_delta,
+        check_categorical=False,
+    )
+    assert full_delta["DELTA: quantita"].tolist() == [1.0 - 12.0]
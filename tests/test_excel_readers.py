@@ -0,0 +1,69 @@
+import warnings
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from pyconsolida.aggregations import find_all_files
+from pyconsolida.budget_reader import _read_raw_budget_sheet
+from pyconsolida.excel_readers import (
+    ENGINES_MODULES,
+    ENGINES_PRIORITY,
+    get_engine,
+    read_budget_sheets,
+    stream_budget_sheets,
+)
+from pyconsolida.sheet_specs import EXCLUDED_FASI, N_COLONNE
+
+
+def test_stream_budget_sheets(tmp_path):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "fase"
+    sheet.append(["intestazione"])
+    sheet.append(["COSTI"])
+    sheet.append([1, "voce", "h", 1.5, 2, 3, 4, 5, "oltre N_COLONNE"])
+    sheet.append(["Totale costi", None, None, None, 10])
+    sheet.append([2, "dopo i totali"])
+    workbook.create_sheet(EXCLUDED_FASI[0]).append(["COSTI"])
+    workbook.save(tmp_path / "analisi.xlsx")
+
+    sheets = dict(stream_budget_sheets(tmp_path / "analisi.xlsx"))
+
+    assert list(sheets.keys()) == ["fase"]
+    df = sheets["fase"]
+    assert df.shape == (3, N_COLONNE)
+    assert df.iloc[-1, 0] == "Totale costi"
+    assert df.iloc[1, 3] == 1.5
+
+
+def test_get_engine(tmp_path):
+    engine = get_engine(tmp_path / "analisi.xlsx")
+    assert engine in ENGINES_PRIORITY[".xlsx"]
+
+    with pytest.raises(ValueError):
+        get_engine(tmp_path / "analisi.csv")
+
+
+@pytest.mark.parametrize("engine", ["calamine", "openpyxl", "xlrd"])
+def test_engines_match_read_excel(temp_source_data, engine):
+    pytest.importorskip(ENGINES_MODULES[engine])
+
+    for folder in sorted(temp_source_data.glob("202[1-9]/*/*")):
+        for filename in find_all_files(folder):
+            if engine not in ENGINES_PRIORITY[filename.suffix.lower()]:
+                continue
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                expected_sheets = pd.read_excel(filename, sheet_name=None)
+
+            for fase, df in read_budget_sheets(filename, engine=engine):
+                expected = _read_raw_budget_sheet(
+                    expected_sheets[fase], folder.name, fase
+                )
+                result = _read_raw_budget_sheet(df, folder.name, fase)
+                if expected is None:
+                    assert result is None
+                else:
+                    pd.testing.assert_frame_equal(result, expected)
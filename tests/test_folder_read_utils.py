@@ -0,0 +1,95 @@
+import os
+from datetime import datetime
+
+from pyconsolida.aggregations import find_all_files
+from pyconsolida.folder_read_utils import FolderCatalogue, get_commessa_months
+from pyconsolida.sheet_specs import PATTERNS, SUFFIXES
+
+
+def _glob_folders(directory):
+    # Ricerca delle cartelle fatta in precedenza in process_tabellone:
+    all_folders = list(directory.glob("202[1-9]/[0-1][0-9]_*/*"))
+    all_folders += list(directory.glob("202[1-9]/*_[0-1][0-9]*/[0-9][0-9][0-9][0-9]*"))
+    return sorted([f for f in all_folders if f.is_dir()])
+
+
+def _glob_files(folder):
+    return [
+        file
+        for pattern in PATTERNS
+        for suffix in SUFFIXES
+        for file in folder.glob(pattern + suffix)
+    ]
+
+
+def _make_tree(directory):
+    for folder, files in {
+        "2023/11_Novembre/1434": ["Analisi.xlsx", "ANALISI VECCHIA.xls", "note.pdf"],
+        "2023/12_Dicembre/1434": ["analisi RO-RO.xlsm", "Analisi.xlsx"],
+        "2023/12_Dicembre/1501": ["SPE_GENE.xlsx"],
+        "2023/12_Dicembre/vuota": [],
+        "2023/Archivio/1434": ["Analisi.xlsx"],
+        "2019/01_Gennaio/1434": ["Analisi.xlsx"],
+    }.items():
+        (directory / folder).mkdir(parents=True)
+        for file in files:
+            (directory / folder / file).write_bytes(b"")
+    (directory / "2023" / "12_Dicembre" / "file.txt").write_bytes(b"")
+
+
+def test_catalogue_matches_glob(tmp_path):
+    directory = tmp_path / "Cantieri"
+    _make_tree(directory)
+
+    folders = FolderCatalogue(directory).refresh()
+
+    assert [folder.path for folder in folders] == _glob_folders(directory)
+    for folder in folders:
+        assert list(folder.files) == _glob_files(folder.path)
+        assert find_all_files(folder.path) == _glob_files(folder.path)
+    assert folders[0].commessa == "1434"
+    assert folders[0].data == datetime(2023, 11, 1)
+
+
+def test_catalogue_incremental(tmp_path):
+    directory = tmp_path / "Cantieri"
+    _make_tree(directory)
+    catalogue_file = tmp_path / "cache" / "catalogo.json"
+
+    catalogue = FolderCatalogue(directory, filename=catalogue_file)
+    catalogue.refresh()
+    catalogue.save()
+    n_folders = catalogue.n_listed
+    # Scritto in modo atomico, senza lasciare file temporanei:
+    assert list(catalogue_file.parent.iterdir()) == [catalogue_file]
+
+    # Senza modifiche non si rielenca nessuna cartella:
+    catalogue = FolderCatalogue(directory, filename=catalogue_file)
+    folders = catalogue.refresh()
+    assert catalogue.n_listed == 0
+    assert [folder.path for folder in folders] == _glob_folders(directory)
+
+    # Nuovo file: si rielenca solo la sua cartella:
+    new_file = directory / "2023" / "12_Dicembre" / "1501" / "Analisi.xlsx"
+    new_file.write_bytes(b"")
+    stat = new_file.parent.stat()
+    os.utime(new_file.parent, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    catalogue.refresh()
+    assert catalogue.n_listed == 1
+    assert new_file in catalogue.get_folder_files()[new_file.parent]
+
+    catalogue.refresh(full=True)
+    assert catalogue.n_listed == n_folders
+
+
+def test_commessa_months(tmp_path):
+    directory = tmp_path / "Cantieri"
+    _make_tree(directory)
+    commessa_months = get_commessa_months(_glob_folders(directory))
+
+    assert commessa_months["1434"] == [datetime(2023, 11, 1), datetime(2023, 12, 1)]
+    assert commessa_months["1501"] == [datetime(2023, 12, 1)]
+
+    # Dalle voci del catalogo, con le date gia' lette:
+    catalogue = FolderCatalogue(directory)
+    assert get_commessa_months(catalogue.refresh()) == commessa_months
@@ -19,6 +19,19 @@ def test_main(temp_source_data, expected_exports_folder):
     assert_directory_exports_equal(dest_dir, expected_exports_folder)
 
 
+def test_main_parallel(temp_source_data, expected_exports_folder):
+    # Parallel reading must give the same exports as the sequential one
+    dest_dir = process_tabellone(
+        directory=temp_source_data,
+        output_dir=None,
+        progress_bar=False,
+        debug_mode=True,
+        workers=2,
+    )
+
+    assert_directory_exports_equal(dest_dir, expected_exports_folder)
+
+
 if __name__ == "__main__":
     assert_directory_exports_equal(
         "/Users/vigji/Desktop/Cantieri_test/exports/expected_export",
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyconsolida.posthoc_fix_utils import (
+    _isinlist,
+    format_check,
+    format_to_check,
+    isinlist,
+)
+from pyconsolida.rule_engine import (
+    MATCHES_FILENAME,
+    AhoCorasick,
+    MatchesMemo,
+    TipologieRules,
+    get_rules_hash,
+)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_aho_corasick(seed):
+    rng = np.random.default_rng(seed)
+    alphabet = list("abc ")
+    patterns = ["", "a", "ab", "bab", "abc", "c c", "cc", "aaa"]
+    automaton = AhoCorasick(patterns)
+
+    for _ in range(200):
+        text = "".join(rng.choice(alphabet, rng.integers(0, 12)))
+        expected = {i for i, pattern in enumerate(patterns) if pattern in text}
+        assert automaton.find(text) == expected
+
+
+def test_rules_match_numba():
+    tipologie_fix = pd.DataFrame(
+        {
+            "da": ["Noli", "Materiali", "Materiali", "Personale", "Noli"],
+            "a": ["Noli speciali", "Inerti", "Inerti", "Tecnici", "Noli"],
+            "se contiene": ["escavatore", "sabbia", "ghiaia", "geometra", "gru"],
+            "e non contiene": ["mini;micro", np.nan, "lavata", np.nan, "a;"],
+        }
+    )
+    voci = pd.DataFrame(
+        {
+            "voce": [
+                "Escavatore cingolato",
+                "Mini escavatore",
+                "escavatore MICRO",
+                "Sabbia fine",
+                "Ghiaia lavata",
+                "ghiaia",
+                "Geometra di cantiere",
+                "sabbia",
+                np.nan,
+                "gru",
+            ],
+            "tipologia": [
+                "Noli",
+                "Noli",
+                "Noli",
+                "Materiali",
+                "Materiali",
+                "Materiali",
+                "Personale",
+                "Noli",
+                "Materiali",
+                "Noli",
+            ],
+        }
+    )
+
+    expected = _isinlist(
+        format_to_check(voci["voce"]),
+        format_to_check(voci["tipologia"]),
+        format_check(tipologie_fix["se contiene"]),
+        format_check(tipologie_fix["e non contiene"]),
+        format_check(tipologie_fix["da"]),
+    )
+    result = isinlist(voci, tipologie_fix)
+
+    np.testing.assert_array_equal(result, expected)
+    assert result[[0, 3, 5, 6]].any(axis=1).all()
+    assert not result[[1, 2, 4, 7, 8, 9]].any()
+
+
+def test_matches_memo(tmp_path):
+    tipologie_fix = pd.DataFrame(
+        {
+            "da": ["Materiali", "Noli"],
+            "a": ["Inerti", "Noli speciali"],
+            "se contiene": ["sabbia", "gru"],
+            "e non contiene": ["fine", np.nan],
+        }
+    )
+    voci = pd.DataFrame(
+        {
+            "voce": ["Sabbia", "sabbia fine", "Gru", np.nan] * 3,
+            "tipologia": ["Materiali", "Materiali", "Noli", "Noli"] * 3,
+        }
+    )
+    matches_filename = tmp_path / "cache" / MATCHES_FILENAME
+    expected = isinlist(voci, tipologie_fix)
+
+    # Stessi match salvando le coppie voce/tipologia nella cache:
+    result = isinlist(voci, tipologie_fix, matches_filename=matches_filename)
+    np.testing.assert_array_equal(result, expected)
+    assert expected[[0, 4, 8], 0].all() and expected[[2, 6, 10], 1].all()
+    assert expected.sum() == 6
+    # Salvati in modo atomico, senza lasciare file temporanei:
+    assert list(matches_filename.parent.iterdir()) == [matches_filename]
+
+    # Nelle esecuzioni seguenti si confrontano solo le coppie mai viste:
+    check, exclude, tipologie = (
+        format_check(tipologie_fix[key])
+        for key in ["se contiene", "e non contiene", "da"]
+    )
+    rules = TipologieRules(check, exclude, tipologie)
+    rules_hash = get_rules_hash(check, exclude, tipologie)
+    memo = MatchesMemo(rules, rules_hash, filename=matches_filename)
+    np.testing.assert_array_equal(
+        memo.match(["sabbia", "gru"], ["materiali"] * 2),
+        [[True, False], [False, False]],
+    )
+    assert memo.n_new == 1
+
+    # Con regole diverse i match salvati non valgono piu':
+    memo = MatchesMemo(rules, "altre regole", filename=matches_filename)
+    memo.match(["sabbia"], ["materiali"])
+    assert memo.n_new == 1
@@ -0,0 +1,129 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from pyconsolida.delta import get_tabellone_delta
+from pyconsolida.posthoc_fix_utils import fix_tipologie_df
+from pyconsolida.schema import (
+    TABELLONE_DTYPES,
+    concat_compact,
+    memory_footprint,
+    plain_memory_footprint,
+    to_compact_dtypes,
+    to_plain_dtypes,
+)
+from pyconsolida.sheet_specs import KEY_SEQUENCE
+
+
+def _tabellone(commessa, data, codici, voci, tipologia="Materiali"):
+    anno, mese = (int(x) for x in data.split("-"))
+    n = len(codici)
+    return pd.DataFrame(
+        {
+            "commessa": [commessa] * n,
+            "fase": ["fase 1"] * n,
+            "anno": anno,
+            "mese": mese,
+            "data": [data] * n,
+            "mesi-da-inizio": 0,
+            "codice": codici,
+            "tipologia": [tipologia] * n,
+            "voce": voci,
+            "costo u.": 1.5,
+            "u.m.": ["m"] * n,
+            "quantita": np.arange(1, n + 1, dtype=float),
+            "imp. unit.": 2.0,
+            "imp.comp.": np.arange(1, n + 1, dtype=float) * 2,
+            "file-hash": [f"hash-{data}"] * n,
+        }
+    )[KEY_SEQUENCE]
+
+
+def _plain(df):
+    return df.astype(
+        {
+            column: str if isinstance(dtype, pd.PeriodDtype) else object
+            for column, dtype in df.dtypes.items()
+            if isinstance(dtype, (pd.CategoricalDtype, pd.PeriodDtype))
+        }
+    )
+
+
+def test_to_compact_dtypes():
+    plain = _tabellone("1434", "2023-12", [101, 102, 101], ["gru", "sabbia", "gru"])
+    compact = to_compact_dtypes(plain)
+
+    assert {c: str(d) for c, d in compact.dtypes.items()} == TABELLONE_DTYPES
+    pd.testing.assert_frame_equal(_plain(compact), plain, check_dtype=False)
+    assert plain_memory_footprint(compact) == memory_footprint(plain)
+    assert memory_footprint(compact) < memory_footprint(plain)
+
+    # Interi che non stanno nel tipo compatto restano a 64 bit:
+    compact = to_compact_dtypes(plain.assign(codice=[101, 2**40, 102]))
+    assert compact["codice"].dtype == np.int64
+
+
+def test_to_plain_dtypes():
+    plain = _tabellone("1434", "2023-12", [101, 102, 101], ["gru", np.nan, "gru"])
+    plain.loc[2, "data"] = np.nan
+
+    # Il tabellone esportato ha gli stessi tipi di prima dello schema compatto:
+    pd.testing.assert_frame_equal(to_plain_dtypes(to_compact_dtypes(plain)), plain)
+
+
+def test_concat_compact():
+    frames = [
+        to_compact_dtypes(_tabellone("1434", "2023-12", [101], ["sabbia"])),
+        to_compact_dtypes(_tabellone("1501", "2024-01", [102, 103], ["gru", "cls"])),
+    ]
+    tabellone = concat_compact(frames)
+
+    # Un unico dizionario, ordinato, per tutte le parti:
+    assert tabellone["voce"].cat.categories.tolist() == ["cls", "gru", "sabbia"]
+    assert tabellone["data"].dtype == "period[M]"
+    pd.testing.assert_frame_equal(
+        _plain(tabellone),
+        pd.concat([_plain(frame) for frame in frames], ignore_index=True),
+    )
+
+
+def test_delta_compact():
+    plain = pd.concat(
+        [
+            _tabellone("1434", "2023-12", [101, 102], ["gru", "sabbia"]),
+            _tabellone("1434", "2024-01", [101, 103], ["gru", "cls"]),
+            _tabellone("1501", "2024-01", [104], ["ferro"]),
+            _tabellone("1501", "2024-02", [104, 104], ["ferro", "ferro"]),
+        ],
+        ignore_index=True,
+    )
+    compact = concat_compact([plain])
+
+    expected = get_tabellone_delta(
+        plain.copy(), datetime(2023, 12, 1), datetime(2024, 2, 1)
+    )
+    result = get_tabellone_delta(compact, datetime(2023, 12, 1), datetime(2024, 2, 1))
+
+    pd.testing.assert_frame_equal(_plain(result), expected, check_dtype=False)
+    # Il tabellone non viene modificato:
+    assert compact["data"].dtype == "period[M]"
+
+
+def test_fix_tipologie_compact():
+    tabellone = concat_compact(
+        [_tabellone("1434", "2023-12", [101, 102], ["gru mobile", "sabbia"])]
+    )
+    tipologie_fix = pd.DataFrame(
+        {
+            "se contiene": ["gru"],
+            "e non contiene": [np.nan],
+            "da": ["Materiali"],
+            "a": ["Noli"],
+        }
+    )
+
+    fix_tipologie_df(tabellone, tipologie_fix)
+
+    assert isinstance(tabellone["tipologia"].dtype, pd.CategoricalDtype)
+    assert tabellone["tipologia"].tolist() == ["Noli", "Materiali"]
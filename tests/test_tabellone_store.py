@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from pyconsolida import aggregations
+from pyconsolida.aggregations import load_loop_and_concat
+from pyconsolida.schema import to_compact_dtypes
+from pyconsolida.sheet_specs import KEY_SEQUENCE
+from pyconsolida.tabellone_store import TabelloneStore
+
+
+def _voci(codici, commessa):
+    return pd.DataFrame(
+        {
+            "codice": pd.Series(codici, dtype=object),
+            "voce": ["voce"] * len(codici),
+            "u.m.": [np.nan] * len(codici),
+            "commessa": commessa,
+            "anno": 2023,
+        }
+    )
+
+
+def test_store_upsert_and_read(tmp_path):
+    folders = [
+        tmp_path / "2023" / f"{m}" / "1434" for m in ["11_Novembre", "12_Dicembre"]
+    ]
+    voci = [_voci([101, 102], "1434"), _voci([103], "1434")]
+    reports = pd.DataFrame(
+        {0: [{"gru", "gru mobile"}], "commessa": ["1434"], "mese": [12]}
+    )
+
+    with TabelloneStore(tmp_path / "tabellone.sqlite") as store:
+        store.upsert(folders[0], "a", "1434", 2023, 11, "h0", {"voci": voci[0]})
+        store.upsert(
+            folders[1],
+            "b",
+            "1434",
+            2023,
+            12,
+            "h1",
+            {"voci": voci[1], "reports": reports},
+        )
+        store.commit()
+
+    with TabelloneStore(tmp_path / "tabellone.sqlite") as store:
+        assert store.get_keys() == {
+            "2023/11_Novembre/1434": "a",
+            "2023/12_Dicembre/1434": "b",
+        }
+
+        # Righe nell'ordine delle cartelle richieste:
+        tables = store.read(folders[::-1])
+        expected = pd.concat(voci[::-1], ignore_index=True)
+        pd.testing.assert_frame_equal(tables["voci"], expected)
+        pd.testing.assert_frame_equal(tables["reports"], reports)
+
+        # Aggiornamento di una cartella:
+        store.upsert(folders[0], "c", "1434", 2023, 11, "h2", {"voci": voci[1]})
+        tables = store.read(folders[:1])
+        pd.testing.assert_frame_equal(tables["voci"], voci[1])
+        assert store.get_keys()["2023/11_Novembre/1434"] == "c"
+
+
+def test_store_compact_dtypes(tmp_path):
+    folder = tmp_path / "2023" / "12_Dicembre" / "1434"
+    voci = to_compact_dtypes(
+        _voci([101, 102], "1434").assign(
+            data="2023-12",
+            mese=12,
+            tipologia=["Noli", np.nan],
+            **{"u.m.": ["m", np.nan]},
+        )
+    )
+
+    with TabelloneStore(tmp_path / "tabellone.sqlite") as store:
+        store.upsert(folder, "a", "1434", 2023, 12, "h0", {"voci": voci})
+        store.commit()
+        tables = store.read([folder])
+
+    pd.testing.assert_frame_equal(tables["voci"], voci)
+
+
+def test_store_all_folders_empty(tmp_path, monkeypatch):
+    # Tutte le cartelle senza voci (vuote o in quarantena): l'archivio non ha
+    # colonne per le voci, e il tabellone deve risultare vuoto.
+    folders = [tmp_path / "2023" / m / "1434" for m in ["11_Novembre", "12_Dicembre"]]
+    for folder in folders:
+        folder.mkdir(parents=True)
+    monkeypatch.setattr(
+        aggregations, "read_all_valid_budgets", lambda folder, *a, **k: (None, None)
+    )
+    tipologie_fix = pd.DataFrame(
+        {
+            "da": ["Noli"],
+            "a": ["Noli speciali"],
+            "se contiene": ["gru"],
+            "e non contiene": [np.nan],
+        }
+    )
+    args = dict(
+        store=True,
+        cache=True,
+        cache_root=tmp_path / "cache",
+        progress_bar=False,
+        folder_files={folder: [] for folder in folders},
+        tipologie_fix=tipologie_fix,
+    )
+
+    # Alla seconda esecuzione le cartelle si leggono dall'archivio:
+    for _ in range(2):
+        budgets, reports = load_loop_and_concat(folders, **args)
+        assert list(budgets.columns) == KEY_SEQUENCE
+        assert len(budgets) == 0
+        assert len(reports) == 0